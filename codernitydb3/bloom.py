@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Nick M. (https://github.com/nickmasster)
+# Copyright 2011-2013 Codernity (http://codernity.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Bloom filters that let indexes answer for missing keys without disk access"""
+
+import os
+import io
+import math
+import struct
+from hashlib import blake2b
+
+from codernitydb3.misc import key_bytes
+
+#: bloom file header, clean close flag, number of hash functions, number of bits
+header_struct = struct.Struct('<cBQ')
+
+CLEAN = b'c'
+DIRTY = b'd'
+
+
+class BloomFilter(object):
+    """
+    Set of keys that can answer *surely not there* or *maybe there*.
+
+    :param bits: size of the filter in bits
+    :param hashes: number of bits set for every key
+    """
+    def __init__(self, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray((bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, error=0.01):
+        """
+        Creates filter sized for ``capacity`` keys with ``error`` false
+        positive rate
+        """
+        capacity = max(capacity, 1)
+        bits = int(math.ceil(-capacity * math.log(error) / math.log(2)**2))
+        hashes = max(1, int(round(bits / float(capacity) * math.log(2))))
+        return cls(bits, hashes)
+
+    def _positions(self, key):
+        digest = blake2b(key_bytes(key), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        data = self.data
+        for position in self._positions(key):
+            data[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        data = self.data
+        for position in self._positions(key):
+            if not data[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def save(self, path):
+        """
+        Writes the filter to ``path``, marked as closed cleanly
+        """
+        with io.open(path, 'wb') as f:
+            f.write(header_struct.pack(CLEAN, self.hashes, self.bits))
+            f.write(self.data)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads filter saved in ``path`` and marks the file as in use, so
+        after a crash the filter is not trusted (it misses keys added
+        since it was loaded).
+
+        :returns: the filter or ``None`` when it's missing or was not closed cleanly
+        """
+        try:
+            f = io.open(path, 'r+b')
+        except (IOError, OSError):
+            return None
+        with f:
+            header = f.read(header_struct.size)
+            if len(header) < header_struct.size:
+                return None
+            flag, hashes, bits = header_struct.unpack(header)
+            if flag != CLEAN:
+                return None
+            bloom = cls(bits, hashes)
+            if f.readinto(bloom.data) != len(bloom.data):
+                return None
+            f.seek(0)
+            f.write(DIRTY)
+            f.flush()
+            os.fsync(f.fileno())
+        return bloom
@@ -20,17 +20,23 @@ import io
 import warnings
 import textwrap
 from inspect import getsource, getfullargspec
+from itertools import islice
 from random import randrange
+from threading import Thread, Event
 
 # for custom indexes
-from codernitydb3.storage import Storage, IU_Storage
-from codernitydb3.hash_index import (IU_UniqueHashIndex, IU_HashIndex,
-                                     HashIndex, UniqueHashIndex)
+from codernitydb3.storage import Storage, IU_Storage, BlobStore
+from codernitydb3.hash_index import (
+    IU_UniqueHashIndex, IU_HashIndex, HashIndex, UniqueHashIndex,
+    IU_LinearHashIndex, IU_UniqueLinearHashIndex, LinearHashIndex,
+    UniqueLinearHashIndex, IU_PagedHashIndex, IU_UniquePagedHashIndex,
+    PagedHashIndex, UniquePagedHashIndex)
 # normal imports
 
 from codernitydb3.index import (ElemNotFound, DocIdNotFound, IndexException,
                                 Index, TryReindexException, ReindexException,
                                 IndexNotFoundException, IndexConflict)
+from codernitydb3.sharded_index import ShardedIndex
 from codernitydb3.indexcreator import Parser
 
 from codernitydb3.misc import NONE
@@ -106,6 +112,41 @@ class DatabaseIsNotOpened(PreconditionsException):
     pass
 
 
+class _IntervalSync(Thread):
+    """
+    Thread that syncs database files with disk every ``interval`` seconds,
+    when something was written since the last sync
+    """
+    def __init__(self, db, interval):
+        super(_IntervalSync, self).__init__(name='IntervalSync')
+        self.daemon = True
+        self.db = db
+        self.interval = interval
+        self.dirty = False
+        self._stop_event = Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sync()
+
+    def sync(self):
+        if not self.dirty:
+            return
+        # cleared before sync, so writes done during it are synced next time
+        self.dirty = False
+        for index in list(self.db.indexes):
+            try:
+                index._fsync_files()
+            except (ValueError, OSError):
+                # index files reopened (compaction, reindex), try again later
+                self.dirty = True
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.sync()
+
+
 class Database:
     """
     A default single thread database object.
@@ -113,6 +154,10 @@ class Database:
 
     custom_header = ""  # : use it for imports required by your database
 
+    storage_batch = 128  # : how many records get_many / all read from index and storage at once, errors of single records are raised when they are yielded
+
+    durability = 'os'  # : when data is synced with disk, check :py:meth:`set_durability`
+
     def __init__(self, path):
         self.path = path
         self.storage = None
@@ -120,6 +165,8 @@ class Database:
         self.id_ind = None
         self.indexes_names = {}
         self.opened = False
+        self._syncer = None
+        self.blobs = None
 
     def create_new_rev(self, old_rev=None):
         """
@@ -145,6 +192,53 @@ class Database:
         if not self.opened:
             raise DatabaseIsNotOpened("Database is not opened")
 
+    def set_durability(self, mode):
+        """
+        Sets when written data is synced with disk (``fsync``):
+
+        * ``'os'`` - never, the kernel writes it when it wants (default)
+        * ``'always'`` - after every insert, update and delete,
+          before it returns
+        * number of milliseconds - a background thread syncs indexes
+          that many milliseconds after they were written. Writes don't
+          wait for disk, but those from the last interval may be lost
+          on power failure.
+
+        Pending writes of :py:class:`codernitydb3.storage.BufferedStorage`
+        are synced once they are committed.
+
+        :param mode: ``'os'``, ``'always'`` or interval in milliseconds
+        """
+        if mode not in ('os', 'always'):
+            if isinstance(mode,
+                          bool) or not isinstance(mode,
+                                                  (int, float)) or mode <= 0:
+                raise PreconditionsException("Invalid durability mode: %r" %
+                                             (mode, ))
+        self._stop_syncer()
+        self.durability = mode
+        if self.opened:
+            self._start_syncer()
+
+    def _start_syncer(self):
+        if self.durability not in ('os', 'always'):
+            self._syncer = _IntervalSync(self, self.durability / 1000.0)
+            self._syncer.start()
+
+    def _stop_syncer(self):
+        if self._syncer is not None:
+            self._syncer.stop()
+            self._syncer = None
+
+    def _written(self):
+        """
+        Called after every data modification, applies durability mode
+        """
+        if self.durability == 'always':
+            self.fsync()
+        elif self._syncer is not None:
+            self._syncer.dirty = True
+
     def set_indexes(self, indexes=None):
         """
         Set indexes using ``indexes`` param
@@ -454,6 +548,7 @@ class Database:
             # when opening / initializing DB without `id` index
             # happens mostly on server side
             pass
+        self.blobs = BlobStore(os.path.join(self.path, '_blobs'))
 
     def initialize(self, path=None, makedir=True):
         """
@@ -545,6 +640,7 @@ for ID index. You should update that index \
         self.__set_main_storage()
         self.__compat_things()
         self.opened = True
+        self._start_syncer()
         return self.path
 
     def exists(self, path=None):
@@ -590,6 +686,7 @@ for ID index. You should update that index \
         self.__set_main_storage()
         self.__compat_things()
         self.opened = True
+        self._start_syncer()
         return True
 
     def close(self):
@@ -598,9 +695,11 @@ for ID index. You should update that index \
         """
         if not self.opened:
             raise DatabaseConflict("Not opened")
+        self._stop_syncer()
         self.id_ind = None
         self.indexes_names = {}
         self.storage = None
+        self.blobs = None
         for index in self.indexes:
             index.close_index()
         self.indexes = []
@@ -701,21 +800,30 @@ you should check index code.""" % (index.name, ex), RuntimeWarning)
             self._single_update_index(index, data, db_data, _id)
         return _id, new_rev
 
-    def _single_insert_index(self, index, data, doc_id):
+    def _make_key_value(self, index, data):
         """
-        Performs insert operation on single index
+        Calls ``make_key_value`` of the index, errors of index code are
+        reported as warnings
 
-        :param index: index to perform operation
-        :param data: new data
-        :param doc_id: document id
+        :returns: ``(key, value)`` or ``None`` when data isn't indexed
         """
         try:
-            should_index = index.make_key_value(data)
+            return index.make_key_value(data)
         except Exception as ex:
             warnings.warn(
                 """Problem during insert for `%s`, ex = `%r`, \
 you should check index code.""" % (index.name, ex), RuntimeWarning)
-            should_index = None
+            return None
+
+    def _single_insert_index(self, index, data, doc_id):
+        """
+        Performs insert operation on single index
+
+        :param index: index to perform operation
+        :param data: new data
+        :param doc_id: document id
+        """
+        should_index = self._make_key_value(index, data)
         if should_index:
             key, value = should_index
             index.insert_with_storage(doc_id, key, value)
@@ -834,6 +942,40 @@ you should check index code.""" % (index.name, ex), RuntimeWarning)
         index.compact()
         del index.compacting
 
+    def reclaim_space(self, index):
+        """
+        Releases disk space taken by storage records of deleted and updated
+        documents (punches holes in storage files, Linux only).
+        Unlike :py:meth:`compact_index` it doesn't copy live data,
+        records in use are found by walking the index, so in thread safe
+        databases writers are stopped only while holes are punched.
+        Use :py:class:`codernitydb3.reclaimer.SpaceReclaimer` to run it
+        periodically in background.
+
+        :param index: the index to reclaim space of
+        :type index: :py:class:`codernitydb3.index.Index`` instance, or string
+        :returns: number of released bytes
+        """
+        self.__not_opened()
+        if isinstance(index, str):
+            if not index in self.indexes_names:
+                raise PreconditionsException("No index named %s" % index)
+            index = self.indexes_names[index]
+        elif not index in self.indexes:
+            raise PreconditionsException(
+                "Argument must be Index instance or valid string index format")
+        shards = getattr(index, 'shards', None)
+        parts = shards.values() if shards else (index, )
+        released = 0
+        for part in parts:
+            storage = part.storage
+            end = storage.stable_end()
+            # records saved while index is walked are placed after ``end``
+            live = sorted(
+                (start, size) for _, _, start, size, _ in part.all() if size)
+            released += storage.punch_holes(live, end)
+        return released
+
     def _compact_indexes(self):
         """
         Runs compact on all indexes
@@ -841,11 +983,22 @@ you should check index code.""" % (index.name, ex), RuntimeWarning)
         for index in self.indexes:
             self.compact_index(index)
 
-    def _single_reindex_index(self, index, data):
-        doc_id, rev, start, size, status = self.id_ind.get(
-            data['_id'])  # it's cached so it's ok
-        if status not in (Index.STATUS_D, Index.STATUS_U):
-            self._single_insert_index(index, data, doc_id)
+    def _reindex_records(self, index, docs):
+        """
+        Yields records of ``index`` for ``docs``, as given to
+        :py:meth:`codernitydb3.index.Index.bulk_load`. Values are written
+        to index storage on the way.
+        """
+        for data in docs:
+            doc_id, rev, start, size, status = self.id_ind.get(
+                data['_id'])  # it's cached so it's ok
+            if status in (Index.STATUS_D, Index.STATUS_U):
+                continue
+            should_index = self._make_key_value(index, data)
+            if should_index:
+                key, value = should_index
+                start, size = index._store_value(value)
+                yield doc_id, key, start, size, Index.STATUS_O
 
     def reindex_index(self, index):
         """
@@ -876,13 +1029,7 @@ you should check index code.""" % (index.name, ex), RuntimeWarning)
         index.destroy()
         index.create_index()
 
-        while True:
-            try:
-                curr = next(all_iter)
-            except StopIteration:
-                break
-            else:
-                self._single_reindex_index(index, curr)
+        index.bulk_load(self._reindex_records(index, all_iter))
         del index.reindexing
 
     def _reindex_indexes(self):
@@ -916,6 +1063,7 @@ you should check index code.""" % (index.name, ex), RuntimeWarning)
         data['_rev'] = _rev  # for make_key_value compat with update / delete
         data['_id'] = _id
         self._insert_indexes(_rev, data)
+        self._written()
         ret = {'_id': _id, '_rev': _rev}
         data.update(ret)
         return ret
@@ -939,6 +1087,7 @@ you should check index code.""" % (index.name, ex), RuntimeWarning)
             self.__not_opened()
             raise PreconditionsException("`_rev` must be valid bytes object")
         _id, new_rev = self._update_indexes(_rev, data)
+        self._written()
         ret = {'_id': _id, '_rev': new_rev}
         data.update(ret)
         return ret
@@ -988,6 +1137,128 @@ you should check index code.""" % (index.name, ex), RuntimeWarning)
             data['key'] = _unk
         return data
 
+    def get_raw(self, index_name, key):
+        """
+        Get single record from Database by ``key``, without decoding
+        stored data. Useful to pass records to clients that understand
+        the codec (e.g. server streaming them to sockets).
+
+        :param index_name: index to get data from
+        :param key: key to get
+        :returns: dict with ``_id``, ``_rev`` (or ``key`` for other
+            indexes than **id**), ``codec`` name and ``raw`` - memoryview
+            of data serialized with that codec (``None`` when record has no
+            data). Data from **id** index doesn't contain ``_id``
+            and ``_rev`` fields.
+        """
+        try:
+            ind = self.indexes_names[index_name]
+        except KeyError:
+            self.__not_opened()
+            raise IndexNotFoundException("Index `%s` doesn't exists" %
+                                         index_name)
+        try:
+            l_key, _unk, start, size, status = ind.get(key)
+        except ElemNotFound as ex:
+            raise RecordNotFound(ex)
+        if not start and not size:
+            raise RecordNotFound("Not found")
+        if status == Index.STATUS_D:
+            raise RecordDeleted("Deleted")
+        storage = ind.storage
+        data = {'_id': l_key, 'codec': getattr(storage, 'codec', None)}
+        if index_name == 'id':
+            data['_rev'] = _unk
+        else:
+            data['key'] = _unk
+        data['raw'] = storage.get_raw(start, size, status) if size else None
+        return data
+
+    def get_multi(self, index_name, keys, with_doc=False, with_storage=True):
+        """
+        Get data for many ``keys`` at once. Works as :py:meth:`get` called
+        for every key, but index is searched once for all keys and
+        records are read from storage in order of their positions.
+
+        :param index_name: index to get data from
+        :param keys: keys to get
+        :param with_doc: if ``True`` data from **id** index will be included in output
+        :param with_storage: if ``True`` data from index storage will be included, otherwise just metadata.
+        :returns: list with data for every key (in order of ``keys``),
+            ``None`` for keys that were not found or are deleted
+        """
+        try:
+            ind = self.indexes_names[index_name]
+        except KeyError:
+            self.__not_opened()
+            raise IndexNotFoundException("Index `%s` doesn't exists" %
+                                         index_name)
+        keys = list(keys)
+        if isinstance(ind, ShardedIndex):
+            # every shard has its own storage
+            res = []
+            for key in keys:
+                try:
+                    res.append(
+                        self.get(index_name, key, with_doc, with_storage))
+                except (RecordNotFound, RecordDeleted):
+                    res.append(None)
+            return res
+        found = ind.get_multi(keys)
+        hits = [
+            i for i, ind_data in enumerate(found) if ind_data and (
+                ind_data[2] or ind_data[3]) and ind_data[4] != Index.STATUS_D
+        ]
+        if with_storage:
+            datas = self._storage_get_many(ind.storage,
+                                           [found[i][-3:] for i in hits])
+        with_doc = with_doc and index_name != 'id'
+        if with_doc:
+            docs = self._get_docs([found[i][0] for i in hits])
+        res = [None] * len(keys)
+        for j, i in enumerate(hits):
+            l_key, _unk = found[i][:2]
+            data = datas[j] if with_storage else {}
+            if with_doc:
+                if isinstance(docs[j], DatabaseException):
+                    raise docs[j]
+                if data:
+                    data['doc'] = docs[j]
+                else:
+                    data = {'doc': docs[j]}
+            data['_id'] = l_key
+            if index_name == 'id':
+                data['_rev'] = _unk
+            else:
+                data['key'] = _unk
+            res[i] = data
+        return res
+
+    def key_exists(self, index_name, key):
+        """
+        Checks if there is record with ``key`` in index, without reading
+        the record itself. Indexes with Bloom filter
+        (:py:attr:`~codernitydb3.index.Index.bloom_capacity`) answer for
+        most of missing keys without any disk access.
+
+        :param index_name: index to check
+        :param key: key to check
+        :returns: ``True`` when not deleted record with that key exists
+        """
+        try:
+            ind = self.indexes_names[index_name]
+        except KeyError:
+            self.__not_opened()
+            raise IndexNotFoundException("Index `%s` doesn't exists" %
+                                         index_name)
+        try:
+            l_key, _unk, start, size, status = ind.get(key)
+        except ElemNotFound:
+            return False
+        if not start and not size:
+            return False
+        return status != Index.STATUS_D
+
     def get_many(self,
                  index_name,
                  key=None,
@@ -1010,6 +1281,12 @@ you should check index code.""" % (index.name, ex), RuntimeWarning)
         :param with_storage: if ``True`` data from index storage will be included, otherwise just metadata.
         :param start: ``start`` parameter for range queries
         :param end: ``end`` parameter for range queries
+        :param kwargs: passed to range query of the index, for *Tree based indexes*
+            ``inclusive_start``, ``inclusive_end`` and ``reverse`` (records from ``end`` backwards)
+
+        Records are read from index and storage in batches of
+        :py:attr:`storage_batch`. When document of a record can't be got
+        (``with_doc``), exception is raised when that record is reached.
 
         :returns: iterator over records
         """
@@ -1028,19 +1305,22 @@ you should check index code.""" % (index.name, ex), RuntimeWarning)
         else:
             gen = ind.get_between(start, end, limit, offset, **kwargs)
         while True:
-            try:
-                #                l_key, start, size, status = next(gen)
-                ind_data = next(gen)
-            except StopIteration:
+            #  l_key, start, size, status
+            chunk = list(islice(gen, self.storage_batch))
+            if not chunk:
                 break
-            else:
-                if with_storage and ind_data[-2]:
-                    data = storage.get(*ind_data[-3:])
-                else:
-                    data = {}
+            if with_storage:
+                datas = self._storage_get_many(
+                    storage, [ind_data[-3:] for ind_data in chunk])
+            if with_doc:
+                docs = self._get_docs([ind_data[0] for ind_data in chunk])
+            for i, ind_data in enumerate(chunk):
+                data = datas[i] if with_storage else {}
                 doc_id = ind_data[0]
                 if with_doc:
-                    doc = self.get('id', doc_id, False)
+                    doc = docs[i]
+                    if isinstance(doc, DatabaseException):
+                        raise doc
                     if data:
                         data['doc'] = doc
                     else:
@@ -1055,7 +1335,8 @@ you should check index code.""" % (index.name, ex), RuntimeWarning)
             limit=-1,
             offset=0,
             with_doc=False,
-            with_storage=True):
+            with_storage=True,
+            reverse=False):
         """
         Alows to get all records for given index
 
@@ -1064,6 +1345,9 @@ you should check index code.""" % (index.name, ex), RuntimeWarning)
         :param offset: defines offset (how many records from start it will ignore)
         :param with_doc: if ``True`` data from **id** index will be included in output
         :param with_storage: if ``True`` data from index storage will be included, otherwise just metadata
+        :param reverse: if ``True`` records are returned from the last one (*Tree based indexes* only)
+
+        Records are read in batches, same as in :py:meth:`get_many`.
         """
         try:
             ind = self.indexes_names[index_name]
@@ -1072,31 +1356,81 @@ you should check index code.""" % (index.name, ex), RuntimeWarning)
             raise IndexNotFoundException("Index `%s` doesn't exists" %
                                          index_name)
         storage = ind.storage
-        gen = ind.all(limit, offset)
+        if reverse:
+            gen = ind.all(limit, offset, reverse=True)
+        else:
+            gen = ind.all(limit, offset)
+        with_doc = with_doc and index_name != 'id'
         while True:
-            try:
-                doc_id, unk, start, size, status = next(gen)
-            except StopIteration:
+            chunk = list(islice(gen, self.storage_batch))
+            if not chunk:
                 break
-            else:
+            if with_storage:
+                values = self._storage_get_many(
+                    storage, [ind_data[-3:] for ind_data in chunk])
+            if with_doc:
+                docs = self._get_docs([ind_data[0] for ind_data in chunk])
+            for i, (doc_id, unk, start, size, status) in enumerate(chunk):
                 if index_name == 'id':
-                    if with_storage and size:
-                        data = storage.get(start, size, status)
-                    else:
-                        data = {}
+                    data = values[i] if with_storage else {}
                     data['_id'] = doc_id
                     data['_rev'] = unk
                 else:
                     data = {}
                     if with_storage and size:
-                        data['value'] = storage.get(start, size, status)
+                        data['value'] = values[i]
                     data['key'] = unk
                     data['_id'] = doc_id
                     if with_doc:
-                        doc = self.get('id', doc_id, False)
-                        data['doc'] = doc
+                        if isinstance(docs[i], DatabaseException):
+                            raise docs[i]
+                        data['doc'] = docs[i]
                 yield data
 
+    def _storage_get_many(self, storage, locations):
+        """
+        Gets data for many ``(start, size, status)`` locations from
+        ``storage`` at once, empty dict for locations without data
+        """
+        res = [{} for _ in locations]
+        with_data = [i for i, loc in enumerate(locations) if loc[1]]
+        if with_data:
+            datas = storage.get_many([locations[i] for i in with_data])
+            for i, data in zip(with_data, datas):
+                res[i] = data
+        return res
+
+    def _get_docs(self, doc_ids):
+        """
+        Gets many documents by ``_id`` at once,
+        same as :py:meth:`get` from **id** index for each of them.
+        For document that can't be got there is exception that
+        :py:meth:`get` would raise, it's raised when caller gets to
+        that document.
+        """
+        docs = []
+        found = []
+        for doc_id in doc_ids:
+            try:
+                _id, _rev, start, size, status = self.id_ind.get(doc_id)
+            except ElemNotFound as ex:
+                docs.append(RecordNotFound(ex))
+                continue
+            if not start and not size:
+                docs.append(RecordNotFound("Not found"))
+            elif status == Index.STATUS_D:
+                docs.append(RecordDeleted("Deleted"))
+            else:
+                found.append((len(docs), _rev, (start, size, status)))
+                docs.append(None)
+        datas = self._storage_get_many(self.id_ind.storage,
+                                       [loc for _, _, loc in found])
+        for (i, _rev, _), doc in zip(found, datas):
+            doc['_id'] = doc_ids[i]
+            doc['_rev'] = _rev
+            docs[i] = doc
+        return docs
+
     def run(self, index_name, target_funct, *args, **kwargs):
         """
         Allows to execute given function on Database side
@@ -1169,8 +1503,39 @@ you should check index code.""" % (index.name, ex), RuntimeWarning)
                 "`_id` and `_rev` must be valid bytes object")
         data['_deleted'] = True
         self._delete_indexes(_id, _rev, data)
+        self._written()
         return True
 
+    def put_blob(self, data):
+        """
+        Saves large value (attachment) out of the document storage,
+        in chunks. Returns blob id that documents can reference,
+        use :py:meth:`open_blob` to read it back.
+
+        :param data: bytes or file like object to copy blob data from
+        """
+        self.__not_opened()
+        return self.blobs.put_blob(data)
+
+    def open_blob(self, blob_id):
+        """
+        Returns binary file object to read blob ``blob_id`` from
+
+        :param blob_id: id returned by :py:meth:`put_blob`
+        """
+        self.__not_opened()
+        return self.blobs.open_blob(blob_id)
+
+    def delete_blob(self, blob_id):
+        """
+        Removes blob ``blob_id``. Blobs aren't removed with documents
+        that reference them.
+
+        :param blob_id: id returned by :py:meth:`put_blob`
+        """
+        self.__not_opened()
+        self.blobs.delete_blob(blob_id)
+
     def compact(self):
         """
         Compact all indexes. Runs :py:meth:`._compact_indexes` behind.
@@ -1187,11 +1552,11 @@ you should check index code.""" % (index.name, ex), RuntimeWarning)
 
     def flush_indexes(self):
         """
-        Flushes all indexes
+        Flushes all indexes, pending storage writes are committed too
         """
         self.__not_opened()
         for index in self.indexes:
-            index.flush()
+            index.commit()
 
     def flush(self):
         """
@@ -19,11 +19,96 @@
 from collections import defaultdict
 from functools import wraps
 from types import MethodType
+from threading import Condition, Lock, get_ident
 
 from codernitydb3.env import cdb_environment
 from codernitydb3.database import PreconditionsException, RevConflict, Database
 
 
+#: index and storage methods that don't change anything,
+#: with parallel reads they are run under the shared side of index lock
+READ_METHODS = frozenset(('get', 'get_raw', 'get_many', 'get_between', 'all',
+                          'make_key', 'make_key_value', 'data_from'))
+
+
+class _RWLockReader:
+    def __init__(self, rw_lock):
+        self.acquire = rw_lock.acquire_read
+        self.release = rw_lock.release_read
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class RWLock:
+    """
+    Lock that lets in many readers or a single writer.
+
+    Used as a plain lock (``with lock``, ``acquire``, ``release``)
+    it's the writer side, shared side is available as :py:attr:`reader`.
+    Writer may enter it again and may read while writing, new readers
+    wait when writer is waiting, so writers are not starved.
+    """
+    def __init__(self):
+        self._cond = Condition(Lock())
+        self._readers = {}
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+        self.reader = _RWLockReader(self)
+
+    def acquire_read(self):
+        me = get_ident()
+        with self._cond:
+            if self._writer != me and me not in self._readers:
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+
+    def release_read(self):
+        me = get_ident()
+        with self._cond:
+            left = self._readers[me] - 1
+            if left:
+                self._readers[me] = left
+            else:
+                del self._readers[me]
+                self._cond.notify_all()
+
+    def acquire(self):
+        me = get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return True
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or any(r != me
+                                                      for r in self._readers):
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._writer_depth = 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+
 class th_safe_gen:
     def __init__(self, name, gen, l=None):
         self.lock = l
@@ -31,7 +116,7 @@ class th_safe_gen:
         self.name = name
 
     def __iter__(self):
-        return th_safe_gen(self.name, self.__gen)
+        return self
 
     def __next__(self):
         with self.lock:
@@ -57,35 +142,53 @@ def safe_wrapper(method, lock):
 
 
 class SafeDatabase(Database):
+
+    parallel_reads = False  #: let read only index methods run in parallel
+
     def __init__(self, path, *args, **kwargs):
         super(SafeDatabase, self).__init__(path, *args, **kwargs)
-        self.indexes_locks = defaultdict(cdb_environment['rlock_obj'])
+        self.indexes_locks = defaultdict(self._index_lock)
         self.close_open_lock = cdb_environment['rlock_obj']()
         self.main_lock = cdb_environment['rlock_obj']()
         self.id_revs = {}
 
+    def _index_lock(self):
+        if self.parallel_reads:
+            return RWLock()
+        return cdb_environment['rlock_obj']()
+
+    def __method_lock(self, name, meth_name):
+        lock = self.indexes_locks[name]
+        if meth_name in READ_METHODS:
+            return getattr(lock, 'reader', lock)
+        return lock
+
     def __patch_index_gens(self, name):
         ind = self.indexes_names[name]
-        for c in ('all', 'get_many'):
-            m = getattr(ind, c)
+        for c in ('all', 'get_many', 'get_between'):
+            m = getattr(ind, c, None)
+            if m is None:  # only tree indexes have ranges
+                continue
             if getattr(ind, c + "_orig", None):
                 return
-            m_fixed = th_safe_gen.wrapper(m, name, c, self.indexes_locks[name])
+            m_fixed = th_safe_gen.wrapper(m, name, c,
+                                          self.__method_lock(name, c))
             setattr(ind, c, m_fixed)
             setattr(ind, c + '_orig', m)
 
     def __patch_index_methods(self, name):
         ind = self.indexes_names[name]
-        lock = self.indexes_locks[name]
         for curr in dir(ind):
             meth = getattr(ind, curr)
             if not curr.startswith('_') and isinstance(meth, MethodType):
-                setattr(ind, curr, safe_wrapper(meth, lock))
+                setattr(ind, curr,
+                        safe_wrapper(meth, self.__method_lock(name, curr)))
         stor = ind.storage
         for curr in dir(stor):
             meth = getattr(stor, curr)
             if not curr.startswith('_') and isinstance(meth, MethodType):
-                setattr(stor, curr, safe_wrapper(meth, lock))
+                setattr(stor, curr,
+                        safe_wrapper(meth, self.__method_lock(name, curr)))
 
     def __patch_index(self, name):
         self.__patch_index_methods(name)
@@ -95,14 +198,14 @@ class SafeDatabase(Database):
         with self.close_open_lock:
             res = super(SafeDatabase, self).initialize(*args, **kwargs)
             for name, _ in self.indexes_names.items():
-                self.indexes_locks[name] = cdb_environment['rlock_obj']()
+                self.indexes_locks[name] = self._index_lock()
             return res
 
     def open(self, *args, **kwargs):
         with self.close_open_lock:
             res = super(SafeDatabase, self).open(*args, **kwargs)
             for name, _ in self.indexes_names.items():
-                self.indexes_locks[name] = cdb_environment['rlock_obj']()
+                self.indexes_locks[name] = self._index_lock()
                 self.__patch_index(name)
             return res
 
@@ -110,7 +213,7 @@ class SafeDatabase(Database):
         with self.close_open_lock:
             res = super(SafeDatabase, self).create(*args, **kwargs)
             for name, _ in self.indexes_names.items():
-                self.indexes_locks[name] = cdb_environment['rlock_obj']()
+                self.indexes_locks[name] = self._index_lock()
                 self.__patch_index(name)
             return res
 
@@ -126,7 +229,7 @@ class SafeDatabase(Database):
         with self.main_lock:
             res = super(SafeDatabase, self).add_index(*args, **kwargs)
             if self.opened:
-                self.indexes_locks[res] = cdb_environment['rlock_obj']()
+                self.indexes_locks[res] = self._index_lock()
                 self.__patch_index(res)
             return res
 
@@ -144,7 +247,7 @@ class SafeDatabase(Database):
         with self.main_lock:
             res = super(SafeDatabase, self).edit_index(*args, **kwargs)
             if self.opened:
-                self.indexes_locks[res] = cdb_environment['rlock_obj']()
+                self.indexes_locks[res] = self._index_lock()
                 self.__patch_index(res)
             return res
 
@@ -49,7 +49,7 @@ class SuperLock(type):
         for base in bases:
             for b_attr in dir(base):
                 a = getattr(base, b_attr, None)
-                if isinstance(a, MethodType) and not b_attr.startswith('_'):
+                if isinstance(a, (FunctionType, MethodType)) and not b_attr.startswith('_'):
                     if b_attr in ('flush', 'flush_indexes'):
                         pass
                     else:
@@ -76,8 +76,10 @@ class SuperThreadSafeDatabase(Database, metaclass=SuperLock):
 
     def __patch_index_gens(self, name):
         ind = self.indexes_names[name]
-        for c in ('all', 'get_many'):
-            m = getattr(ind, c)
+        for c in ('all', 'get_many', 'get_between'):
+            m = getattr(ind, c, None)
+            if m is None:  # only tree indexes have ranges
+                continue
             if getattr(ind, c + "_orig", None):
                 return
             m_fixed = th_safe_gen.wrapper(m, name, c, self.super_lock)
@@ -20,6 +20,7 @@ from threading import RLock
 
 from codernitydb3.database_safe_shared import SafeDatabase
 from codernitydb3.env import cdb_environment
+from codernitydb3.readers import positional_reads
 
 cdb_environment['mode'] = "threads"
 cdb_environment['rlock_obj'] = RLock
@@ -30,4 +31,9 @@ class ThreadSafeDatabase(SafeDatabase):
     Thread safe version of codernitydb3 that uses several lock objects,
     on different methods / different indexes etc. It's completely different
     implementation of locking than SuperThreadSafe one.
+
+    When files are read with ``os.pread`` (or memory maps), reads on the
+    same index run in parallel, only writers are serialized.
     """
+
+    parallel_reads = positional_reads
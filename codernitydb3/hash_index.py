@@ -19,16 +19,23 @@
 import os
 import marshal
 import io
+import sys
 import struct
 import shutil
+import zlib
+
+from array import array
+from hashlib import blake2b
 
 from codernitydb3.index import (Index, IndexException, DocIdNotFound,
                                 ElemNotFound, TryReindexException,
                                 IndexPreconditionsException)
 
 from codernitydb3.rr_cache import cache1lvl
-from codernitydb3.misc import random_hex_32
-from codernitydb3.storage import IU_Storage, DummyStorage
+from codernitydb3.misc import random_hex_32, key_bytes
+from codernitydb3.readers import advise
+from codernitydb3.storage import (IU_Storage, DummyStorage, BufferedStorage,
+                                  CompressedStorage, SegmentedStorage)
 from codernitydb3.env import cdb_environment
 
 if cdb_environment.get('rlock_obj'):
@@ -40,6 +47,56 @@ try:
 except ImportError:
     from __init__ import __version__
 
+_hash_functions = {}
+
+
+def register_hash_function(name, function):
+    """
+    Registers function that hash indexes can use to place keys in buckets.
+
+    Function name is saved in the index properties, so the function has to
+    be registered (under the same name) every time such index is opened,
+    and it has to return the same value for the same key in every process.
+
+    :param name: hash function name
+    :param function: function that returns non negative integer for given key
+    """
+    _hash_functions[name] = function
+
+
+def get_hash_function(name):
+    """
+    Returns hash function registered as ``name``
+    """
+    try:
+        return _hash_functions[name]
+    except KeyError:
+        raise IndexException("Unknown hash function: %r" % name)
+
+
+def _crc32(key):
+    return zlib.crc32(key_bytes(key))
+
+
+def _blake2b(key):
+    return int.from_bytes(
+        blake2b(key_bytes(key), digest_size=8).digest(), 'little')
+
+
+def _fnv1a(key):
+    h = 0xcbf29ce484222325
+    for byte in key_bytes(key):
+        h = ((h ^ byte) * 0x100000001b3) & 0xffffffffffffffff
+    return h
+
+
+register_hash_function('crc32', _crc32)
+register_hash_function('blake2b', _blake2b)
+register_hash_function('fnv1a', _fnv1a)
+# salted per process for str and bytes keys, used by indexes created
+# before hash function became index property
+register_hash_function('builtin', hash)
+
 
 class IU_HashIndex(Index):
     """
@@ -47,6 +104,13 @@ class IU_HashIndex(Index):
 
     That design is because main index logic should be always in database not in custom user indexes.
     """
+
+    hash_function = 'crc32'  # : name of function used to place keys in buckets, check :py:func:`register_hash_function`
+
+    memory_buckets = False  # : keep bucket table in memory (4 bytes per bucket), saves one read in every operation
+
+    scan_block_size = 1024 * 1024  # : size of blocks read by full scans (``all``, reindex), bytes
+
     def __init__(self,
                  db_path,
                  name,
@@ -91,9 +155,17 @@ class IU_HashIndex(Index):
         self.entry_struct = struct.Struct(self.entry_line_format)
         self.data_start = (self.hash_lim +
                            1) * self.bucket_line_size + self._start_ind + 2
+        self._hash = get_hash_function(self.hash_function)
+        self._bucket_table = None
+        self._free_entries = [
+        ]  # : locations of free entries (of empty pages in :py:class:`IU_PagedHashIndex`)
+        self._free_entries_changed = False
 
     def _fix_params(self):
+        # indexes without hash function in props used the builtin one
+        self.hash_function = 'builtin'
         super(IU_HashIndex, self)._fix_params()
+        self._hash = get_hash_function(self.hash_function)
         self.bucket_line_size = struct.calcsize(self.bucket_line_format)
         self.entry_line_size = struct.calcsize(self.entry_line_format)
         self.bucket_struct = struct.Struct(self.bucket_line_format)
@@ -104,11 +176,13 @@ class IU_HashIndex(Index):
     def open_index(self):
         if not os.path.isfile(os.path.join(self.db_path, self.name + '_buck')):
             raise IndexException("Doesn't exists")
-        self.buckets = io.open(os.path.join(self.db_path, self.name + "_buck"),
-                               'r+b',
-                               buffering=0)
+        self._open_buckets()
         self._fix_params()
+        self._load_bucket_table()
+        self._load_free_entries()
         self._open_storage()
+        self._open_bloom()
+        self._drop_lost()
 
     def create_index(self):
         if os.path.isfile(os.path.join(self.db_path, self.name + '_buck')):
@@ -119,28 +193,44 @@ class IU_HashIndex(Index):
                          bucket_line_format=self.bucket_line_format,
                          entry_line_format=self.entry_line_format,
                          hash_lim=self.hash_lim,
+                         hash_function=self.hash_function,
                          __version__=self.__version__,
                          storage_class=self.storage_class)
             f.write(marshal.dumps(props))
-        self.buckets = io.open(os.path.join(self.db_path, self.name + "_buck"),
-                               'r+b',
-                               buffering=0)
+        self._open_buckets()
+        self._load_bucket_table()
+        self._free_entries = []
+        self._free_entries_changed = False
         self._create_storage()
+        self._open_bloom(create=True)
 
     def destroy(self):
         super(IU_HashIndex, self).destroy()
+        if os.path.exists(self._free_entries_path):
+            os.unlink(self._free_entries_path)
         self._clear_cache()
 
+    def _close(self):
+        self._save_free_entries()
+        self._free_entries = []
+        super(IU_HashIndex, self)._close()
+
+    def commit(self):
+        super(IU_HashIndex, self).commit()
+        self._save_free_entries()
+
     def _open_storage(self):
         s = globals()[self.storage_class]
         if not self.storage:
             self.storage = s(self.db_path, self.name)
+            self._configure_storage()
         self.storage.open()
 
     def _create_storage(self):
         s = globals()[self.storage_class]
         if not self.storage:
             self.storage = s(self.db_path, self.name)
+            self._configure_storage()
         self.storage.create()
 
     # def close_index(self):
@@ -155,9 +245,10 @@ class IU_HashIndex(Index):
 
         :param key: the key to find
         """
+        if self.bloom is not None and key not in self.bloom:
+            return None, None, 0, 0, self.STATUS_U
         start_position = self._calculate_position(key)
-        self.buckets.seek(start_position)
-        curr_data = self.buckets.read(self.bucket_line_size)
+        curr_data = self._read_bucket(start_position)
         if curr_data:
             location = self.bucket_struct.unpack(curr_data)[0]
             if not location:
@@ -175,44 +266,134 @@ class IU_HashIndex(Index):
             return None, None, 0, 0, self.STATUS_U
 
     def _find_key_many(self, key, limit=1, offset=0):
+        if self.bloom is not None and key not in self.bloom:
+            return
         location = None
         start_position = self._calculate_position(key)
-        self.buckets.seek(start_position)
-        curr_data = self.buckets.read(self.bucket_line_size)
+        curr_data = self._read_bucket(start_position)
         if curr_data:
             location = self.bucket_struct.unpack(curr_data)[0]
-        while offset:
-            if not location:
-                break
-            try:
-                found_at, doc_id, l_key, start, size, status, _next = self._locate_key(
-                    key, location)
-            except IndexException:
-                break
-            else:
-                if status != self.STATUS_D:
-                    if l_key == key:  # in case of hash function conflicts
-                        offset -= 1
-                location = _next
-        while limit:
-            if not location:
-                break
-            try:
-                found_at, doc_id, l_key, start, size, status, _next = self._locate_key(
-                    key, location)
-            except IndexException:
-                break
-            else:
-                if status != self.STATUS_D:
-                    if l_key == key:  # in case of hash function conflicts
-                        yield doc_id, start, size, status
-                        limit -= 1
-                location = _next
+        try:
+            for found_at, entry in self._walk(location):
+                if not limit:
+                    break
+                doc_id, l_key, start, size, status, _next = entry
+                # in case of hash function conflicts
+                if status == self.STATUS_D or l_key != key:
+                    continue
+                if offset:
+                    offset -= 1
+                    continue
+                yield doc_id, start, size, status
+                limit -= 1
+        except struct.error:
+            return
 
     def _calculate_position(self, key):
-        return abs(hash(key)
+        return abs(self._hash(key)
                    & self.hash_lim) * self.bucket_line_size + self._start_ind
 
+    def _load_bucket_table(self):
+        """
+        Reads whole bucket table to memory when :py:attr:`memory_buckets` is set
+        """
+        self._bucket_table = None
+        if not self.memory_buckets:
+            return
+        size = (self.hash_lim + 1) * self.bucket_line_size
+        data = bytes(self._read_buckets(self._start_ind, size))
+        table = array('I')
+        table.frombytes(data.ljust(size, b'\x00'))
+        if sys.byteorder == 'big':
+            table.byteswap()
+        self._bucket_table = table
+
+    def _read_bucket(self, position):
+        """
+        Reads bucket line from ``position``, returns empty bytes when
+        there is no such bucket
+        """
+        if self._bucket_table is not None:
+            location = self._bucket_table[(position - self._start_ind) //
+                                          self.bucket_line_size]
+            if not location:
+                return b''
+            return self.bucket_struct.pack(location)
+        return self._read_buckets(position, self.bucket_line_size)
+
+    def _write_bucket(self, position, location):
+        """
+        Points bucket from ``position`` to the entry at ``location``
+        """
+        self.buckets.seek(position)
+        self.buckets.write(self.bucket_struct.pack(location))
+        if self._bucket_table is not None:
+            self._bucket_table[(position - self._start_ind) //
+                               self.bucket_line_size] = location
+
+    def _entry_key(self, entry):
+        """
+        Returns the key from unpacked entry line
+        """
+        return entry[1]
+
+    def _walk(self, location):
+        """
+        Iterates over chain of entries starting from ``location``,
+        using `next` field in record
+
+        :returns: generator of ``(location, unpacked entry)``
+        """
+        while location:
+            entry = self.entry_struct.unpack(
+                self._read_buckets(location, self.entry_line_size))
+            yield location, entry
+            location = entry[-1]
+
+    def _entry_place(self, location, found_at):
+        """
+        Returns position where new entry linked after the one at
+        ``found_at`` should be written
+
+        :param location: position of the first entry in chain (0 for new chain)
+        :param found_at: position of the previous entry in chain
+        """
+        if self._free_entries:
+            self._free_entries_changed = True
+            return self._free_entries.pop()
+        return max(self.buckets.seek(0, 2), self.data_start)
+
+    def _scan_blocks(self, unit):
+        """
+        Reads entries part of buckets file sequentially, in blocks of
+        about :py:attr:`scan_block_size` bytes
+
+        :param unit: size of parts that are never split between blocks
+        :returns: generator of memoryviews, whole ``unit`` parts only
+        """
+        size = max(self.scan_block_size // unit, 1) * unit
+        advise(self.buckets, 'SEQUENTIAL')
+        try:
+            location = self.data_start
+            while True:
+                data = self._read_buckets(location, size)
+                whole = len(data) - len(data) % unit
+                if whole:
+                    yield memoryview(data)[:whole]
+                if len(data) < size:
+                    break
+                location += size
+        finally:
+            advise(self.buckets, 'NORMAL')
+
+    def _all_entries(self):
+        """
+        Iterates over all entries (deleted too) in order they are stored
+        """
+        for data in self._scan_blocks(self.entry_line_size):
+            for entry in self.entry_struct.iter_unpack(data):
+                yield entry
+
     # TODO add cache!
     def _locate_key(self, key, start):
         """
@@ -222,26 +403,13 @@ class IU_HashIndex(Index):
         :param key: the key to locate
         :param start: position to start from
         """
-        location = start
-        while True:
-            self.buckets.seek(location)
-            data = self.buckets.read(self.entry_line_size)
-            # todo, maybe partial read there...
-            try:
-                doc_id, l_key, start, size, status, _next = self.entry_struct.unpack(
-                    data)
-            except struct.error:
-                raise ElemNotFound(
-                    "Not found")  # not found but might be also broken
-            if l_key == key:
-                break
-            else:
-                if not _next:
-                    # not found
-                    raise ElemNotFound("Not found")
-                else:
-                    location = _next  # go to next record
-        return location, doc_id, l_key, start, size, status, _next
+        try:
+            for location, entry in self._walk(start):
+                if entry[1] == key:
+                    return (location, ) + entry
+        except struct.error:
+            pass  # not found but might be also broken
+        raise ElemNotFound("Not found")
 
 
 #    @lfu_cache(100)
@@ -255,26 +423,14 @@ class IU_HashIndex(Index):
         :param key: key value
         :param start: position to start from
         """
-        location = start
-        while True:
-            self.buckets.seek(location)
-            data = self.buckets.read(self.entry_line_size)
-            try:
-                l_doc_id, l_key, start, size, status, _next = self.entry_struct.unpack(
-                    data)
-            except:
-                raise DocIdNotFound("Doc_id '%s' for '%s' not found" %
-                                    (doc_id, key))
-            if l_doc_id == doc_id and l_key == key:  # added for consistency
-                break
-            else:
-                if not _next:
-                    # not found
-                    raise DocIdNotFound("Doc_id '%s' for '%s' not found" %
-                                        (doc_id, key))
-                else:
-                    location = _next  # go to next record
-        return location, doc_id, l_key, start, size, status, _next
+        try:
+            for location, entry in self._walk(start):
+                # key is checked too for consistency
+                if entry[0] == doc_id and entry[1] == key:
+                    return (location, ) + entry
+        except struct.error:
+            pass
+        raise DocIdNotFound("Doc_id '%s' for '%s' not found" % (doc_id, key))
 
     def _find_place(self, start):
         """
@@ -283,24 +439,14 @@ class IU_HashIndex(Index):
 
         :param start: position to start from
         """
-        location = start
-        while True:
-            self.buckets.seek(location)
-            data = self.buckets.read(self.entry_line_size)
-            # todo, maybe partial read there...
-            doc_id, l_key, start, size, status, _next = self.entry_struct.unpack(
-                data)
-            if not _next or status == self.STATUS_D:
-                return self.buckets.tell(
-                ) - self.entry_line_size, doc_id, l_key, start, size, status, _next
-            else:
-                location = _next  # go to next record
+        for location, entry in self._walk(start):
+            if not entry[-1] or entry[-2] == self.STATUS_D:
+                return (location, ) + entry
 
     def update(self, doc_id, key, u_start=0, u_size=0, u_status=None):
         u_status = u_status or self.STATUS_O
         start_position = self._calculate_position(key)
-        self.buckets.seek(start_position)
-        curr_data = self.buckets.read(self.bucket_line_size)
+        curr_data = self._read_bucket(start_position)
         # test if it's unique or not really unique hash
         if curr_data:
             location = self.bucket_struct.unpack(curr_data)[0]
@@ -319,9 +465,9 @@ class IU_HashIndex(Index):
 
     def insert(self, doc_id, key, start, size, status=None):
         status = status or self.STATUS_O
+        self._bloom_add(key)
         start_position = self._calculate_position(key)
-        self.buckets.seek(start_position)
-        curr_data = self.buckets.read(self.bucket_line_size)
+        curr_data = self._read_bucket(start_position)
 
         # conflict occurs?
         if curr_data:
@@ -336,8 +482,8 @@ class IU_HashIndex(Index):
             except DocIdNotFound:
                 found_at, _doc_id, _key, _start, _size, _status, _next = self._find_place(
                     location)
-                self.buckets.seek(0, 2)
-                wrote_at = self.buckets.tell()
+                wrote_at = self._entry_place(location, found_at)
+                self.buckets.seek(wrote_at)
                 self.buckets.write(
                     self.entry_struct.pack(doc_id, key, start, size, status,
                                            _next))
@@ -359,20 +505,13 @@ class IU_HashIndex(Index):
             return True
             # raise NotImplementedError
         else:
-            self.buckets.seek(0, 2)
-            wrote_at = self.buckets.tell()
-
-            # check if position is bigger than all hash entries...
-            if wrote_at < self.data_start:
-                self.buckets.seek(self.data_start)
-                wrote_at = self.buckets.tell()
-
+            wrote_at = self._entry_place(0, 0)
+            self.buckets.seek(wrote_at)
             self.buckets.write(
                 self.entry_struct.pack(doc_id, key, start, size, status, 0))
             #            self.flush()
             self._find_key.delete(key)
-            self.buckets.seek(start_position)
-            self.buckets.write(self.bucket_struct.pack(wrote_at))
+            self._write_bucket(start_position, wrote_at)
             self.flush()
             return True
 
@@ -382,82 +521,177 @@ class IU_HashIndex(Index):
     def get_many(self, key, limit=1, offset=0):
         return self._find_key_many(self.make_key(key), limit, offset)
 
-    def all(self, limit=-1, offset=0):
-        self.buckets.seek(self.data_start)
-        while offset:
-            curr_data = self.buckets.read(self.entry_line_size)
-            if not curr_data:
-                break
-            try:
-                doc_id, key, start, size, status, _next = self.entry_struct.unpack(
-                    curr_data)
-            except IndexException:
-                break
-            else:
-                if status != self.STATUS_D:
-                    offset -= 1
-        while limit:
-            curr_data = self.buckets.read(self.entry_line_size)
+    def get_multi(self, keys):
+        """
+        Finds many keys at once. Keys are grouped by bucket, so every
+        chain is walked only once, and buckets are visited in order.
+
+        :param keys: keys to find
+        :returns: list with result of :py:meth:`get` for every key,
+            ``None`` for keys that were not found
+        """
+        res = [None] * len(keys)
+        buckets = {}
+        for i, key in enumerate(keys):
+            key = self.make_key(key)
+            if self.bloom is not None and key not in self.bloom:
+                continue
+            wanted = buckets.setdefault(self._calculate_position(key), {})
+            wanted.setdefault(key, []).append(i)
+        for position in sorted(buckets):
+            wanted = buckets[position]
+            curr_data = self._read_bucket(position)
             if not curr_data:
-                break
+                continue
+            location = self.bucket_struct.unpack(curr_data)[0]
             try:
-                doc_id, key, start, size, status, _next = self.entry_struct.unpack(
-                    curr_data)
-            except IndexException:
+                for found_at, entry in self._walk(location):
+                    key = self._entry_key(entry)
+                    if key in wanted and self._entry_found(entry):
+                        for i in wanted.pop(key):
+                            res[i] = entry[:5]
+                        if not wanted:
+                            break
+            except struct.error:
+                pass
+        return res
+
+    def _entry_found(self, entry):
+        """
+        Tells if entry for searched key is the one :py:meth:`get` returns
+        """
+        return entry[-2] != self.STATUS_D
+
+    def all(self, limit=-1, offset=0):
+        for doc_id, key, start, size, status, _next in self._all_entries():
+            if not limit:
                 break
-            else:
-                if status != self.STATUS_D:
-                    yield doc_id, key, start, size, status
-                    limit -= 1
-
-    def _fix_link(self, key, pos_prev, pos_next):
-        # CHECKIT why I need that hack
-        if pos_prev >= self.data_start:
-            self.buckets.seek(pos_prev)
-            data = self.buckets.read(self.entry_line_size)
-            if data:
-                doc_id, l_key, start, size, status, _next = self.entry_struct.unpack(
-                    data)
-                self.buckets.seek(pos_prev)
-                self.buckets.write(
-                    self.entry_struct.pack(doc_id, l_key, start, size, status,
-                                           pos_next))
-                self.flush()
-        if pos_next:
-            self.buckets.seek(pos_next)
-            data = self.buckets.read(self.entry_line_size)
-            if data:
-                doc_id, l_key, start, size, status, _next = self.entry_struct.unpack(
-                    data)
-                self.buckets.seek(pos_next)
-                self.buckets.write(
-                    self.entry_struct.pack(doc_id, l_key, start, size, status,
-                                           _next))
-                self.flush()
-        return
+            if status == self.STATUS_D:
+                continue
+            if offset:
+                offset -= 1
+                continue
+            yield doc_id, key, start, size, status
+            limit -= 1
+
+    def _bucket_locations(self):
+        """
+        Returns locations of first entries from all buckets
+        """
+        if self._bucket_table is not None:
+            return self._bucket_table
+        size = (self.hash_lim + 1) * self.bucket_line_size
+        data = self._read_buckets(self._start_ind, size)
+        data = data[:len(data) - len(data) % self.bucket_line_size]
+        return [x[0] for x in self.bucket_struct.iter_unpack(data)]
+
+    def chain_lengths(self):
+        """
+        Counts buckets by length of their chains, deleted entries are
+        counted too because they are still traversed.
+
+        :returns: dict ``{chain length: number of buckets}``, empty buckets are skipped
+        """
+        lengths = {}
+        for location in self._bucket_locations():
+            length = sum(1 for _ in self._walk(location))
+            if length:
+                lengths[length] = lengths.get(length, 0) + 1
+        return lengths
 
     def delete(self, doc_id, key, start=0, size=0):
         start_position = self._calculate_position(key)
-        self.buckets.seek(start_position)
-        curr_data = self.buckets.read(self.bucket_line_size)
+        curr_data = self._read_bucket(start_position)
         if curr_data:
             location = self.bucket_struct.unpack(curr_data)[0]
         else:
             # case happens when trying to delete element with new index key in data
             # after adding new index to database without reindex
             raise TryReindexException()
-        found_at, _doc_id, _key, start, size, status, _next = self._locate_doc_id(
-            doc_id, key, location)
-        self.buckets.seek(found_at)
-        self.buckets.write(
-            self.entry_struct.pack(doc_id, key, start, size, self.STATUS_D,
-                                   _next))
+        if not location:
+            raise TryReindexException()
+        prev = None
+        for found_at, entry in self._walk(location):
+            if entry[0] == doc_id and entry[1] == key:
+                break
+            prev = found_at, entry
+        else:
+            raise DocIdNotFound("Doc_id '%s' for '%s' not found" %
+                                (doc_id, key))
+        self._unlink_entry(start_position, prev, found_at, entry)
         self.flush()
-        # self._fix_link(_key, _prev, _next)
         self._find_key.delete(key)
         self._locate_doc_id.delete(doc_id)
         return True
 
+    def _unlink_entry(self, start_position, prev, location, entry):
+        """
+        Unlinks entry at ``location`` from its chain and frees it
+
+        :param start_position: position of the bucket of the chain
+        :param prev: ``(location, entry)`` of previous entry in chain, ``None`` for the first one
+        """
+        _next = entry[-1]
+        if prev:
+            self.buckets.seek(prev[0])
+            self.buckets.write(
+                self.entry_struct.pack(*prev[1][:-1] + (_next, )))
+            self._locate_doc_id.delete(prev[1][0])
+        else:
+            self._write_bucket(start_position, _next)
+        self._free_entry(location, entry)
+
+    def _free_entry(self, location, entry):
+        """
+        Marks entry at ``location`` (already unlinked from its chain) as
+        deleted and puts it on the free entries list, next insert will
+        use it.
+        """
+        self.buckets.seek(location)
+        self.buckets.write(
+            self.entry_struct.pack(*entry[:-2] + (self.STATUS_D, 0)))
+        self._free_entries.append(location)
+        self._free_entries_changed = True
+
+    def _is_free(self, location):
+        """
+        Tells if entry at ``location`` from saved free entries list
+        is still free
+        """
+        entry = self.entry_struct.unpack(
+            self._read_buckets(location, self.entry_line_size))
+        return entry[-2] == self.STATUS_D and not entry[-1]
+
+    @property
+    def _free_entries_path(self):
+        return os.path.join(self.db_path, self.name + '_buck_free')
+
+    def _load_free_entries(self):
+        """
+        Loads free entries list saved by :py:meth:`commit` or on close.
+        After a crash the list can be older than buckets, entries that
+        were used since it was saved are skipped (entries freed since
+        then are leaked until compaction, but never used twice).
+        """
+        self._free_entries = []
+        self._free_entries_changed = False
+        if os.path.exists(self._free_entries_path):
+            with io.open(self._free_entries_path, 'rb') as f:
+                self._free_entries = [
+                    location for location in marshal.loads(f.read())
+                    if self._is_free(location)
+                ]
+
+    def _save_free_entries(self):
+        if not self._free_entries_changed:
+            return
+        self._free_entries_changed = False
+        if self._free_entries:
+            with io.open(self._free_entries_path, 'wb') as f:
+                f.write(marshal.dumps(self._free_entries))
+        elif os.path.exists(self._free_entries_path):
+            os.unlink(self._free_entries_path)
+
     def compact(self, hash_lim=None):
 
         if not hash_lim:
@@ -467,6 +701,7 @@ class IU_HashIndex(Index):
                                      self.name + '_compact',
                                      hash_lim=hash_lim)
         compact_ind.create_index()
+        compact_ind.storage.copy_settings(self.storage)
 
         gen = self.all()
         while True:
@@ -474,22 +709,16 @@ class IU_HashIndex(Index):
                 doc_id, key, start, size, status = next(gen)
             except StopIteration:
                 break
-            self.storage._f.seek(start)
-            value = self.storage._f.read(size)
-            start_ = compact_ind.storage._f.tell()
-            compact_ind.storage._f.write(value)
+            value = self.storage._read(start, size)
+            start_ = compact_ind.storage._write(value)
             compact_ind.insert(doc_id, key, start_, size, status)
 
         compact_ind.close_index()
         original_name = self.name
         # os.unlink(os.path.join(self.db_path, self.name + "_buck"))
         self.close_index()
-        shutil.move(
-            os.path.join(compact_ind.db_path, compact_ind.name + "_buck"),
-            os.path.join(self.db_path, self.name + "_buck"))
-        shutil.move(
-            os.path.join(compact_ind.db_path, compact_ind.name + "_stor"),
-            os.path.join(self.db_path, self.name + "_stor"))
+        compact_ind._move_buckets(self.name)
+        compact_ind.storage.move(self.name)
         # self.name = original_name
         self.open_index()  # reload...
         self.name = original_name
@@ -498,6 +727,15 @@ class IU_HashIndex(Index):
         self._clear_cache()
         return True
 
+    def _move_buckets(self, new_name):
+        shutil.move(os.path.join(self.db_path, self.name + "_buck"),
+                    os.path.join(self.db_path, new_name + "_buck"))
+        # compacted index has no free entries
+        target = os.path.join(self.db_path, new_name + '_buck_free')
+        if os.path.exists(target):
+            os.unlink(target)
+        self._move_bloom(new_name)
+
     def make_key(self, key):
         return key if isinstance(key, bytes) else key.encode('utf8')
 
@@ -544,9 +782,10 @@ class IU_UniqueHashIndex(IU_HashIndex):
 
         :param key: the key to find
         """
+        if self.bloom is not None and key not in self.bloom:
+            return None, None, 0, 0, self.STATUS_U
         start_position = self._calculate_position(key)
-        self.buckets.seek(start_position)
-        curr_data = self.buckets.read(self.bucket_line_size)
+        curr_data = self._read_bucket(start_position)
         if curr_data:
             location = self.bucket_struct.unpack(curr_data)[0]
             found_at, l_key, rev, start, size, status, _next = self._locate_key(
@@ -558,6 +797,16 @@ class IU_UniqueHashIndex(IU_HashIndex):
     def _find_key_many(self, *args, **kwargs):
         raise NotImplementedError()
 
+    def _entry_key(self, entry):
+        return entry[0]
+
+    def _entry_found(self, entry):
+        return True  # deleted records are reported, as in get
+
+    def _all_keys(self):
+        for entry in self.all():
+            yield entry[0]
+
     def _find_place(self, start, key):
         """
         Find a place to where put the key. It will iterate using `next` field in record, until
@@ -565,20 +814,11 @@ class IU_UniqueHashIndex(IU_HashIndex):
 
         :param start: position to start from
         """
-        location = start
-        while True:
-            self.buckets.seek(location)
-            data = self.buckets.read(self.entry_line_size)
-            # todo, maybe partial read there...
-            l_key, rev, start, size, status, _next = self.entry_struct.unpack(
-                data)
-            if l_key == key:
+        for location, entry in self._walk(start):
+            if entry[0] == key:
                 raise IndexException("The '%s' key already exists" % key)
-            if not _next or status == self.STATUS_D:
-                return self.buckets.tell(
-                ) - self.entry_line_size, l_key, rev, start, size, status, _next
-            else:
-                location = _next  # go to next record
+            if not entry[-1] or entry[-2] == self.STATUS_D:
+                return (location, ) + entry
 
     # @lfu_cache(100)
     def _locate_key(self, key, start):
@@ -589,32 +829,18 @@ class IU_UniqueHashIndex(IU_HashIndex):
         :param key: the key to locate
         :param start: position to start from
         """
-        location = start
-        while True:
-            self.buckets.seek(location)
-            data = self.buckets.read(self.entry_line_size)
-            # todo, maybe partial read there...
-            try:
-                l_key, rev, start, size, status, _next = self.entry_struct.unpack(
-                    data)
-            except struct.error:
-                raise ElemNotFound("Location '%s' not found" % key)
-            if l_key == key:
-                break
-            else:
-                if not _next:
-                    # not found
-                    raise ElemNotFound("Location '%s' not found" % key)
-                else:
-                    location = _next  # go to next record
-        return self.buckets.tell(
-        ) - self.entry_line_size, l_key, rev, start, size, status, _next
+        try:
+            for location, entry in self._walk(start):
+                if entry[0] == key:
+                    return (location, ) + entry
+        except struct.error:
+            pass
+        raise ElemNotFound("Location '%s' not found" % key)
 
     def update(self, key, rev, u_start=0, u_size=0, u_status=None):
         u_status = u_status or self.STATUS_O
         start_position = self._calculate_position(key)
-        self.buckets.seek(start_position)
-        curr_data = self.buckets.read(self.bucket_line_size)
+        curr_data = self._read_bucket(start_position)
         # test if it's unique or not really unique hash
 
         if curr_data:
@@ -636,9 +862,9 @@ class IU_UniqueHashIndex(IU_HashIndex):
 
     def insert(self, key, rev, start, size, status=None):
         status = status or self.STATUS_O
+        self._bloom_add(key)
         start_position = self._calculate_position(key)
-        self.buckets.seek(start_position)
-        curr_data = self.buckets.read(self.bucket_line_size)
+        curr_data = self._read_bucket(start_position)
 
         # conflict occurs?
         if curr_data:
@@ -649,14 +875,8 @@ class IU_UniqueHashIndex(IU_HashIndex):
             # last key with that hash
             found_at, _key, _rev, _start, _size, _status, _next = self._find_place(
                 location, key)
-            self.buckets.seek(0, 2)
-            wrote_at = self.buckets.tell()
-
-            # check if position is bigger than all hash entries...
-            if wrote_at < self.data_start:
-                self.buckets.seek(self.data_start)
-                wrote_at = self.buckets.tell()
-
+            wrote_at = self._entry_place(location, found_at)
+            self.buckets.seek(wrote_at)
             self.buckets.write(
                 self.entry_struct.pack(key, rev, start, size, status, _next))
 
@@ -671,57 +891,39 @@ class IU_UniqueHashIndex(IU_HashIndex):
             return True
             # raise NotImplementedError
         else:
-            self.buckets.seek(0, 2)
-            wrote_at = self.buckets.tell()
-
-            # check if position is bigger than all hash entries...
-            if wrote_at < self.data_start:
-                self.buckets.seek(self.data_start)
-                wrote_at = self.buckets.tell()
-
+            wrote_at = self._entry_place(0, 0)
+            self.buckets.seek(wrote_at)
             self.buckets.write(
                 self.entry_struct.pack(key, rev, start, size, status, 0))
             #            self.flush()
-            self.buckets.seek(start_position)
-            self.buckets.write(self.bucket_struct.pack(wrote_at))
+            self._write_bucket(start_position, wrote_at)
             self.flush()
             self._find_key.delete(key)
             return True
 
     def all(self, limit=-1, offset=0):
-        self.buckets.seek(self.data_start)
-        while offset:
-            curr_data = self.buckets.read(self.entry_line_size)
-            if not curr_data:
-                break
-            try:
-                doc_id, rev, start, size, status, next = self.entry_struct.unpack(
-                    curr_data)
-            except IndexException:
+        for doc_id, rev, start, size, status, _next in self._all_entries():
+            if not limit:
                 break
-            else:
-                if status != self.STATUS_D:
-                    offset -= 1
-
-        while limit:
-            curr_data = self.buckets.read(self.entry_line_size)
-            if not curr_data:
-                break
-            try:
-                doc_id, rev, start, size, status, next = self.entry_struct.unpack(
-                    curr_data)
-            except IndexException:
-                break
-            else:
-                if status != self.STATUS_D:
-                    yield doc_id, rev, start, size, status
-                    limit -= 1
+            if status == self.STATUS_D:
+                continue
+            if offset:
+                offset -= 1
+                continue
+            yield doc_id, rev, start, size, status
+            limit -= 1
 
     def get_many(self, *args, **kwargs):
         raise NotImplementedError()
 
+    def _drop_entry(self, entry):
+        # lost record is deleted, its space is not freed, it's not written
+        self.update(entry[0], b'00000000', 0, 0, self.STATUS_D)
+
     def delete(self, key, start=0, size=0):
+        old_start, old_size = self._find_key(key)[2:4]
         self.update(key, b'00000000', start, size, self.STATUS_D)
+        self.storage.free(old_start, old_size)
 
     def make_key_value(self, data):
         _id = data['_id']
@@ -754,9 +956,11 @@ class IU_UniqueHashIndex(IU_HashIndex):
         return self.insert(_id, _rev, start, size)
 
     def update_with_storage(self, _id, _rev, value):
+        old_start, old_size = self._find_key(_id)[2:4]
         if value:
-            start, size = self.storage.insert(value)
+            start, size = self.storage.replace(old_start, old_size, value)
         else:
+            self.storage.free(old_start, old_size)
             start = 1
             size = 0
         return self.update(_id, _rev, start, size)
@@ -789,6 +993,9 @@ class DummyHashIndex(IU_HashIndex):
     def get_many(self, *args, **kwargs):
         raise StopIteration
 
+    def get_multi(self, keys):
+        return [None] * len(keys)
+
     def delete(self, *args, **kwargs):
         pass
 
@@ -859,6 +1066,282 @@ class IU_MultiHashIndex(IU_HashIndex):
         raise NotImplementedError()
 
 
+class IU_LinearHashIndex(IU_HashIndex):
+    """
+    Hash index that grows with `Linear hashing`, instead of using fixed
+    ``hash_lim`` buckets. It starts with ``initial_buckets`` buckets and
+    splits one bucket at a time when there is more than ``load_factor``
+    entries per bucket, so chains stay short whatever the index size is.
+
+    Buckets are kept in ``<name>_dir`` file and are loaded to memory when
+    the index is opened, so finding chain start doesn't touch the disk.
+    """
+    def __init__(self,
+                 db_path,
+                 name,
+                 *args,
+                 initial_buckets=64,
+                 load_factor=0.75,
+                 **kwargs):
+        """
+        :param initial_buckets: number of buckets of the empty index
+        :type initial_buckets: integer
+        :param load_factor: average number of entries per bucket that causes bucket split
+        :type load_factor: float
+        """
+        super(IU_LinearHashIndex, self).__init__(db_path, name, *args,
+                                                 **kwargs)
+        self.initial_buckets = initial_buckets
+        self.load_factor = load_factor
+        self.data_start = self._start_ind + 2
+        self._dir = array('I')
+        self.entries = 0  # : number of live entries, saved in props on commit
+
+    def _fix_params(self):
+        # files made before it was saved count it from entries part size
+        self.entries = None
+        super(IU_LinearHashIndex, self)._fix_params()
+        self.data_start = self._start_ind + 2
+        self._set_level()
+
+    def _load_free_entries(self):
+        super(IU_LinearHashIndex, self)._load_free_entries()
+        if self.entries is None:
+            slots = (self.buckets.seek(0, 2) -
+                     self.data_start) // self.entry_line_size
+            self.entries = slots - len(self._free_entries)
+        self._saved_entries = self.entries
+
+    def create_index(self):
+        super(IU_LinearHashIndex, self).create_index()
+        self.entries = self._saved_entries = 0
+        self._save_params(
+            dict(initial_buckets=self.initial_buckets,
+                 load_factor=self.load_factor,
+                 entries=0))
+
+    def _save_entries(self):
+        if self.entries != self._saved_entries:
+            self._saved_entries = self.entries
+            self._save_params(dict(entries=self.entries))
+
+    def commit(self):
+        super(IU_LinearHashIndex, self).commit()
+        self._save_entries()
+
+    def _open_buckets(self):
+        super(IU_LinearHashIndex, self)._open_buckets()
+        path = os.path.join(self.db_path, self.name + "_dir")
+        if not os.path.isfile(path):
+            with io.open(path, 'wb') as f:
+                f.write(b'\x00' * self.bucket_line_size * self.initial_buckets)
+        self.directory = io.open(path, 'r+b', buffering=0)
+        self._dir = array('I')
+        self._dir.frombytes(self.directory.read())
+        if sys.byteorder == 'big':
+            self._dir.byteswap()
+        self._set_level()
+
+    def _load_bucket_table(self):
+        pass  # buckets are always in memory
+
+    def _set_level(self):
+        """
+        Computes split round and next bucket to split from buckets count
+        """
+        level = 0
+        while self.initial_buckets << (level + 1) <= len(self._dir):
+            level += 1
+        self._level = level
+        self._split = len(self._dir) - (self.initial_buckets << level)
+
+    def _calculate_position(self, key):
+        h = self._hash(key) & 0xffffffff
+        position = h % (self.initial_buckets << self._level)
+        if position < self._split:
+            position = h % (self.initial_buckets << (self._level + 1))
+        return position
+
+    def _read_bucket(self, position):
+        location = self._dir[position]
+        if not location:
+            return b''
+        return self.bucket_struct.pack(location)
+
+    def _write_bucket(self, position, location):
+        if position == len(self._dir):
+            self._dir.append(location)
+        else:
+            self._dir[position] = location
+        self.directory.seek(position * self.bucket_line_size)
+        self.directory.write(self.bucket_struct.pack(location))
+
+    def insert(self, *args, **kwargs):
+        super(IU_LinearHashIndex, self).insert(*args, **kwargs)
+        self.entries += 1
+        while self.entries > self.load_factor * len(self._dir):
+            self._split_bucket()
+        return True
+
+    def delete(self, *args, **kwargs):
+        super(IU_LinearHashIndex, self).delete(*args, **kwargs)
+        self.entries -= 1
+        return True
+
+    def _split_bucket(self):
+        """
+        Moves entries from the next bucket to split to the new bucket,
+        only `next` fields of entries are rewritten
+        """
+        old = self._split
+        new = old + (self.initial_buckets << self._level)
+        mod = self.initial_buckets << (self._level + 1)
+        chains = {old: [], new: []}
+        for location, entry in self._walk(self._dir[old]):
+            position = (self._hash(self._entry_key(entry)) & 0xffffffff) % mod
+            chains[position].append((location, entry))
+        for position, chain in chains.items():
+            for i, (location, entry) in enumerate(chain):
+                _next = chain[i + 1][0] if i + 1 < len(chain) else 0
+                if entry[-1] != _next:
+                    self.buckets.seek(location)
+                    self.buckets.write(
+                        self.entry_struct.pack(*(entry[:-1] + (_next, ))))
+            self._write_bucket(position, chain[0][0] if chain else 0)
+        self._split += 1
+        if self._split == self.initial_buckets << self._level:
+            self._level += 1
+            self._split = 0
+        self._locate_doc_id.clear()
+
+    def _bucket_locations(self):
+        return self._dir
+
+    def _move_buckets(self, new_name):
+        super(IU_LinearHashIndex, self)._move_buckets(new_name)
+        shutil.move(os.path.join(self.db_path, self.name + "_dir"),
+                    os.path.join(self.db_path, new_name + "_dir"))
+
+    def _close(self):
+        self._save_entries()
+        self.directory.close()
+        super(IU_LinearHashIndex, self)._close()
+
+    def destroy(self):
+        super(IU_LinearHashIndex, self).destroy()
+        os.unlink(os.path.join(self.db_path, self.name + "_dir"))
+
+    def fsync(self):
+        try:
+            os.fsync(self.directory.fileno())
+        except:
+            pass
+        super(IU_LinearHashIndex, self).fsync()
+
+    def _fsync_files(self):
+        os.fsync(self.directory.fileno())
+        super(IU_LinearHashIndex, self)._fsync_files()
+
+
+class IU_UniqueLinearHashIndex(IU_LinearHashIndex, IU_UniqueHashIndex):
+    """
+    :py:class:`IU_LinearHashIndex` for *unique* keys, can be used as **id** index.
+    """
+    pass
+
+
+class IU_PagedHashIndex(IU_HashIndex):
+    """
+    Hash index that keeps entries of every bucket together in pages of
+    ``page_entries`` entries, new page is added to the bucket only when
+    its pages are full. Walking the chain reads whole page at once, so
+    usually one read finds the key.
+
+    Each used bucket takes at least one page, so it uses less buckets
+    (``hash_lim``) than :py:class:`IU_HashIndex` by default.
+    """
+    def __init__(self, db_path, name, *args, page_entries=16, **kwargs):
+        """
+        :param page_entries: number of entries in one page
+        :type page_entries: integer
+        """
+        kwargs.setdefault('hash_lim', 0xffff)
+        super(IU_PagedHashIndex, self).__init__(db_path, name, *args, **kwargs)
+        self.page_entries = page_entries
+        self.page_size = self.entry_line_size * self.page_entries
+
+    def _fix_params(self):
+        super(IU_PagedHashIndex, self)._fix_params()
+        self.page_size = self.entry_line_size * self.page_entries
+
+    def create_index(self):
+        super(IU_PagedHashIndex, self).create_index()
+        self._save_params(dict(page_entries=self.page_entries))
+
+    def _page_start(self, location):
+        return location - (location - self.data_start) % self.page_size
+
+    def _walk(self, location):
+        pages = {}
+        while location:
+            page = self._page_start(location)
+            data = pages.get(page)
+            if data is None:
+                data = pages[page] = self._read_buckets(page, self.page_size)
+            entry = self.entry_struct.unpack_from(data, location - page)
+            yield location, entry
+            location = entry[-1]
+
+    def _entry_place(self, location, found_at):
+        # free slot in any page of the chain
+        pages = {}
+        while location:
+            page = self._page_start(location)
+            data = pages.get(page)
+            if data is None:
+                data = pages[page] = self._read_buckets(page, self.page_size)
+                for i, entry in enumerate(self.entry_struct.iter_unpack(data)):
+                    if entry[-2] == b'\x00':
+                        return page + i * self.entry_line_size
+            location = self.entry_struct.unpack_from(data, location - page)[-1]
+        if self._free_entries:
+            self._free_entries_changed = True
+            return self._free_entries.pop()
+        page = max(self.buckets.seek(0, 2), self.data_start)
+        self.buckets.seek(page)
+        self.buckets.write(b'\x00' * self.page_size)
+        return page
+
+    def _all_entries(self):
+        for data in self._scan_blocks(self.page_size):
+            for entry in self.entry_struct.iter_unpack(data):
+                if entry[-2] != b'\x00':
+                    yield entry
+
+    def _free_entry(self, location, entry):
+        """
+        Zeroes entry at ``location``, its slot is reused by its bucket.
+        Free entries list of paged index holds only starts of empty
+        pages, they are reused by any bucket.
+        """
+        self.buckets.seek(location)
+        self.buckets.write(b'\x00' * self.entry_line_size)
+        page = self._page_start(location)
+        if self._is_free(page):
+            self._free_entries.append(page)
+            self._free_entries_changed = True
+
+    def _is_free(self, location):
+        return not any(self._read_buckets(location, self.page_size))
+
+
+class IU_UniquePagedHashIndex(IU_PagedHashIndex, IU_UniqueHashIndex):
+    """
+    :py:class:`IU_PagedHashIndex` for *unique* keys, can be used as **id** index.
+    """
+    pass
+
+
 # classes for public use, done in this way because of
 # generation static files with indexes (_index directory)
 
@@ -881,3 +1364,31 @@ class MultiHashIndex(IU_MultiHashIndex):
     """
     That class is designed to be used in custom indexes.
     """
+
+
+class LinearHashIndex(IU_LinearHashIndex):
+    """
+    That class is designed to be used in custom indexes.
+    """
+    pass
+
+
+class UniqueLinearHashIndex(IU_UniqueLinearHashIndex):
+    """
+    That class is designed to be used in custom indexes. It can be **id** index.
+    """
+    pass
+
+
+class PagedHashIndex(IU_PagedHashIndex):
+    """
+    That class is designed to be used in custom indexes.
+    """
+    pass
+
+
+class UniquePagedHashIndex(IU_UniquePagedHashIndex):
+    """
+    That class is designed to be used in custom indexes. It can be **id** index.
+    """
+    pass
@@ -23,6 +23,8 @@ import struct
 import shutil
 
 from codernitydb3.storage import IU_Storage, DummyStorage
+from codernitydb3.readers import reader_for
+from codernitydb3.bloom import BloomFilter
 
 try:
     from codernitydb3 import __version__
@@ -74,24 +76,113 @@ class Index:
 
     custom_header = ""  # : use it for imports required by your index
 
+    mmap_reads = False  # : read buckets and storage through memory maps
+
+    storage_codec = None  # : codec name for new storage, check :py:func:`codernitydb3.storage.register_codec`
+
+    storage_reuse_space = False  # : overwrite updated values in place and reuse space of removed ones (id index)
+
+    bloom_capacity = 0  # : expected number of keys, when set the index keeps Bloom filter of its keys
+
+    bloom_error = 0.01  # : false positive rate of the Bloom filter
+
     def __init__(self, db_path, name):
         self.name = name
         self._start_ind = 500
         self.db_path = db_path
+        self.bloom = None
         # self.storage = None
 
     def open_index(self):
         if not os.path.isfile(os.path.join(self.db_path, self.name + '_buck')):
             raise IndexException("Doesn't exists")
+        self._open_buckets()
+        self._fix_params()
+        self._open_storage()
+        self._open_bloom()
+        self._drop_lost()
+
+    def _open_buckets(self):
         self.buckets = io.open(os.path.join(self.db_path, self.name + "_buck"),
                                'r+b',
                                buffering=0)
-        self._fix_params()
-        self._open_storage()
+        self._buckets_reader = reader_for(self.buckets, self.mmap_reads)
+
+    def _read_buckets(self, start, size):
+        """
+        Reads ``size`` bytes from ``start`` position of buckets file
+        """
+        return self._buckets_reader.read(start, size)
 
     def _close(self):
+        self._buckets_reader.close()
         self.buckets.close()
         self.storage.close()
+        if self.bloom is not None:
+            self.bloom.save(self._bloom_path())
+            self.bloom = None
+
+    def _bloom_path(self, name=None):
+        return os.path.join(self.db_path, (name or self.name) + '_bloom')
+
+    def _open_bloom(self, create=False):
+        """
+        Loads Bloom filter of the index (when :py:attr:`bloom_capacity` is
+        set). Filter that is missing or wasn't saved on close is rebuilt
+        from keys of the index.
+
+        :param create: start with empty filter
+        """
+        self.bloom = None
+        if not self.bloom_capacity:
+            return
+        bloom = None if create else BloomFilter.load(self._bloom_path())
+        if bloom is None:
+            keys = [] if create else list(self._all_keys())
+            bloom = BloomFilter.for_capacity(
+                max(self.bloom_capacity, len(keys)), self.bloom_error)
+            for key in keys:
+                bloom.add(key)
+        self.bloom = bloom
+
+    def _move_bloom(self, new_name):
+        path = self._bloom_path()
+        if os.path.exists(path):
+            shutil.move(path, self._bloom_path(new_name))
+
+    def _bloom_add(self, key):
+        if self.bloom is not None:
+            self.bloom.add(key)
+
+    def _all_keys(self):
+        """
+        Iterates over keys of all not deleted entries
+        """
+        for entry in self.all():
+            yield entry[1]
+
+    def _drop_lost(self):
+        """
+        Removes entries pointing past data committed to storage, when
+        storage was not closed cleanly (records that were still pending
+        then are lost)
+        """
+        if not self.storage.unclean:
+            return
+        end = self.storage.stable_end()
+        lost = [
+            entry for entry in self.all()
+            if entry[3] and entry[2] + entry[3] > end
+        ]
+        for entry in lost:
+            self._drop_entry(entry)
+        self.storage.unclean = False
+
+    def _drop_entry(self, entry):
+        """
+        Removes entry (as yielded by :py:meth:`all`) with lost record
+        """
+        self.delete(entry[0], entry[1], 0, 0)
 
     def close_index(self):
         self.flush()
@@ -121,6 +212,15 @@ class Index:
         self.buckets.seek(0, 2)
         self.__dict__.update(props)
 
+    def _configure_storage(self):
+        """
+        Passes index options to just created storage object
+        """
+        self.storage.mmap_reads = self.mmap_reads
+        self.storage.reuse_space = self.storage_reuse_space
+        if self.storage_codec:
+            self.storage.codec = self.storage_codec
+
     def _open_storage(self, *args, **kwargs):
         pass
 
@@ -145,6 +245,33 @@ class Index:
     def get_many(self, key, start_from=None, limit=0):
         raise NotImplementedError()
 
+    def get_multi(self, keys):
+        """
+        Finds many keys at once, indexes that can batch lookups override it.
+
+        :param keys: keys to find
+        :returns: list with result of :py:meth:`get` for every key,
+            ``None`` for keys that were not found
+        """
+        res = []
+        for key in keys:
+            try:
+                res.append(self.get(key))
+            except ElemNotFound:
+                res.append(None)
+        return res
+
+    def bulk_load(self, records, presorted=False):
+        """
+        Adds many records at once, indexes that can build their structure
+        faster from the whole stream override it.
+
+        :param records: iterable of ``(doc_id, key, start, size, status)``
+        :param presorted: ``True`` when records are already ordered by key
+        """
+        for doc_id, key, start, size, status in records:
+            self.insert(doc_id, key, start, size, status)
+
     def all(self, start_pos):
         raise NotImplementedError()
 
@@ -164,7 +291,12 @@ class Index:
         self._close()
         bucket_file = os.path.join(self.db_path, self.name + '_buck')
         os.unlink(bucket_file)
+        if os.path.exists(self._bloom_path()):
+            os.unlink(self._bloom_path())
         self._destroy_storage()
+        self._clear_cache()
+
+    def _clear_cache(self):
         self._find_key.clear()
 
     def flush(self):
@@ -174,6 +306,16 @@ class Index:
         except:
             pass
 
+    def commit(self):
+        """
+        Writes all pending data of the index and its storage.
+        """
+        try:
+            self.storage.commit()
+        except:
+            pass
+        self.flush()
+
     def fsync(self):
         try:
             os.fsync(self.buckets.fileno())
@@ -181,18 +323,28 @@ class Index:
         except:
             pass
 
-    def update_with_storage(self, doc_id, key, value):
+    def _fsync_files(self):
+        """
+        Syncs data already written to index files with disk, without
+        writing pending data, so it can be called from other thread
+        """
+        os.fsync(self.buckets.fileno())
+        self.storage._fsync_files()
+
+    def _store_value(self, value):
+        """
+        Writes ``value`` to storage of the index
+
+        :returns: ``(start, size)`` of the value, ``(1, 0)`` for no value
+        """
         if value:
-            start, size = self.storage.insert(value)
-        else:
-            start = 1
-            size = 0
+            return self.storage.insert(value)
+        return 1, 0
+
+    def update_with_storage(self, doc_id, key, value):
+        start, size = self._store_value(value)
         return self.update(doc_id, key, start, size)
 
     def insert_with_storage(self, doc_id, key, value):
-        if value:
-            start, size = self.storage.insert(value)
-        else:
-            start = 1
-            size = 0
+        start, size = self._store_value(value)
         return self.insert(doc_id, key, start, size)
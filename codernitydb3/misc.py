@@ -33,4 +33,15 @@ def random_hex_32():
 
 def random_hex_4(*args, **kwargs):
     s = '%04x' % randrange(256**2)
-    return s.encode('utf8')
\ No newline at end of file
+    return s.encode('utf8')
+
+
+def key_bytes(key):
+    """
+    Returns bytes that represent index key, for hashing. Bytes keys are
+    used as they are: keys that index finds are the same as read from
+    its entries (already padded to the key format size).
+    """
+    if isinstance(key, bytes):
+        return key
+    return repr(key).encode('utf8')
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Nick M. (https://github.com/nickmasster)
+# Copyright 2011-2013 Codernity (http://codernity.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Cache of decoded file pages, used by tree indexes"""
+
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+
+class _NoLock(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+class PageCache(object):
+    """
+    Least recently used cache of decoded pages of a file. Pages are
+    kept by their start position, total size of cached pages (bytes
+    they take in the file) is limited to ``max_bytes``.
+
+    Writers call :py:meth:`invalidate` with the written range, so every
+    page it overlaps is read again.
+    """
+    def __init__(self, max_bytes, lock=None):
+        """
+        :param max_bytes: size limit of cached pages
+        :param lock: lock object used when many threads share the cache
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._pages = OrderedDict()  # start: (size, page)
+        self._starts = []  # sorted starts of cached pages
+        self._max_page = 0
+        self._lock = lock or _NoLock()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, start):
+        """
+        Returns page that starts at ``start``, ``None`` when not cached
+        """
+        with self._lock:
+            try:
+                page = self._pages[start][1]
+            except KeyError:
+                return None
+            self._pages.move_to_end(start)
+            return page
+
+    def put(self, start, size, page):
+        """
+        Adds decoded ``page`` that takes ``size`` bytes from ``start``,
+        least recently used pages are removed to make room for it
+        """
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if start in self._pages:
+                self._remove(start)
+            while self.size + size > self.max_bytes:
+                self._remove(next(iter(self._pages)))
+            self._pages[start] = (size, page)
+            insort(self._starts, start)
+            self.size += size
+            self._max_page = max(self._max_page, size)
+
+    def invalidate(self, start, size):
+        """
+        Removes all pages that overlap ``size`` bytes from ``start``
+        """
+        with self._lock:
+            i = bisect_left(self._starts, start + size)
+            while i:
+                i -= 1
+                page_start = self._starts[i]
+                if page_start + self._max_page <= start:
+                    break  # this and earlier pages end before the range
+                if page_start + self._pages[page_start][0] > start:
+                    self._remove(page_start)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            del self._starts[:]
+            self.size = 0
+
+    def _remove(self, start):
+        size = self._pages.pop(start)[0]
+        del self._starts[bisect_left(self._starts, start)]
+        self.size -= size
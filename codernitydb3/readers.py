@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Nick M. (https://github.com/nickmasster)
+# Copyright 2011-2013 Codernity (http://codernity.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Positional readers used by storages and indexes"""
+
+import os
+import mmap
+
+
+class FileReader(object):
+    """
+    Reads data from given positions of a file object with seek + read
+    """
+    def __init__(self, f):
+        self._f = f
+
+    def read(self, start, size):
+        self._f.seek(start)
+        return self._f.read(size)
+
+    def read_view(self, start, size):
+        """
+        Same as :py:meth:`read`, returns memoryview
+        """
+        return memoryview(self.read(start, size))
+
+    def close(self):
+        pass
+
+
+class PositionalReader(FileReader):
+    """
+    Reads data from given positions of a file with ``os.pread``.
+
+    It doesn't move the file offset, so many threads can read
+    the same file at once.
+    """
+    def read(self, start, size):
+        return os.pread(self._f.fileno(), size, start)
+
+
+class MmapReader(FileReader):
+    """
+    Reads data from given positions of a file through a read only
+    memory map of it.
+
+    Files used by database are append only (or updated in place),
+    so when read goes past the mapped area, file is mapped again
+    with its current size. Previous map is closed (unless memoryviews
+    over it are still used, then garbage collector closes it), reads
+    that find it closed by another thread use the new map.
+    """
+    def __init__(self, f):
+        super(MmapReader, self).__init__(f)
+        self._map = None
+
+    def _remap(self):
+        size = os.fstat(self._f.fileno()).st_size
+        if size:
+            old = self._map
+            self._map = mmap.mmap(self._f.fileno(),
+                                  size,
+                                  access=mmap.ACCESS_READ)
+            if old is not None:
+                self._close_map(old)
+        return self._map
+
+    def _close_map(self, m):
+        try:
+            m.close()
+        except BufferError:
+            pass  # views are still used, garbage collector will close it
+
+    def _map_for(self, end):
+        m = self._map
+        if m is None or end > len(m):
+            m = self._remap()
+        return m
+
+    def read(self, start, size):
+        while True:
+            m = self._map_for(start + size)
+            if m is None:
+                return b''
+            try:
+                return m[start:start + size]
+            except ValueError:
+                pass  # closed by remap in another thread
+
+    def read_view(self, start, size):
+        """
+        Returns memoryview over the map, without copying data
+        """
+        while True:
+            m = self._map_for(start + size)
+            if m is None:
+                return memoryview(b'')
+            try:
+                return memoryview(m)[start:start + size]
+            except ValueError:
+                pass  # closed by remap in another thread
+
+    def close(self):
+        if self._map is not None:
+            self._close_map(self._map)
+            self._map = None
+
+
+def advise(f, advice):
+    """
+    Tells the kernel how file object ``f`` is going to be read, does
+    nothing when ``posix_fadvise`` is not available
+
+    :param advice: name of ``POSIX_FADV_*`` constant, like ``'SEQUENTIAL'``
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(f.fileno(), 0, 0, getattr(os, 'POSIX_FADV_' + advice))
+    except (OSError, ValueError):
+        pass  # only a hint
+
+
+#: True when readers don't share file offset (``os.pread`` is available)
+positional_reads = hasattr(os, 'pread')
+
+
+def reader_for(f, mmap_reads=False):
+    """
+    Returns reader object for file object ``f``
+    """
+    if mmap_reads:
+        return MmapReader(f)
+    if positional_reads:
+        return PositionalReader(f)
+    return FileReader(f)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Nick M. (https://github.com/nickmasster)
+# Copyright 2011-2013 Codernity (http://codernity.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Background release of disk space taken by removed records"""
+
+from threading import Thread, Event
+
+
+class SpaceReclaimer(Thread):
+    """
+    Thread that periodically runs
+    :py:meth:`codernitydb3.database.Database.reclaim_space` on database
+    indexes. Use it with thread safe databases only.
+
+    :param db: opened database
+    :param interval: seconds between runs
+    :param indexes: names of indexes to reclaim space of, all by default
+    """
+    def __init__(self, db, interval=60, indexes=None):
+        super(SpaceReclaimer, self).__init__(name='SpaceReclaimer')
+        self.daemon = True
+        self.db = db
+        self.interval = interval
+        self.indexes = indexes
+        self.released = 0  #: number of bytes released so far
+        self._stop_event = Event()
+
+    def reclaim(self):
+        """
+        Reclaims space of indexes once, returns number of released bytes
+        """
+        names = self.indexes or [index.name for index in self.db.indexes]
+        released = 0
+        for name in names:
+            if not self.db.opened:
+                break
+            released += self.db.reclaim_space(name)
+        self.released += released
+        return released
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            if not self.db.opened:
+                break
+            self.reclaim()
+
+    def stop(self):
+        """
+        Stops the thread and waits for it
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
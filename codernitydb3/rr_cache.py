@@ -29,9 +29,10 @@ def cache1lvl(maxsize=100):
             try:
                 result = cache1lvl[key]
             except KeyError:
-                if len(cache1lvl) == maxsize:
+                if len(cache1lvl) >= maxsize:
                     for i in range(maxsize // 10 or 1):
-                        del cache1lvl[choice(list(cache1lvl.keys()))]
+                        # pop, key may be already evicted by other reader
+                        cache1lvl.pop(choice(list(cache1lvl.keys())), None)
                 cache1lvl[key] = user_function(key, *args, **kwargs)
                 result = cache1lvl[key]
 
@@ -68,14 +69,18 @@ def cache2lvl(maxsize=100):
                 result = cache[args[0]][args[1]]
             except KeyError:
                 #                print wrapper.cache_size
-                if wrapper.cache_size == maxsize:
+                if wrapper.cache_size >= maxsize:
                     to_delete = maxsize // 10 or 1
                     for i in range(to_delete):
-                        key1 = choice(list(cache.keys()))
-                        key2 = choice(list(cache[key1].keys()))
-                        del cache[key1][key2]
-                        if not cache[key1]:
-                            del cache[key1]
+                        # other reader may evict the same entries
+                        try:
+                            key1 = choice(list(cache.keys()))
+                            inner = cache[key1]
+                            del inner[choice(list(inner.keys()))]
+                            if not inner:
+                                del cache[key1]
+                        except (KeyError, IndexError):
+                            pass
                     wrapper.cache_size -= to_delete
 
 
@@ -100,6 +100,22 @@ class ShardedIndex(Index):
         for curr in self.shards.values():
             curr.reindex()
 
+    def commit(self):
+        for curr in self.shards.values():
+            curr.commit()
+
+    def flush(self):
+        for curr in self.shards.values():
+            curr.flush()
+
+    def fsync(self):
+        for curr in self.shards.values():
+            curr.fsync()
+
+    def _fsync_files(self):
+        for curr in self.shards.values():
+            curr._fsync_files()
+
     def all(self, *args, **kwargs):
         for curr in self.shards.values():
             for now in curr.all(*args, **kwargs):
@@ -18,9 +18,20 @@
 """Storage module"""
 
 import os
+import sys
 import struct
 import marshal
+import pickle
+import zlib
 import io
+import errno
+import shutil
+import ctypes
+import ctypes.util
+import threading
+
+from codernitydb3.readers import reader_for
+from codernitydb3.misc import random_hex_32
 
 try:
     from codernitydb3 import __version__
@@ -32,10 +43,105 @@ class StorageException(Exception):
     pass
 
 
+#: storage header, version, separator, codec name, reserved space
+header_struct = struct.Struct("10s5s16s69s")
+
+_codecs = {}
+
+
+def register_codec(name, dumps, loads):
+    """
+    Registers codec that storages can use to serialize documents.
+
+    Codec name is saved in the storage header, so the codec has to be
+    registered (under the same name) every time such storage is opened.
+
+    :param name: codec name, up to 16 ascii characters
+    :param dumps: function that serializes object to bytes
+    :param loads: function that deserializes object from bytes
+    """
+    if len(name.encode('ascii')) > 16:
+        raise StorageException("Too long codec name: %r" % name)
+    _codecs[name] = (dumps, loads)
+
+
+def get_codec(name):
+    """
+    Returns ``(dumps, loads)`` functions for registered codec ``name``
+    """
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise StorageException("Unknown codec: %r" % name)
+
+
+def _pickle_dumps(data):
+    return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+register_codec('marshal', marshal.dumps, marshal.loads)
+register_codec('pickle', _pickle_dumps, pickle.loads)
+
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+
+def _load_fallocate():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError:
+        return None
+    for name in ('fallocate64', 'fallocate'):
+        fallocate = getattr(libc, name, None)
+        if fallocate is not None:
+            fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64,
+                                  ctypes.c_int64)
+            fallocate.restype = ctypes.c_int
+            return fallocate
+    return None
+
+
+_fallocate = _load_fallocate()
+
+#: True when disk space of file ranges can be released (Linux ``fallocate``)
+hole_punching = _fallocate is not None
+
+
+def punch_hole(f, start, end):
+    """
+    Releases disk blocks of file ``f`` between ``start`` and ``end``
+    positions, file size doesn't change and released range reads as zeros.
+    Only whole file system blocks are released, returns number
+    of released bytes (0 when file system doesn't support it).
+    """
+    if not hole_punching:
+        return 0
+    block = os.fstat(f.fileno()).st_blksize
+    start = -(-start // block) * block
+    end = end // block * block
+    if end <= start:
+        return 0
+    blocks = os.fstat(f.fileno()).st_blocks
+    res = _fallocate(f.fileno(), FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE,
+                     start, end - start)
+    if res != 0:
+        err = ctypes.get_errno()
+        if err in (errno.EOPNOTSUPP, errno.ENOSYS):
+            return 0
+        raise OSError(err, os.strerror(err))
+    # ranges punched before don't count
+    return max(blocks - os.fstat(f.fileno()).st_blocks, 0) * 512
+
+
 class DummyStorage:
     """
     Storage mostly used to fake real storage
     """
+
+    unclean = False
+
     def create(self, *args, **kwargs):
         pass
 
@@ -60,15 +166,42 @@ class DummyStorage:
     def update(self, *args, **kwargs):
         return 0, 0
 
+    def replace(self, *args, **kwargs):
+        return 0, 0
+
+    def free(self, *args, **kwargs):
+        pass
+
+    def stable_end(self, *args, **kwargs):
+        return 0
+
+    def punch_holes(self, *args, **kwargs):
+        return 0
+
     def get(self, *args, **kwargs):
         return None
 
+    def get_raw(self, *args, **kwargs):
+        return None
+
+    def move(self, *args, **kwargs):
+        pass
+
+    def copy_settings(self, *args, **kwargs):
+        pass
+
+    def commit(self, *args, **kwargs):
+        pass
+
     # def compact(self, *args, **kwargs):
     #     pass
 
     def fsync(self, *args, **kwargs):
         pass
 
+    def _fsync_files(self, *args, **kwargs):
+        pass
+
     def flush(self, *args, **kwargs):
         pass
 
@@ -77,24 +210,35 @@ class IU_Storage(object):
 
     __version__ = __version__
 
+    mmap_reads = False  #: serve reads from memory mapped storage file
+    merge_gap = 4 * 1024  #: :py:meth:`get_many` reads records closer than that with one read (bytes)
+    merge_limit = 1024 * 1024  #: max size of a single :py:meth:`get_many` read (bytes)
+    codec = 'marshal'  #: codec used by new storage, opened one uses codec from its header
+    reuse_space = False  #: overwrite replaced records in place and reuse space of freed ones
+    min_free = 16  #: smaller free extents are not tracked (bytes)
+    unclean = False  #: set on open when pending data could be lost, entries pointing past :py:meth:`stable_end` are invalid then
+
     def __init__(self, db_path, name='main'):
         self.db_path = db_path
         self.name = name
         self._header_size = 100
         self._f = None
+        self._reader = None
+        self._free = {}
+        self._set_codec(self.codec)
 
     def create(self):
         if os.path.exists(os.path.join(self.db_path, self.name + "_stor")):
             raise IOError("Storage already exists!")
         with io.open(os.path.join(self.db_path, self.name + "_stor"),
                      'wb') as f:
-            f.write(
-                struct.pack("10s90s", self.__version__.encode('utf8'),
-                            b'|||||'))
+            f.write(self._pack_header())
             f.close()
+        self._set_codec(self.codec)
         self._f = io.open(os.path.join(self.db_path, self.name + "_stor"),
                           'r+b',
                           buffering=0)
+        self._reader = reader_for(self._f, self.mmap_reads)
         self.flush()
         self._f.seek(0, 2)
 
@@ -104,31 +248,195 @@ class IU_Storage(object):
         self._f = io.open(os.path.join(self.db_path, self.name + "_stor"),
                           'r+b',
                           buffering=0)
+        self._reader = reader_for(self._f, self.mmap_reads)
+        self._read_header()
+        self._load_free()
         self.flush()
         self._f.seek(0, 2)
 
+    def _pack_header(self):
+        return header_struct.pack(self.__version__.encode('utf8'), b'|||||',
+                                  self.codec.encode('ascii'), b'')
+
+    def _unpack_header(self, header):
+        """
+        Sets codec saved in storage header,
+        storages without it are using marshal
+        """
+        codec = header_struct.unpack(header)[2].rstrip(b'\x00')
+        self._set_codec(codec.decode('ascii') if codec else 'marshal')
+
+    def _read_header(self):
+        self._unpack_header(self._reader.read(0, self._header_size))
+
+    def _set_codec(self, name):
+        self.codec = name
+        self._dumps, self._loads = get_codec(name)
+
+    @property
+    def _free_path(self):
+        return os.path.join(self.db_path, self.name + '_free')
+
+    def _load_free(self):
+        """
+        Loads free space list saved on close. The file is removed
+        right away, so after a crash storage starts with empty list
+        (free space is leaked until compaction, but never reused twice).
+        """
+        self._free = {}
+        if os.path.exists(self._free_path):
+            if self.reuse_space:
+                with io.open(self._free_path, 'rb') as f:
+                    self._free = marshal.loads(f.read())
+            os.unlink(self._free_path)
+
+    def _save_free(self):
+        if self._free:
+            with io.open(self._free_path, 'wb') as f:
+                f.write(marshal.dumps(self._free))
+            self._free = {}
+
+    def _move_free(self, name):
+        target = os.path.join(self.db_path, name + '_free')
+        if os.path.exists(target):
+            os.unlink(target)
+        if os.path.exists(self._free_path):
+            shutil.move(self._free_path, target)
+
     def destroy(self):
         os.unlink(os.path.join(self.db_path, self.name + '_stor'))
+        if os.path.exists(self._free_path):
+            os.unlink(self._free_path)
+
+    def move(self, name):
+        """
+        Moves files of closed storage to storage ``name``, replacing it.
+        Used by compaction.
+        """
+        shutil.move(os.path.join(self.db_path, self.name + '_stor'),
+                    os.path.join(self.db_path, name + '_stor'))
+        self._move_free(name)
+        self.name = name
+
+    def copy_settings(self, storage):
+        """
+        Prepares just created storage for raw records copied from
+        ``storage``. Used by compaction.
+        """
+        pass
 
     def close(self):
+        self._save_free()
+        self._reader.close()
         self._f.close()
         # self.flush()
         # self.fsync()
 
     def data_from(self, data):
-        return marshal.loads(data)
+        return self._loads(data)
 
     def data_to(self, data):
-        return marshal.dumps(data)
+        return self._dumps(data)
 
-    def save(self, data):
-        s_data = self.data_to(data)
+    def _write(self, s_data):
+        """
+        Appends already serialized data, returns its start position
+        """
         self._f.seek(0, 2)
         start = self._f.tell()
-        size = len(s_data)
         self._f.write(s_data)
+        return start
+
+    def _write_at(self, start, s_data):
+        """
+        Writes already serialized data over bytes from ``start`` position
+        """
+        self._f.seek(start)
+        self._f.write(s_data)
+
+    def _writable(self, start):
+        """
+        Tells if data from ``start`` position can be overwritten
+        """
+        return True
+
+    def _read(self, start, size):
+        """
+        Reads ``size`` bytes of serialized data from ``start`` position
+        """
+        return self._reader.read(start, size)
+
+    def free(self, start, size):
+        """
+        Marks ``size`` bytes from ``start`` position as not used anymore,
+        so they can be reused by next saves (when :py:attr:`reuse_space`
+        is set).
+
+        Free extents are kept in lists per size class (power of 2).
+        """
+        if self.reuse_space and size >= self.min_free and self._writable(
+                start):
+            self._free.setdefault(size.bit_length(), []).append((start, size))
+
+    def _allocate(self, size):
+        """
+        Takes free extent for ``size`` bytes, returns its start
+        or ``None`` when there is no such extent. Rest of the extent
+        is freed again.
+        """
+        size_class = size.bit_length()
+        for c in sorted(c for c in self._free if c >= size_class):
+            extents = self._free[c]
+            if c == size_class:
+                # extents of the same class may be too small,
+                # check only the latest ones to keep it cheap
+                for i in range(
+                        len(extents) - 1,
+                        max(len(extents) - 64, 0) - 1, -1):
+                    if extents[i][1] >= size:
+                        break
+                else:
+                    continue
+            else:
+                i = -1
+            start, e_size = extents.pop(i)
+            if not extents:
+                del self._free[c]
+            self.free(start + size, e_size - size)
+            return start
+        return None
+
+    def _store(self, s_data):
+        start = self._allocate(len(s_data)) if self._free else None
+        if start is None:
+            return self._write(s_data)
+        self._write_at(start, s_data)
+        return start
+
+    def save(self, data):
+        s_data = self.data_to(data)
+        start = self._store(s_data)
+        self.flush()
+        return start, len(s_data)
+
+    def replace(self, start, size, data):
+        """
+        Saves ``data`` that replaces record ``(start, size)``,
+        returns new ``(start, size)``.
+
+        With :py:attr:`reuse_space` set, data is written in place of the old
+        record when it fits, otherwise the old record space is freed.
+        Without it, it's the same as :py:meth:`save`.
+        """
+        s_data = self.data_to(data)
+        if self.reuse_space and len(s_data) <= size and self._writable(start):
+            self._write_at(start, s_data)
+            self.free(start + len(s_data), size - len(s_data))
+        else:
+            old_start, start = start, self._store(s_data)
+            self.free(old_start, size)
         self.flush()
-        return start, size
+        return start, len(s_data)
 
     def insert(self, data):
         return self.save(data)
@@ -136,18 +444,711 @@ class IU_Storage(object):
     def update(self, data):
         return self.save(data)
 
-    def get(self, start, size, status='c'):
-        if status == 'd':
+    def get(self, start, size, status=b'c'):
+        if status == b'd':
             return None
-        print(locals())
-        self._f.seek(start)
-        return self.data_from(self._f.read(size))
+        return self.data_from(self._read(start, size))
+
+    def _read_view(self, start, size):
+        """
+        Same as :py:meth:`_read`, returns memoryview
+        """
+        return self._reader.read_view(start, size)
+
+    def get_raw(self, start, size, status=b'c'):
+        """
+        Returns record serialized with :py:attr:`codec`, without decoding
+        it. It's a memoryview over read buffer, or over memory map
+        with :py:attr:`mmap_reads` (so it sees later in place updates,
+        copy it to keep it).
+        """
+        if status == b'd':
+            return None
+        return self._read_view(start, size)
+
+    def _can_merge(self, start, end):
+        """
+        Tells if bytes from ``start`` to ``end`` can be read with single
+        :py:meth:`_read` call
+        """
+        return True
+
+    def get_many(self, locations):
+        """
+        Gets many records at once, returns them in order of ``locations``.
+
+        Records are read in order of their positions, records that are
+        close to each other (:py:attr:`merge_gap`) are read with single
+        read call.
+
+        :param locations: list of ``(start, size, status)``, same as
+            :py:meth:`get` arguments
+        """
+        res = [None] * len(locations)
+        order = sorted(
+            (loc[0], i) for i, loc in enumerate(locations) if loc[2] != b'd')
+        run = []
+        run_start = run_end = 0
+        for start, i in order:
+            end = start + locations[i][1]
+            if run and (start - run_end > self.merge_gap
+                        or end - run_start > self.merge_limit
+                        or not self._can_merge(run_start, end)):
+                self._get_run(locations, run, run_start, run_end, res)
+                run = []
+            if not run:
+                run_start = start
+                run_end = end
+            run.append(i)
+            run_end = max(run_end, end)
+        if run:
+            self._get_run(locations, run, run_start, run_end, res)
+        return res
+
+    def _get_run(self, locations, run, run_start, run_end, res):
+        data = self._read(run_start, run_end - run_start)
+        for i in run:
+            start, size = locations[i][:2]
+            start -= run_start
+            res[i] = self.data_from(data[start:start + size])
+
+    def stable_end(self):
+        """
+        Returns position up to which stored data is not changed anymore,
+        records saved later are placed after it
+        """
+        return os.fstat(self._f.fileno()).st_size
+
+    def punch_holes(self, live, end):
+        """
+        Releases disk space between ``live`` records, up to ``end``
+        position (taken from :py:meth:`stable_end` before ``live`` records
+        were collected). Returns number of released bytes.
+
+        Storage with :py:attr:`reuse_space` set reuses that space itself,
+        so nothing is released then.
+
+        :param live: sorted list of ``(start, size)`` of records in use
+        """
+        if self.reuse_space or not hole_punching:
+            return 0
+        released = 0
+        pos = self._header_size
+        for start, size in live:
+            if start >= end:
+                break
+            if start > pos:
+                released += self._punch(pos, start)
+            pos = max(pos, start + size)
+        if end > pos:
+            released += self._punch(pos, end)
+        return released
+
+    def _punch(self, start, end):
+        return punch_hole(self._f, start, end)
 
     def flush(self):
         self._f.flush()
 
+    def commit(self):
+        """
+        Makes all saved data visible in the storage file.
+        Plain storage writes everything immediately, so it's just a flush.
+        """
+        self.flush()
+
+    def fsync(self):
+        os.fsync(self._f.fileno())
+
+    def _fsync_files(self):
+        """
+        Syncs already written data with disk, pending data is not written
+        """
+        os.fsync(self._f.fileno())
+
+
+class IU_BufferedStorage(IU_Storage):
+    """
+    Storage that groups appended records in memory and writes them
+    to the disk in batches (group commit).
+
+    Start positions are calculated from the tail offset tracked in memory,
+    so ``(start, size)`` returned by :py:meth:`save` stays valid after the
+    batch is written. Pending records are written when there is more than
+    :py:attr:`buffer_size` bytes of them, :py:attr:`buffer_time` seconds
+    after the first of them was saved, or when :py:meth:`commit` is called
+    (database flush and close).
+
+    Index entries may point to pending records, so when the storage was
+    not closed cleanly (``<name>_pending`` file is left) :py:attr:`unclean`
+    is set on open and the index drops entries that point past
+    the committed data.
+    """
+
+    buffer_size = 512 * 1024  #: commit when pending data is bigger than that (bytes)
+    buffer_time = 1.0  #: commit pending data that many seconds after it was saved, ``0`` disables it
+
+    def __init__(self, db_path, name='main'):
+        super(IU_BufferedStorage, self).__init__(db_path, name)
+        self._buffer = bytearray()
+        self._committed = 0
+        self._tail = 0
+        self._lock = threading.RLock()
+        self._timer = None
+
+    @property
+    def _pending_path(self):
+        return os.path.join(self.db_path, self.name + '_pending')
+
+    def _mark_pending(self):
+        with io.open(self._pending_path, 'wb'):
+            pass
+
+    def create(self):
+        super(IU_BufferedStorage, self).create()
+        self._committed = self._tail = self._f.tell()
+        self._mark_pending()
+
+    def open(self):
+        super(IU_BufferedStorage, self).open()
+        self._committed = self._tail = self._f.tell()
+        self.unclean = os.path.exists(self._pending_path)
+        self._mark_pending()
+
+    def close(self):
+        self.commit()
+        super(IU_BufferedStorage, self).close()
+        if os.path.exists(self._pending_path):
+            os.unlink(self._pending_path)
+
+    def destroy(self):
+        super(IU_BufferedStorage, self).destroy()
+        if os.path.exists(self._pending_path):
+            os.unlink(self._pending_path)
+
+    def _write(self, s_data):
+        with self._lock:
+            start = self._tail
+            if not self._buffer and self.buffer_time:
+                self._timer = threading.Timer(self.buffer_time,
+                                              self._timed_commit)
+                self._timer.daemon = True
+                self._timer.start()
+            self._buffer += s_data
+            self._tail += len(s_data)
+            if len(self._buffer) >= self.buffer_size:
+                self.commit()
+            return start
+
+    def _write_at(self, start, s_data):
+        with self._lock:
+            if start >= self._committed:
+                start -= self._committed
+                self._buffer[start:start + len(s_data)] = s_data
+            else:
+                super(IU_BufferedStorage, self)._write_at(start, s_data)
+
+    def _read(self, start, size):
+        with self._lock:
+            if start >= self._committed:
+                start -= self._committed
+                return bytes(self._buffer[start:start + size])
+            return super(IU_BufferedStorage, self)._read(start, size)
+
+    def _read_view(self, start, size):
+        with self._lock:
+            if start >= self._committed:
+                return memoryview(self._read(start, size))
+            return super(IU_BufferedStorage, self)._read_view(start, size)
+
+    def _can_merge(self, start, end):
+        return start >= self._committed or end <= self._committed
+
+    def stable_end(self):
+        return self._committed
+
+    def _timed_commit(self):
+        with self._lock:
+            if self._buffer:
+                self.commit()
+
+    def commit(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._buffer:
+                self._f.seek(self._committed)
+                self._f.write(self._buffer)
+                self._committed = self._tail
+                self._buffer = bytearray()
+            self._f.flush()
+
     def fsync(self):
+        self.commit()
+        super(IU_BufferedStorage, self).fsync()
+
+
+class IU_CompressedStorage(IU_Storage):
+    """
+    Storage that compresses every record with zlib (raw deflate),
+    using a preset dictionary trained on a sample of stored records.
+
+    Every record is framed with :py:attr:`frame_struct` (dictionary id,
+    compressed data length). Until enough records are seen
+    (:py:attr:`train_size` bytes of serialized data) records are
+    compressed without dictionary, then the dictionary is built from them
+    and saved in ``<name>_zdict`` file next to the storage. Call
+    :py:meth:`train` to build a new dictionary from another sample,
+    records written earlier keep using the old one.
+    """
+
+    frame_struct = struct.Struct('<BI')  #: dictionary id, compressed length
+    compress_level = 6  #: zlib compression level
+    train_size = 64 * 1024  #: serialized data collected before first dictionary is trained
+    zdict_size = 32 * 1024  #: max dictionary size (deflate window)
+
+    NO_DICT = 0  #: record compressed without dictionary
+    RAW = 0xff  #: record stored uncompressed, when compression doesn't help
+
+    def __init__(self, db_path, name='main'):
+        super(IU_CompressedStorage, self).__init__(db_path, name)
+        self._zdicts = [b'']
+        self._samples = []
+        self._samples_size = 0
+
+    @property
+    def _zdict_path(self):
+        return os.path.join(self.db_path, self.name + '_zdict')
+
+    def create(self):
+        super(IU_CompressedStorage, self).create()
+        self._zdicts = [b'']
+
+    def open(self):
+        super(IU_CompressedStorage, self).open()
+        self._zdicts = [b'']
+        if os.path.exists(self._zdict_path):
+            with io.open(self._zdict_path, 'rb') as f:
+                data = f.read()
+            pos = 0
+            while pos < len(data):
+                size = struct.unpack_from('<I', data, pos)[0]
+                self._zdicts.append(data[pos + 4:pos + 4 + size])
+                pos += 4 + size
+
+    def destroy(self):
+        super(IU_CompressedStorage, self).destroy()
+        if os.path.exists(self._zdict_path):
+            os.unlink(self._zdict_path)
+
+    def move(self, name):
+        target = os.path.join(self.db_path, name + '_zdict')
+        if os.path.exists(target):
+            os.unlink(target)
+        if os.path.exists(self._zdict_path):
+            shutil.move(self._zdict_path, target)
+        super(IU_CompressedStorage, self).move(name)
+
+    def copy_settings(self, storage):
+        """
+        Copied records are still compressed, so dictionaries of
+        ``storage`` are copied too
+        """
+        if os.path.exists(storage._zdict_path):
+            shutil.copyfile(storage._zdict_path, self._zdict_path)
+        self._zdicts = list(storage._zdicts)
+
+    def train(self, samples=None):
+        """
+        Builds new compression dictionary and returns its id.
+        New records will be compressed with it.
+
+        :param samples: serialized records to build dictionary from,
+            records collected by storage are used by default
+        """
+        if samples is None:
+            samples = self._samples
+        # deflate prefers matches close to the end of the dictionary,
+        # so the latest samples go last
+        zdict = b''.join(samples)[-self.zdict_size:]
+        if not zdict:
+            raise StorageException("No samples to train dictionary")
+        if len(self._zdicts) >= self.RAW:
+            raise StorageException("Too many dictionaries")
+        with io.open(self._zdict_path, 'ab') as f:
+            f.write(struct.pack('<I', len(zdict)) + zdict)
+            f.flush()
+            os.fsync(f.fileno())
+        self._zdicts.append(zdict)
+        self._samples = []
+        self._samples_size = 0
+        return len(self._zdicts) - 1
+
+    def _compress(self, data):
+        dict_id = len(self._zdicts) - 1
+        if dict_id == self.NO_DICT:
+            self._samples.append(data)
+            self._samples_size += len(data)
+            if self._samples_size >= self.train_size:
+                dict_id = self.train()
+        if dict_id == self.NO_DICT:
+            c = zlib.compressobj(self.compress_level, zlib.DEFLATED, -15)
+        else:
+            c = zlib.compressobj(self.compress_level, zlib.DEFLATED, -15, 9,
+                                 zlib.Z_DEFAULT_STRATEGY,
+                                 self._zdicts[dict_id])
+        c_data = c.compress(data) + c.flush()
+        if len(c_data) >= len(data):
+            dict_id, c_data = self.RAW, data
+        return self.frame_struct.pack(dict_id, len(c_data)) + c_data
+
+    def _decompress(self, data):
+        dict_id, size = self.frame_struct.unpack_from(data)
+        start = self.frame_struct.size
+        c_data = data[start:start + size]
+        if dict_id == self.RAW:
+            return c_data
+        if dict_id == self.NO_DICT:
+            d = zlib.decompressobj(-15)
+        else:
+            d = zlib.decompressobj(-15, self._zdicts[dict_id])
+        return d.decompress(c_data) + d.flush()
+
+    def data_from(self, data):
+        return super(IU_CompressedStorage,
+                     self).data_from(self._decompress(data))
+
+    def get_raw(self, start, size, status=b'c'):
+        """
+        Returns record serialized with :py:attr:`codec`, like
+        :py:meth:`IU_Storage.get_raw`, but it's not a view over file
+        data: the record is decompressed into a new buffer (a copy),
+        also with :py:attr:`mmap_reads`.
+        """
+        data = super(IU_CompressedStorage, self).get_raw(start, size, status)
+        if data is None:
+            return None
+        return memoryview(self._decompress(data))
+
+    def data_to(self, data):
+        return self._compress(super(IU_CompressedStorage, self).data_to(data))
+
+
+class IU_SegmentedStorage(IU_Storage):
+    """
+    Storage that keeps records in fixed size segment files
+    (``<name>_stor.00000``, ``<name>_stor.00001``, ...) instead of
+    a single ``<name>_stor`` file.
+
+    Record address is ``segment_id * segment_size + offset``. When a record
+    doesn't fit into the active segment, the segment is sealed (synced
+    and never written again) and a new one is started. ``<name>_stor``
+    keeps the storage header and the manifest (segment size and list
+    of segments). Sealed segments can be backed up, mmapped or dropped
+    (:py:meth:`drop_segment`) on their own. With :py:attr:`reuse_space`
+    only space in the active segment is reused.
+    """
+
+    segment_size = 64 * 1024 * 1024  #: size of a new storage segments (bytes)
+
+    def __init__(self, db_path, name='main'):
+        super(IU_SegmentedStorage, self).__init__(db_path, name)
+        self._segments = {}
+        self._active = None
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self.db_path, self.name + '_stor')
+
+    def segment_path(self, seg_id):
+        """
+        Returns path of segment ``seg_id`` file
+        """
+        return os.path.join(self.db_path, '%s_stor.%05d' % (self.name, seg_id))
+
+    def sealed_segments(self):
+        """
+        Returns ids of segments that are not written anymore
+        """
+        return sorted(k for k in self._segments if k != self._active)
+
+    def _save_manifest(self):
+        manifest = dict(segment_size=self.segment_size,
+                        segments=sorted(self._segments))
+        tmp_path = self._manifest_path + '_tmp'
+        with io.open(tmp_path, 'wb') as f:
+            f.write(self._pack_header() + marshal.dumps(manifest))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._manifest_path)
+
+    def _read_manifest(self):
+        with io.open(self._manifest_path, 'rb') as f:
+            data = f.read()
+        self._unpack_header(data[:self._header_size])
+        return marshal.loads(data[self._header_size:])
+
+    def _open_segment(self, seg_id, create=False):
+        path = self.segment_path(seg_id)
+        if create:
+            with io.open(path, 'wb') as f:
+                f.write(self._pack_header())
+        f = io.open(path, 'r+b', buffering=0)
+        self._segments[seg_id] = (f, reader_for(f, self.mmap_reads))
+        return f
+
+    def _activate(self, seg_id, create=False):
+        self._active = seg_id
+        self._f = self._open_segment(seg_id, create)
+        self._f.seek(0, 2)
+
+    def create(self):
+        if os.path.exists(self._manifest_path):
+            raise IOError("Storage already exists!")
+        self._set_codec(self.codec)
+        self._activate(0, create=True)
+        self._save_manifest()
+
+    def open(self):
+        if not os.path.exists(self._manifest_path):
+            raise IOError("Storage doesn't exists!")
+        manifest = self._read_manifest()
+        self.segment_size = manifest['segment_size']
+        for seg_id in manifest['segments'][:-1]:
+            self._open_segment(seg_id)
+        self._activate(manifest['segments'][-1])
+        self._load_free()
+
+    def close(self):
+        self._save_free()
+        for f, reader in self._segments.values():
+            reader.close()
+            f.close()
+        self._segments = {}
+        self._active = None
+
+    def destroy(self):
+        for seg_id in self._read_manifest()['segments']:
+            os.unlink(self.segment_path(seg_id))
+        os.unlink(self._manifest_path)
+        if os.path.exists(self._free_path):
+            os.unlink(self._free_path)
+
+    def move(self, name):
+        target = self.__class__(self.db_path, name)
+        if os.path.exists(target._manifest_path):
+            target.destroy()
+        for seg_id in self._read_manifest()['segments']:
+            shutil.move(self.segment_path(seg_id), target.segment_path(seg_id))
+        shutil.move(self._manifest_path, target._manifest_path)
+        self._move_free(name)
+        self.name = name
+
+    def drop_segment(self, seg_id):
+        """
+        Removes sealed segment ``seg_id``. Records from it
+        are not available anymore, so it should be called only when
+        segment has no live records.
+        """
+        if seg_id == self._active:
+            raise StorageException("Can't drop active segment")
+        f, reader = self._segments.pop(seg_id)
+        reader.close()
+        f.close()
+        self._save_manifest()
+        os.unlink(self.segment_path(seg_id))
+
+    def _seal(self):
+        self._free = {}
+        self.fsync()
+        self._activate(self._active + 1, create=True)
+        self._save_manifest()
+
+    def _write(self, s_data):
+        size = len(s_data)
+        if size > self.segment_size - self._header_size:
+            raise StorageException("Record bigger than storage segment")
+        self._f.seek(0, 2)
+        offset = self._f.tell()
+        if offset + size > self.segment_size:
+            self._seal()
+            offset = self._header_size
+        self._f.write(s_data)
+        return self._active * self.segment_size + offset
+
+    def _write_at(self, start, s_data):
+        self._f.seek(start - self._active * self.segment_size)
+        self._f.write(s_data)
+
+    def _writable(self, start):
+        return start // self.segment_size == self._active
+
+    def _can_merge(self, start, end):
+        return start // self.segment_size == (end - 1) // self.segment_size
+
+    def stable_end(self):
+        return self._active * self.segment_size + os.fstat(
+            self._f.fileno()).st_size
+
+    def _punch(self, start, end):
+        released = 0
+        while start < end:
+            seg_id, offset = divmod(start, self.segment_size)
+            seg_start = seg_id * self.segment_size
+            start = min(end, seg_start + self.segment_size)
+            try:
+                f = self._segments[seg_id][0]
+            except KeyError:
+                continue  # dropped segment
+            released += punch_hole(
+                f, max(offset, self._header_size),
+                min(start - seg_start,
+                    os.fstat(f.fileno()).st_size))
+        return released
+
+    def _segment_reader(self, start):
+        seg_id, offset = divmod(start, self.segment_size)
+        try:
+            return self._segments[seg_id][1], offset
+        except KeyError:
+            raise StorageException("No storage segment %d" % seg_id)
+
+    def _read(self, start, size):
+        reader, offset = self._segment_reader(start)
+        return reader.read(offset, size)
+
+    def _read_view(self, start, size):
+        reader, offset = self._segment_reader(start)
+        return reader.read_view(offset, size)
+
+
+class BlobWriter(object):
+    """
+    File like object that writes new blob, returned by
+    :py:meth:`BlobStore.create_blob`.
+
+    Data goes to a temporary file, blob becomes visible under
+    :py:attr:`blob_id` when writer is closed. When used as context
+    manager and exception is raised, blob is discarded.
+    """
+    def __init__(self, store, blob_id):
+        self.blob_id = blob_id
+        self._path = store.blob_path(blob_id)
+        self._tmp_path = self._path + '_tmp'
+        self._f = io.open(self._tmp_path, 'wb')
+        self.size = 0
+
+    @property
+    def closed(self):
+        return self._f.closed
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._f.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def close(self):
+        if self._f.closed:
+            return
+        self._f.flush()
         os.fsync(self._f.fileno())
+        self._f.close()
+        os.replace(self._tmp_path, self._path)
+
+    def discard(self):
+        """
+        Drops written data, blob is not created
+        """
+        self._f.close()
+        if os.path.exists(self._tmp_path):
+            os.unlink(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class BlobStore(object):
+    """
+    Keeps large values (attachments) out of the document storage,
+    every blob is a separate file in ``path`` directory.
+
+    Blobs are written and read in chunks, so they never pass through
+    codec and never sit in memory as a whole. Documents keep only blob
+    ids, blobs are not removed with documents that reference them.
+    """
+
+    chunk_size = 1024 * 1024  #: size of chunks copied by :py:meth:`put_blob` (bytes)
+
+    def __init__(self, path):
+        self.path = path
+
+    def blob_path(self, blob_id):
+        """
+        Returns path of blob ``blob_id`` file
+        """
+        if isinstance(blob_id, bytes):
+            blob_id = blob_id.decode('ascii')
+        if len(blob_id) != 32 or blob_id.strip('0123456789abcdef'):
+            raise StorageException("Invalid blob id: %r" % blob_id)
+        return os.path.join(self.path, blob_id)
+
+    def create_blob(self):
+        """
+        Returns :py:class:`BlobWriter` for a new blob
+        """
+        if not os.path.exists(self.path):
+            os.makedirs(self.path, exist_ok=True)
+        return BlobWriter(self, random_hex_32().decode('ascii'))
+
+    def put_blob(self, data):
+        """
+        Saves new blob, returns its id.
+
+        :param data: bytes or file like object to copy blob data from
+        """
+        with self.create_blob() as writer:
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                writer.write(data)
+            else:
+                shutil.copyfileobj(data, writer, self.chunk_size)
+        return writer.blob_id
+
+    def open_blob(self, blob_id):
+        """
+        Returns binary file object to read blob ``blob_id`` from
+        """
+        try:
+            return io.open(self.blob_path(blob_id), 'rb')
+        except FileNotFoundError:
+            raise StorageException("No blob %r" % blob_id)
+
+    def blob_size(self, blob_id):
+        """
+        Returns size of blob ``blob_id`` (bytes)
+        """
+        try:
+            return os.path.getsize(self.blob_path(blob_id))
+        except FileNotFoundError:
+            raise StorageException("No blob %r" % blob_id)
+
+    def delete_blob(self, blob_id):
+        """
+        Removes blob ``blob_id``
+        """
+        try:
+            os.unlink(self.blob_path(blob_id))
+        except FileNotFoundError:
+            raise StorageException("No blob %r" % blob_id)
 
 
 # classes for public use, done in this way because of
@@ -156,3 +1157,15 @@ class IU_Storage(object):
 
 class Storage(IU_Storage):
     pass
+
+
+class BufferedStorage(IU_BufferedStorage):
+    pass
+
+
+class CompressedStorage(IU_CompressedStorage):
+    pass
+
+
+class SegmentedStorage(IU_SegmentedStorage):
+    pass
@@ -21,12 +21,19 @@ import marshal
 import os
 import io
 import shutil
+import heapq
+import tempfile
+from bisect import bisect_left, bisect_right
+from itertools import chain, islice, takewhile
+from operator import itemgetter
 # from ipdb import set_trace
 
 from codernitydb3.env import cdb_environment
-from codernitydb3.storage import IU_Storage
+from codernitydb3.storage import (IU_Storage, BufferedStorage,
+                                  CompressedStorage, SegmentedStorage)
 from codernitydb3.index import Index, IndexException, DocIdNotFound, ElemNotFound, TryReindexException
-from codernitydb3.rr_cache import cache1lvl, cache2lvl
+from codernitydb3.rr_cache import cache1lvl
+from codernitydb3.page_cache import PageCache
 
 if cdb_environment.get('rlock_obj'):
     from codernitydb3 import patch
@@ -43,6 +50,46 @@ MOVE_BUFFER_PREV = 0
 MOVE_BUFFER_NEXT = 1
 
 
+def _read_run(f):
+    """
+    Yields records of sorted run written by :py:func:`_sorted_records`
+    """
+    while True:
+        try:
+            records = marshal.load(f)
+        except EOFError:
+            return
+        yield from records
+
+
+def _sorted_records(records, chunk_size, tmp_dir):
+    """
+    Yields ``records`` (as used by bulk loads) ordered by key. Streams
+    longer than ``chunk_size`` are split into sorted runs kept in
+    temporary files in ``tmp_dir``, that are merged at the end.
+    """
+    by_key = itemgetter(1)
+    records = iter(records)
+    runs = []
+    try:
+        while True:
+            chunk = sorted(islice(records, chunk_size), key=by_key)
+            if not runs and len(chunk) < chunk_size:
+                yield from chunk
+                return
+            if not chunk:
+                break
+            run = tempfile.TemporaryFile(dir=tmp_dir)
+            runs.append(run)
+            for i in range(0, len(chunk), 1000):
+                marshal.dump(chunk[i:i + 1000], run)
+            run.seek(0)
+        yield from heapq.merge(*[_read_run(run) for run in runs], key=by_key)
+    finally:
+        for run in runs:
+            run.close()
+
+
 class NodeCapacityException(IndexException):
     pass
 
@@ -54,6 +101,12 @@ class IU_TreeBasedIndex(Index):
     TYPE_LEAF = b'l'
     TYPE_NODE = b'n'
 
+    page_cache_bytes = 4 * 1024 * 1024  # : size of nodes and leaves kept decoded in memory (as stored in file), 0 disables the cache
+
+    bulk_fill_factor = 0.9  # : part of leaves and nodes filled by :py:meth:`bulk_load` (compact, reindex), the rest is left for later inserts
+
+    bulk_sort_chunk = 100000  # : records sorted in memory by :py:meth:`bulk_load`, longer streams are sorted in chunks on disk and merged
+
     def __init__(self,
                  db_path,
                  name,
@@ -80,23 +133,12 @@ class IU_TreeBasedIndex(Index):
         self.storage_class = storage_class
         self.storage = None
         cache = cache1lvl(100)
-        twolvl_cache = cache2lvl(150)
         self._find_key = cache(self._find_key)
         self._match_doc_id = cache(self._match_doc_id)
-        # self._read_single_leaf_record =
-        # twolvl_cache(self._read_single_leaf_record)
-        self._find_key_in_leaf = twolvl_cache(self._find_key_in_leaf)
-        self._read_single_node_key = twolvl_cache(self._read_single_node_key)
-        self._find_first_key_occurence_in_node = twolvl_cache(
-            self._find_first_key_occurence_in_node)
-        self._find_last_key_occurence_in_node = twolvl_cache(
-            self._find_last_key_occurence_in_node)
-        self._read_leaf_nr_of_elements = cache(self._read_leaf_nr_of_elements)
-        self._read_leaf_neighbours = cache(self._read_leaf_neighbours)
-        self._read_leaf_nr_of_elements_and_neighbours = cache(
-            self._read_leaf_nr_of_elements_and_neighbours)
-        self._read_node_nr_of_elements_and_children_flag = cache(
-            self._read_node_nr_of_elements_and_children_flag)
+        lock_obj = cdb_environment.get('rlock_obj')
+        self._pages = PageCache(self.page_cache_bytes,
+                                lock_obj() if lock_obj else None)
+        self._changes = 0  # writes to buckets, see _scan
 
     def _count_props(self):
         """
@@ -130,6 +172,15 @@ class IU_TreeBasedIndex(Index):
                                                  self.leaf_heading_format)
         self.node_heading_size = struct.calcsize('<' +
                                                  self.node_heading_format)
+        self._leaf_heading_struct = struct.Struct('<' +
+                                                  self.leaf_heading_format)
+        self._leaf_record_struct = struct.Struct(
+            '<' + self.single_leaf_record_format)
+        self._node_heading_struct = struct.Struct('<' +
+                                                  self.node_heading_format)
+        self._node_body_struct = struct.Struct(
+            '<' + self.pointer_format +
+            (self.key_format + self.pointer_format) * self.node_capacity)
 
     def create_index(self):
         if os.path.isfile(os.path.join(self.db_path, self.name + '_buck')):
@@ -144,16 +195,18 @@ class IU_TreeBasedIndex(Index):
                          key_format=self.key_format,
                          meta_format=self.meta_format,
                          version=self.__version__,
-                         storage_class=self.storage_class)
+                         storage_class=self.storage_class,
+                         free_leaf=0,
+                         free_node=0)
             f.write(marshal.dumps(props))
-        self.buckets = io.open(os.path.join(self.db_path, self.name + "_buck"),
-                               'r+b',
-                               buffering=0)
+        self.free_leaf = self.free_node = 0
+        self._free_pages_changed = False
+        self._open_buckets()
         self._create_storage()
-        self.buckets.seek(self._start_ind)
-        self.buckets.write(struct.pack('<c', self.TYPE_LEAF))
+        self._write_buckets(self._start_ind, struct.pack('<c', self.TYPE_LEAF))
         self._insert_empty_root()
         self.root_flag = self.TYPE_LEAF
+        self._open_bloom(create=True)
 
     def destroy(self):
         super(IU_TreeBasedIndex, self).destroy()
@@ -162,69 +215,388 @@ class IU_TreeBasedIndex(Index):
     def open_index(self):
         if not os.path.isfile(os.path.join(self.db_path, self.name + '_buck')):
             raise IndexException("Doesn't exists")
-        self.buckets = io.open(os.path.join(self.db_path, self.name + "_buck"),
-                               'r+b',
-                               buffering=0)
-        self.buckets.seek(self._start_ind)
-        self.root_flag = struct.unpack('<c', self.buckets.read(1))[0]
+        self._open_buckets()
+        self.root_flag = struct.unpack('<c',
+                                       self._read_buckets(self._start_ind,
+                                                          1))[0]
         self._fix_params()
         self._open_storage()
+        self._open_bloom()
+        self._drop_lost()
 
     def _insert_empty_root(self):
-        self.buckets.seek(self.data_start)
         root = struct.pack('<' + self.leaf_heading_format, 0, 0, 0)
         root += self.single_leaf_record_size * self.node_capacity * b'\x00'
-        self.buckets.write(root)
+        self._write_buckets(self.data_start, root)
         self.flush()
 
     def insert(self, doc_id, key, start, size, status=None):
         status = status or self.STATUS_O
+        self._bloom_add(key)
         nodes_stack, indexes = self._find_leaf_to_insert(key)
         self._insert_new_record_into_leaf(nodes_stack.pop(), key, doc_id,
                                           start, size, status, nodes_stack,
                                           indexes)
+        self._save_free_pages()
 
         self._match_doc_id.delete(doc_id)
 
-    def _read_leaf_nr_of_elements_and_neighbours(self, leaf_start):
+    def bulk_load(self, records, presorted=False):
+        """
+        Builds empty index from ``records`` bottom-up. Leaves are packed
+        to :py:attr:`bulk_fill_factor` and written in one sequential pass,
+        then every level of nodes is made from first keys of the level
+        below, up to the root. Index that already has records gets them
+        one by one.
+
+        :param records: iterable of ``(doc_id, key, start, size, status)``
+        :param presorted: ``True`` when records are already ordered by
+            key, otherwise they are sorted (stable, so records with equal
+            keys keep their order)
+        """
+        if self.root_flag != self.TYPE_LEAF or self._read_leaf_nr_of_elements(
+                self.data_start):
+            return super(IU_TreeBasedIndex, self).bulk_load(records)
+        if not presorted:
+            records = _sorted_records(records, self.bulk_sort_chunk,
+                                      self.db_path)
+        if self.free_leaf or self.free_node:
+            # all pages are written again from the root
+            self.free_leaf = self.free_node = 0
+            self._free_pages_changed = True
+        leaf_capacity = max(
+            1,
+            min(self.node_capacity,
+                int(self.node_capacity * self.bulk_fill_factor)))
+        # at least 4 children, so balanced groups never get less than 2
+        node_children = max(
+            4,
+            min(self.node_capacity + 1,
+                int((self.node_capacity + 1) * self.bulk_fill_factor)))
+        leaves = self._bulk_leaves(records, leaf_capacity)
+        first = next(leaves, None)
+        if first is None:
+            return
+        second = next(leaves, None)
+        if second is None:
+            # everything fits into the root leaf
+            self._write_buckets(self.data_start, self._bulk_leaf(first, 0, 0))
+        else:
+            level = self._bulk_write_leaves(chain((first, second), leaves))
+            children_flag = self.TYPE_LEAF
+            while len(level) > node_children:
+                level = self._bulk_write_nodes(level, children_flag,
+                                               node_children)
+                children_flag = self.TYPE_NODE
+            self._write_buckets(self.data_start,
+                                self._bulk_node(level, children_flag))
+            self._write_buckets(self._start_ind,
+                                struct.pack('<c', self.TYPE_NODE))
+            self.root_flag = self.TYPE_NODE
+        self.flush()
+        self._clear_cache()
+
+    def _bulk_leaves(self, records, leaf_capacity):
+        """
+        Groups sorted records into leaves
+
+        :returns: generator of ``(first_key, nr_of_elements, records_data)``
+        """
+        pack = self._leaf_record_struct.pack
+        status_o = self.STATUS_O
+        bloom = self.bloom
+        leaf = []
+        first_key = None
+        for doc_id, key, start, size, status in records:
+            if bloom is not None:
+                bloom.add(key)
+            if not leaf:
+                first_key = key
+            leaf.append(pack(key, doc_id, start, size, status or status_o))
+            if len(leaf) == leaf_capacity:
+                yield first_key, len(leaf), b''.join(leaf)
+                leaf = []
+        if leaf:
+            yield first_key, len(leaf), b''.join(leaf)
+
+    def _bulk_leaf(self, leaf, prev_leaf, next_leaf):
+        first_key, nr_of_elements, data = leaf
+        return (self._leaf_heading_struct.pack(nr_of_elements, prev_leaf,
+                                               next_leaf) + data +
+                (self.node_capacity - nr_of_elements) *
+                self.single_leaf_record_size * b'\x00')
+
+    def _bulk_node(self, children, children_flag):
+        """
+        Packs node with ``children`` (list of ``(first_key, pointer)``),
+        first key of every child but the first one separates it from the
+        previous child
+        """
+        values = [children[0][1]]
+        for key, pointer in children[1:]:
+            values.append(key)
+            values.append(pointer)
+        nr_of_keys = len(children) - 1
+        return (self._node_heading_struct.pack(nr_of_keys, children_flag) +
+                struct.pack(
+                    '<' + self.pointer_format +
+                    (self.key_format + self.pointer_format) * nr_of_keys, *
+                    values) + (self.node_capacity - nr_of_keys) *
+                (self.key_size + self.pointer_size) * b'\x00')
+
+    def _bulk_write_leaves(self, leaves):
+        """
+        Writes linked leaves one after another, they start right after
+        the root node
+
+        :returns: list of ``(first_key, leaf_start)``
+        """
+        level = []
+        pages = []
+        prev_leaf = 0
+        leaf_start = self.data_start + self.node_size
         self.buckets.seek(leaf_start)
-        data = self.buckets.read(self.elements_counter_size +
-                                 2 * self.pointer_size)
-        nr_of_elements, prev_l, next_l = struct.unpack(
-            '<' + self.elements_counter_format + 2 * self.pointer_format, data)
-        return nr_of_elements, prev_l, next_l
+        leaf = next(leaves)
+        for following in chain(leaves, (None, )):
+            next_leaf = leaf_start + self.leaf_size if following else 0
+            pages.append(self._bulk_leaf(leaf, prev_leaf, next_leaf))
+            level.append((leaf[0], leaf_start))
+            if len(pages) == 1024:
+                self.buckets.write(b''.join(pages))
+                pages = []
+            prev_leaf, leaf_start, leaf = leaf_start, next_leaf, following
+        self.buckets.write(b''.join(pages))
+        return level
+
+    def _bulk_write_nodes(self, level, children_flag, node_children):
+        """
+        Appends nodes for pages of ``level``, they are split into
+        groups of as equal size as possible
 
-    def _read_node_nr_of_elements_and_children_flag(self, start):
+        :returns: list of ``(first_key, node_start)``
+        """
+        nr_of_nodes = -(-len(level) // node_children)
+        size, bigger = divmod(len(level), nr_of_nodes)
+        self.buckets.seek(0, 2)  # end of file
+        node_start = self.buckets.tell()
+        upper = []
+        pages = []
+        i = 0
+        for nr in range(nr_of_nodes):
+            children = level[i:i + size + (nr < bigger)]
+            i += len(children)
+            pages.append(self._bulk_node(children, children_flag))
+            upper.append((children[0][0], node_start))
+            node_start += self.node_size
+        self.buckets.write(b''.join(pages))
+        return upper
+
+    def _leaf_page(self, leaf_start):
+        """
+        Returns leaf ``(TYPE_LEAF, nr_of_elements, prev_leaf, next_leaf,
+        data, records)``, read with single call and kept in page cache.
+        Records are decoded on first use (``None`` until then).
+        """
+        page = self._pages.get(leaf_start)
+        if page is None or page[0] != self.TYPE_LEAF:
+            data = self._read_buckets(leaf_start, self.leaf_size)
+            nr_of_elements, prev_l, next_l = self._leaf_heading_struct.unpack_from(
+                data)
+            page = (self.TYPE_LEAF, nr_of_elements, prev_l, next_l, data,
+                    [None] * self.node_capacity)
+            self._pages.put(leaf_start, self.leaf_size, page)
+        return page
+
+    def _node_page(self, node_start):
+        """
+        Returns decoded node ``(TYPE_NODE, nr_of_elements, children_flag,
+        keys, pointers)``, read with single call and kept in page cache
+        """
+        page = self._pages.get(node_start)
+        if page is None or page[0] != self.TYPE_NODE:
+            data = self._read_buckets(node_start, self.node_size)
+            nr_of_elements, children_flag = self._node_heading_struct.unpack_from(
+                data)
+            body = self._node_body_struct.unpack_from(data,
+                                                      self.node_heading_size)
+            page = (self.TYPE_NODE, nr_of_elements, children_flag, body[1::2],
+                    body[0::2])
+            self._pages.put(node_start, self.node_size, page)
+        return page
+
+    def _write_buckets(self, start, data):
+        """
+        Writes ``data`` at ``start`` position of buckets file,
+        cached pages that it changes are dropped
+        """
         self.buckets.seek(start)
-        data = self.buckets.read(self.elements_counter_size + self.flag_size)
-        nr_of_elements, children_flag = struct.unpack(
-            '<' + self.elements_counter_format + self.flag_format, data)
-        return nr_of_elements, children_flag
+        self.buckets.write(data)
+        self._pages.invalidate(start, len(data))
+        self._changes += 1
+
+    def _new_page(self, page_type):
+        """
+        Returns start of page for new leaf or node. Pages freed by
+        deletes are used first, then the file grows.
+        """
+        name = 'free_leaf' if page_type == self.TYPE_LEAF else 'free_node'
+        page_start = getattr(self, name)
+        if page_start:
+            setattr(
+                self, name,
+                struct.unpack(
+                    '<' + self.pointer_format,
+                    self._read_buckets(page_start, self.pointer_size))[0])
+            self._free_pages_changed = True
+            return page_start
+        self.buckets.seek(0, 2)  # end of file
+        # root leaf is split into root node and leaf that overlap it
+        return max(self.buckets.tell(),
+                   self.data_start + self.node_size + self.leaf_size)
+
+    def _free_page(self, page_start, page_type):
+        """
+        Adds page to list of free pages of its type, each free page
+        starts with pointer to the next one
+        """
+        name = 'free_leaf' if page_type == self.TYPE_LEAF else 'free_node'
+        self._write_buckets(
+            page_start,
+            struct.pack('<' + self.pointer_format, getattr(self, name)))
+        setattr(self, name, page_start)
+        self._free_pages_changed = True
+
+    def _save_free_pages(self):
+        """
+        Saves first pages of free lists in index props, when they changed
+        """
+        if self._free_pages_changed:
+            self._free_pages_changed = False
+            self._save_params(
+                dict(free_leaf=self.free_leaf, free_node=self.free_node))
+
+    def flush(self):
+        self._save_free_pages()
+        super(IU_TreeBasedIndex, self).flush()
+
+    def _scan(self,
+              records,
+              limit=-1,
+              reverse=False,
+              start=None,
+              end=None,
+              inclusive_start=True,
+              inclusive_end=True,
+              key=None):
+        """
+        Passes ``records`` of a range scan, :py:meth:`all` or of
+        :py:meth:`get_many` for ``key``. Scan can be paused between
+        records, when index was written in the meantime it's started
+        again from the root after the last passed record, so it never
+        continues from records that were moved or from reused pages.
+        """
+        last_key = None
+        passed = set()  # doc ids passed with last_key
+        while True:
+            changes = self._changes
+            for record in records:
+                curr_key = key if key is not None else record[1]
+                if curr_key != last_key:
+                    last_key = curr_key
+                    passed = set()
+                elif record[0] in passed:
+                    continue
+                passed.add(record[0])
+                yield record
+                limit -= 1
+                if not limit:
+                    return
+                if self._changes != changes:
+                    break
+            else:
+                return
+            if key is not None:
+                records = self._find_key_many(key, -1, 0)
+            elif reverse:
+                records = self._find_key_equal_and_smaller(last_key, -1, 0)
+                if start is not None:
+                    records = self._find_key_between_reversed(
+                        records, start, -1, inclusive_start)
+            elif end is None:
+                records = self._find_key_equal_and_bigger(last_key, -1, 0)
+            else:
+                records = self._find_key_between(last_key, end, -1, 0, True,
+                                                 inclusive_end)
+
+    def _write_leaf(self, leaf_start, records, prev_leaf, next_leaf):
+        """
+        Writes whole leaf with ``records`` (list of ``(key, doc_id,
+        start, size, status)``)
+        """
+        pack = self._leaf_record_struct.pack
+        data = b''.join([pack(*record) for record in records])
+        self._write_buckets(
+            leaf_start,
+            self._bulk_leaf((None, len(records), data), prev_leaf, next_leaf))
+
+    def _write_node(self, node_start, keys, pointers, children_flag):
+        """
+        Writes whole node, ``pointers`` has one more element than ``keys``
+        """
+        children = [(None, pointers[0])]
+        children.extend(zip(keys, pointers[1:]))
+        self._write_buckets(node_start,
+                            self._bulk_node(children, children_flag))
+
+    def _read_leaf_nr_of_elements_and_neighbours(self, leaf_start):
+        return self._leaf_page(leaf_start)[1:4]
+
+    def _read_node_nr_of_elements_and_children_flag(self, start):
+        return self._node_page(start)[1:3]
 
     def _read_leaf_nr_of_elements(self, start):
-        self.buckets.seek(start)
-        data = self.buckets.read(self.elements_counter_size)
-        nr_of_elements = struct.unpack('<' + self.elements_counter_format,
-                                       data)
-        return nr_of_elements[0]
+        return self._leaf_page(start)[1]
 
     def _read_single_node_key(self, node_start, key_index):
-        self.buckets.seek(
-            self._calculate_key_position(node_start, key_index,
-                                         self.TYPE_NODE))
-        data = self.buckets.read(self.single_node_record_size)
-        flag_left, key, pointer_right = struct.unpack(
-            '<' + self.single_node_record_format, data)
-        return flag_left, key, pointer_right
+        if not 0 <= key_index < self.node_capacity:
+            # outside of the node (searches in empty ones)
+            data = self._read_buckets(
+                self._calculate_key_position(node_start, key_index,
+                                             self.TYPE_NODE),
+                self.single_node_record_size)
+            return struct.unpack('<' + self.single_node_record_format, data)
+        page = self._node_page(node_start)
+        return page[4][key_index], page[3][key_index], page[4][key_index + 1]
 
     def _read_single_leaf_record(self, leaf_start, key_index):
-        self.buckets.seek(
-            self._calculate_key_position(leaf_start, key_index,
-                                         self.TYPE_LEAF))
-        data = self.buckets.read(self.single_leaf_record_size)
-        key, doc_id, start, size, status = struct.unpack(
-            '<' + self.single_leaf_record_format, data)
-        return key, doc_id, start, size, status
+        if not 0 <= key_index < self.node_capacity:
+            # outside of the leaf (searches in empty ones)
+            data = self._read_buckets(
+                self._calculate_key_position(leaf_start, key_index,
+                                             self.TYPE_LEAF),
+                self.single_leaf_record_size)
+            return struct.unpack('<' + self.single_leaf_record_format, data)
+        page = self._leaf_page(leaf_start)
+        record = page[5][key_index]
+        if record is None:
+            record = page[5][key_index] = self._leaf_record_struct.unpack_from(
+                page[4],
+                self._calculate_key_position(0, key_index, self.TYPE_LEAF))
+        return record
+
+    def _read_leaf_records(self, leaf_start, nr_of_elements):
+        """
+        Returns first ``nr_of_elements`` records of the leaf
+
+        :returns: list of ``(key, doc_id, start, size, status)``
+        """
+        page = self._leaf_page(leaf_start)
+        records = page[5]
+        if None in records[:nr_of_elements]:
+            records[:nr_of_elements] = self._leaf_record_struct.iter_unpack(
+                page[4][self.leaf_heading_size:self._calculate_key_position(
+                    0, nr_of_elements, self.TYPE_LEAF)])
+        return records[:nr_of_elements]
 
     def _calculate_key_position(self, start, key_index, flag):
         """
@@ -289,46 +661,22 @@ class IU_TreeBasedIndex(Index):
                     curr_key_index = 0
 
     def _update_element(self, leaf_start, key_index, new_data):
-        self.buckets.seek(
+        self._write_buckets(
             self._calculate_key_position(leaf_start, key_index, self.TYPE_LEAF)
-            + self.key_size)
-        self.buckets.write(struct.pack('<' + self.meta_format, *new_data))
+            + self.key_size, struct.pack('<' + self.meta_format, *new_data))
 
-    def _delete_element(self, leaf_start, key_index):
-        self.buckets.seek(
-            self._calculate_key_position(leaf_start, key_index, self.TYPE_LEAF)
-            + self.single_leaf_record_size - 1)
-        self.buckets.write(struct.pack('<c', self.STATUS_D))
-
-    def _leaf_linear_key_search(self, key, start, start_index, end_index):
-        self.buckets.seek(start)
-        data = self.buckets.read(
-            (end_index - start_index + 1) * self.single_leaf_record_size)
-        curr_key = struct.unpack('<' + self.key_format,
-                                 data[:self.key_size])[0]
-        data = data[self.single_leaf_record_size:]
-        curr_index = 0
-        while curr_key != key:
+    def _leaf_linear_key_search(self, key, leaf_start, start_index, end_index):
+        curr_index = start_index
+        while self._read_single_leaf_record(leaf_start, curr_index)[0] != key:
             curr_index += 1
-            curr_key = struct.unpack('<' + self.key_format,
-                                     data[:self.key_size])[0]
-            data = data[self.single_leaf_record_size:]
-        return start_index + curr_index
-
-    def _node_linear_key_search(self, key, start, start_index, end_index):
-        self.buckets.seek(start + self.pointer_size)
-        data = self.buckets.read((end_index - start_index + 1) *
-                                 (self.key_size + self.pointer_size))
-        curr_key = struct.unpack('<' + self.key_format,
-                                 data[:self.key_size])[0]
-        data = data[self.key_size + self.pointer_size:]
-        curr_index = 0
-        while curr_key != key:
+        return curr_index
+
+    def _node_linear_key_search(self, key, node_start, start_index, end_index):
+        keys = self._node_page(node_start)[3]
+        curr_index = start_index
+        while keys[curr_index] != key:
             curr_index += 1
-            curr_key = struct.unpack('<' + self.key_format,
-                                     data[:self.key_size])[0]
-            data = data[self.key_size + self.pointer_size:]
-        return start_index + curr_index
+        return curr_index
 
     def _next_buffer(self, buffer_start, buffer_end):
         return buffer_end, buffer_end + tree_buffer_size
@@ -436,8 +784,12 @@ class IU_TreeBasedIndex(Index):
             if curr_status == self.STATUS_D:
                 raise ElemNotFound
             elif doc_id is not None and doc_id != curr_doc_id:
-                #                    should't happen, crashes earlier on id index
-                raise DocIdNotFound
+                # records with equal keys can continue in next leaves
+                leaf_start, nr_of_elements, matching_record_index = self._match_doc_id(
+                    doc_id, key, 0, leaf_start, 1)
+                curr_key, curr_doc_id, curr_start, curr_size, curr_status = self._read_single_leaf_record(
+                    leaf_start, matching_record_index)
+                return leaf_start, matching_record_index, curr_doc_id, curr_key, curr_start, curr_size, curr_status
             else:
                 return leaf_start, 0, curr_doc_id, curr_key, curr_start, curr_size, curr_status
 
@@ -510,8 +862,15 @@ class IU_TreeBasedIndex(Index):
 
         if imax > imin:
             chosen_key_position = candidate_index
+        elif imax < 0 < nr_of_elements:
+            # key is smaller than all keys in leaf, don't read before it
+            chosen_key_position = 0
         else:
             chosen_key_position = imax
+        if not nr_of_elements:  # empty root leaf
+            if return_closest:
+                return leaf_start, chosen_key_position
+            raise ElemNotFound
         curr_key, curr_doc_id, curr_start, curr_size, curr_status = self._read_single_leaf_record(
             leaf_start, chosen_key_position)
         if key != curr_key:
@@ -524,10 +883,7 @@ class IU_TreeBasedIndex(Index):
         else:
             if mode == MODE_FIRST and imin < chosen_key_position:  # check if there isn't any element with equal key before chosen one
                 matching_record_index = self._leaf_linear_key_search(
-                    key,
-                    self._calculate_key_position(leaf_start, imin,
-                                                 self.TYPE_LEAF), imin,
-                    chosen_key_position)
+                    key, leaf_start, imin, chosen_key_position)
             else:
                 matching_record_index = chosen_key_position
             curr_key, curr_doc_id, curr_start, curr_size, curr_status = self._read_single_leaf_record(
@@ -738,9 +1094,7 @@ class IU_TreeBasedIndex(Index):
             node_start, chosen_key_position)
         if mode == MODE_FIRST and imin < chosen_key_position:  # check if there is no elements with equal key before chosen one
             matching_record_index = self._node_linear_key_search(
-                key,
-                self._calculate_key_position(node_start, imin, self.TYPE_NODE),
-                imin, chosen_key_position)
+                key, node_start, imin, chosen_key_position)
         else:
             matching_record_index = chosen_key_position
         l_pointer, curr_key, r_pointer = self._read_single_node_key(
@@ -759,28 +1113,24 @@ class IU_TreeBasedIndex(Index):
 
     def _update_leaf_ready_data(self, leaf_start, start_index,
                                 new_nr_of_elements, records_to_rewrite):
-        self.buckets.seek(leaf_start)
-        self.buckets.write(struct.pack('<h', new_nr_of_elements))
+        self._write_buckets(leaf_start, struct.pack('<h', new_nr_of_elements))
         start_position = self._calculate_key_position(leaf_start, start_index,
                                                       self.TYPE_LEAF)
-        self.buckets.seek(start_position)
-        self.buckets.write(
+        self._write_buckets(
+            start_position,
             struct.pack(
                 '<' + (new_nr_of_elements - start_index) *
                 self.single_leaf_record_format, *records_to_rewrite))
 
         #        self._read_single_leaf_record.delete(leaf_start)
-        self._read_leaf_nr_of_elements.delete(leaf_start)
-        self._read_leaf_nr_of_elements_and_neighbours.delete(leaf_start)
 
     def _update_leaf(self, leaf_start, new_record_position, nr_of_elements,
                      nr_of_records_to_rewrite, on_deleted, new_key, new_doc_id,
                      new_start, new_size, new_status):
         if nr_of_records_to_rewrite == 0:  # just write at set position
-            self.buckets.seek(
+            self._write_buckets(
                 self._calculate_key_position(leaf_start, new_record_position,
-                                             self.TYPE_LEAF))
-            self.buckets.write(
+                                             self.TYPE_LEAF),
                 struct.pack('<' + self.single_leaf_record_format, new_key,
                             new_doc_id, new_start, new_size, new_status))
             self.flush()
@@ -788,9 +1138,8 @@ class IU_TreeBasedIndex(Index):
             start = self._calculate_key_position(leaf_start,
                                                  new_record_position,
                                                  self.TYPE_LEAF)
-            self.buckets.seek(start)
-            data = self.buckets.read(nr_of_records_to_rewrite *
-                                     self.single_leaf_record_size)
+            data = self._read_buckets(
+                start, nr_of_records_to_rewrite * self.single_leaf_record_size)
             records_to_rewrite = struct.unpack(
                 '<' +
                 nr_of_records_to_rewrite * self.single_leaf_record_format,
@@ -807,55 +1156,40 @@ class IU_TreeBasedIndex(Index):
                 else:
                     curr_index += 1
 
-            self.buckets.seek(start)
-            self.buckets.write(
+            self._write_buckets(
+                start,
                 struct.pack(
                     '<' + (nr_of_records_to_rewrite + 1) *
                     self.single_leaf_record_format, new_key,
                     new_doc_id, new_start, new_size, new_status,
                     *tuple(records_to_rewrite)))
             self.flush()
-        self.buckets.seek(leaf_start)
         if not on_deleted:  # when new record replaced deleted one, nr of leaf elements stays the same
-            self.buckets.write(struct.pack('<h', nr_of_elements + 1))
+            self._write_buckets(leaf_start,
+                                struct.pack('<h', nr_of_elements + 1))
 
-        self._read_leaf_nr_of_elements.delete(leaf_start)
-        self._read_leaf_nr_of_elements_and_neighbours.delete(leaf_start)
-        self._find_key_in_leaf.delete(leaf_start)
 
     def _read_leaf_neighbours(self, leaf_start):
-        self.buckets.seek(leaf_start + self.elements_counter_size)
-        neihbours_data = self.buckets.read(2 * self.pointer_size)
-        prev_l, next_l = struct.unpack('<' + 2 * self.pointer_format,
-                                       neihbours_data)
-        return prev_l, next_l
+        return self._leaf_page(leaf_start)[2:4]
 
     def _update_leaf_size_and_pointers(self, leaf_start, new_size, new_prev,
                                        new_next):
-        self.buckets.seek(leaf_start)
-        self.buckets.write(
+        self._write_buckets(
+            leaf_start,
             struct.pack(
                 '<' + self.elements_counter_format + 2 * self.pointer_format,
                 new_size, new_prev, new_next))
 
-        self._read_leaf_nr_of_elements.delete(leaf_start)
-        self._read_leaf_neighbours.delete(leaf_start)
-        self._read_leaf_nr_of_elements_and_neighbours.delete(leaf_start)
 
     def _update_leaf_prev_pointer(self, leaf_start, pointer):
-        self.buckets.seek(leaf_start + self.elements_counter_size)
-        self.buckets.write(struct.pack('<' + self.pointer_format, pointer))
+        self._write_buckets(leaf_start + self.elements_counter_size,
+                            struct.pack('<' + self.pointer_format, pointer))
 
-        self._read_leaf_neighbours.delete(leaf_start)
-        self._read_leaf_nr_of_elements_and_neighbours.delete(leaf_start)
 
     def _update_size(self, start, new_size):
-        self.buckets.seek(start)
-        self.buckets.write(
-            struct.pack('<' + self.elements_counter_format, new_size))
+        self._write_buckets(
+            start, struct.pack('<' + self.elements_counter_format, new_size))
 
-        self._read_leaf_nr_of_elements.delete(start)
-        self._read_leaf_nr_of_elements_and_neighbours.delete(start)
 
     def _create_new_root_from_leaf(self, leaf_start, nr_of_records_to_rewrite,
                                    new_leaf_size, old_leaf_size, half_size,
@@ -863,18 +1197,17 @@ class IU_TreeBasedIndex(Index):
         blanks = (self.node_capacity - new_leaf_size) * \
             self.single_leaf_record_size * b'\x00'
         left_leaf_start_position = self.data_start + self.node_size
-        right_leaf_start_position = self.data_start + \
-            self.node_size + self.leaf_size
-        self.buckets.seek(self.data_start + self.leaf_heading_size)
         # read old root
-        data = self.buckets.read(self.single_leaf_record_size *
-                                 self.node_capacity)
+        data = self._read_buckets(
+            self.data_start + self.leaf_heading_size,
+            self.single_leaf_record_size * self.node_capacity)
         leaf_data = struct.unpack(
             '<' + self.single_leaf_record_format * self.node_capacity, data)
         # remove deleted records, if succeded abort spliting
         if self._update_if_has_deleted(self.data_start, leaf_data, 0,
                                        new_data):
             return None
+        right_leaf_start_position = self._new_page(self.TYPE_LEAF)
         # find out key which goes to parent node
         if nr_of_records_to_rewrite > new_leaf_size - 1:
             key_moved_to_parent_node = leaf_data[(old_leaf_size - 1) * 5]
@@ -934,16 +1267,12 @@ class IU_TreeBasedIndex(Index):
                            ) * self.single_leaf_record_size * b'\x00'
         right_leaf_data += blanks
         data_to_write += left_leaf_data
-        data_to_write += right_leaf_data
-        self.buckets.seek(self._start_ind)
-        self.buckets.write(struct.pack('<c', self.TYPE_NODE) + data_to_write)
+        self._write_buckets(right_leaf_start_position, right_leaf_data)
+        self._write_buckets(self._start_ind,
+                            struct.pack('<c', self.TYPE_NODE) + data_to_write)
         self.root_flag = self.TYPE_NODE
 
         #            self._read_single_leaf_record.delete(leaf_start)
-        self._find_key_in_leaf.delete(leaf_start)
-        self._read_leaf_nr_of_elements.delete(leaf_start)
-        self._read_leaf_nr_of_elements_and_neighbours.delete(leaf_start)
-        self._read_leaf_neighbours.delete(leaf_start)
         return None
 
     def _split_leaf(self,
@@ -976,14 +1305,13 @@ class IU_TreeBasedIndex(Index):
                 self.single_leaf_record_size * b'\x00'
             prev_l, next_l = self._read_leaf_neighbours(leaf_start)
             if nr_of_records_to_rewrite > half_size:  # insert key into first half of leaf
-                self.buckets.seek(
+                # read all records with key>new_key
+                data = self._read_buckets(
                     self._calculate_key_position(
                         leaf_start,
                         self.node_capacity - nr_of_records_to_rewrite,
-                        self.TYPE_LEAF))
-                # read all records with key>new_key
-                data = self.buckets.read(nr_of_records_to_rewrite *
-                                         self.single_leaf_record_size)
+                        self.TYPE_LEAF),
+                    nr_of_records_to_rewrite * self.single_leaf_record_size)
                 records_to_rewrite = struct.unpack(
                     '<' +
                     nr_of_records_to_rewrite * self.single_leaf_record_format,
@@ -996,9 +1324,8 @@ class IU_TreeBasedIndex(Index):
                     return None
                 key_moved_to_parent_node = records_to_rewrite[-new_leaf_size *
                                                               5]
-                # write new leaf at end of file
-                self.buckets.seek(0, 2)  # end of file
-                new_leaf_start = self.buckets.tell()
+                # write new leaf on freed page or at end of file
+                new_leaf_start = self._new_page(self.TYPE_LEAF)
                 # prepare new leaf_data
                 new_leaf = struct.pack(
                     '<' + self.elements_counter_format +
@@ -1008,18 +1335,16 @@ class IU_TreeBasedIndex(Index):
                     *records_to_rewrite[-new_leaf_size * 5:])
                 new_leaf += blanks
                 # write new leaf
-                self.buckets.write(new_leaf)
+                self._write_buckets(new_leaf_start, new_leaf)
                 # update old leaf heading
                 self._update_leaf_size_and_pointers(leaf_start, old_leaf_size,
                                                     prev_l, new_leaf_start)
-                # seek position of new key in first half
-                self.buckets.seek(
+                # write new key and keys after, at its position in first half
+                self._write_buckets(
                     self._calculate_key_position(
                         leaf_start,
                         self.node_capacity - nr_of_records_to_rewrite,
-                        self.TYPE_LEAF))
-                # write new key and keys after
-                self.buckets.write(
+                        self.TYPE_LEAF),
                     struct.pack(
                         '<' + self.single_leaf_record_format *
                         (nr_of_records_to_rewrite - new_leaf_size + 1),
@@ -1030,16 +1355,14 @@ class IU_TreeBasedIndex(Index):
                 if next_l:  # when next_l is 0 there is no next leaf to update, avoids writing data at 0 position of file
                     self._update_leaf_prev_pointer(next_l, new_leaf_start)
 
-                self._find_key_in_leaf.delete(leaf_start)
 
                 return new_leaf_start, key_moved_to_parent_node
             else:  # key goes into second half of leaf     '
                 # seek half of the leaf
-                self.buckets.seek(
+                data = self._read_buckets(
                     self._calculate_key_position(leaf_start, old_leaf_size,
-                                                 self.TYPE_LEAF))
-                data = self.buckets.read(self.single_leaf_record_size *
-                                         (new_leaf_size - 1))
+                                                 self.TYPE_LEAF),
+                    self.single_leaf_record_size * (new_leaf_size - 1))
                 records_to_rewrite = struct.unpack(
                     '<' + (new_leaf_size - 1) * self.single_leaf_record_format,
                     data)
@@ -1052,8 +1375,7 @@ class IU_TreeBasedIndex(Index):
                     -(new_leaf_size - 1) * 5]
                 if key_moved_to_parent_node > new_key:
                     key_moved_to_parent_node = new_key
-                self.buckets.seek(0, 2)  # end of file
-                new_leaf_start = self.buckets.tell()
+                new_leaf_start = self._new_page(self.TYPE_LEAF)
                 # prepare new leaf data
                 index_of_records_split = nr_of_records_to_rewrite * 5
                 if index_of_records_split:
@@ -1074,13 +1396,12 @@ class IU_TreeBasedIndex(Index):
                     (nr_of_records_to_rewrite + 1), new_key, new_doc_id,
                     new_start, new_size, self.STATUS_O, *records_after)
                 new_leaf += blanks
-                self.buckets.write(new_leaf)
+                self._write_buckets(new_leaf_start, new_leaf)
                 self._update_leaf_size_and_pointers(leaf_start, old_leaf_size,
                                                     prev_l, new_leaf_start)
                 if next_l:  # pren next_l is 0 there is no next leaf to update, avoids writing data at 0 position of file
                     self._update_leaf_prev_pointer(next_l, new_leaf_start)
 
-                self._find_key_in_leaf.delete(leaf_start)
 
                 return new_leaf_start, key_moved_to_parent_node
 
@@ -1133,15 +1454,13 @@ class IU_TreeBasedIndex(Index):
                                    nr_of_keys_to_rewrite, new_node_size,
                                    old_node_size, new_key, new_pointer):
         # reading second half of node
-        self.buckets.seek(self.data_start + self.node_heading_size)
         # read all keys with key>new_key
-        data = self.buckets.read(self.pointer_size + self.node_capacity *
-                                 (self.key_size + self.pointer_size))
+        data = self._read_buckets(
+            self.data_start + self.node_heading_size, self.pointer_size +
+            self.node_capacity * (self.key_size + self.pointer_size))
         old_node_data = struct.unpack(
             '<' + self.pointer_format + self.node_capacity *
             (self.key_format + self.pointer_format), data)
-        self.buckets.seek(0, 2)  # end of file
-        new_node_start = self.buckets.tell()
         if nr_of_keys_to_rewrite == new_node_size:
             key_moved_to_root = new_key
             # prepare new nodes data
@@ -1206,21 +1525,20 @@ class IU_TreeBasedIndex(Index):
                 '<' + (nr_of_keys_to_rewrite + 1) *
                 (self.key_format + self.pointer_format), new_key, new_pointer,
                 *keys_after)
-        new_root = self._prepare_new_root_data(key_moved_to_root,
-                                               new_node_start,
-                                               new_node_start + self.node_size)
         left_node += (self.node_capacity - old_node_size) * \
             (self.key_size + self.pointer_size) * b'\x00'
         # adding blanks after new node
         right_node += (self.node_capacity - new_node_size) * \
             (self.key_size + self.pointer_size) * b'\x00'
-        self.buckets.seek(0, 2)
-        self.buckets.write(left_node + right_node)
-        self.buckets.seek(self.data_start)
-        self.buckets.write(new_root)
+        left_node_start = self._new_page(self.TYPE_NODE)
+        self._write_buckets(left_node_start, left_node)
+        right_node_start = self._new_page(self.TYPE_NODE)
+        self._write_buckets(right_node_start, right_node)
+        new_root = self._prepare_new_root_data(key_moved_to_root,
+                                               left_node_start,
+                                               right_node_start)
+        self._write_buckets(self.data_start, new_root)
 
-        self._read_single_node_key.delete(node_start)
-        self._read_node_nr_of_elements_and_children_flag.delete(node_start)
         return None
 
     def _split_node(self,
@@ -1250,19 +1568,17 @@ class IU_TreeBasedIndex(Index):
                 self.key_size + self.pointer_size) * b'\x00'
             if nr_of_keys_to_rewrite == new_node_size:  # insert key into first half of node
                 # reading second half of node
-                self.buckets.seek(
+                # read all keys with key>new_key
+                data = self._read_buckets(
                     self._calculate_key_position(node_start, old_node_size,
                                                  self.TYPE_NODE) +
-                    self.pointer_size)
-                # read all keys with key>new_key
-                data = self.buckets.read(nr_of_keys_to_rewrite *
-                                         (self.key_size + self.pointer_size))
+                    self.pointer_size,
+                    nr_of_keys_to_rewrite *
+                    (self.key_size + self.pointer_size))
                 old_node_data = struct.unpack(
                     '<' + nr_of_keys_to_rewrite *
                     (self.key_format + self.pointer_format), data)
-                # write new node at end of file
-                self.buckets.seek(0, 2)
-                new_node_start = self.buckets.tell()
+                new_node_start = self._new_page(self.TYPE_NODE)
                 # prepare new node_data
                 new_node = struct.pack(
                     '<' + self.node_heading_format + self.pointer_format +
@@ -1270,32 +1586,27 @@ class IU_TreeBasedIndex(Index):
                     new_node_size, children_flag, new_pointer, *old_node_data)
                 new_node += blanks
                 # write new node
-                self.buckets.write(new_node)
+                self._write_buckets(new_node_start, new_node)
                 # update old node data
                 self._update_size(node_start, old_node_size)
 
-                self._read_single_node_key.delete(node_start)
-                self._read_node_nr_of_elements_and_children_flag.delete(
-                    node_start)
 
                 return new_node_start, new_key
             elif nr_of_keys_to_rewrite > half_size:  # insert key into first half of node
                 # seek for first key to rewrite
-                self.buckets.seek(
-                    self._calculate_key_position(
-                        node_start, self.node_capacity -
-                        nr_of_keys_to_rewrite, self.TYPE_NODE) +
-                    self.pointer_size)
                 # read all keys with key>new_key
-                data = self.buckets.read(nr_of_keys_to_rewrite *
-                                         (self.key_size + self.pointer_size))
+                data = self._read_buckets(
+                    self._calculate_key_position(
+                        node_start, self.node_capacity - nr_of_keys_to_rewrite,
+                        self.TYPE_NODE) + self.pointer_size,
+                    nr_of_keys_to_rewrite *
+                    (self.key_size + self.pointer_size))
                 old_node_data = struct.unpack(
                     '<' + nr_of_keys_to_rewrite *
                     (self.key_format + self.pointer_format), data)
                 key_moved_to_parent_node = old_node_data[-(new_node_size + 1) *
                                                          2]
-                self.buckets.seek(0, 2)
-                new_node_start = self.buckets.tell()
+                new_node_start = self._new_page(self.TYPE_NODE)
                 # prepare new node_data
                 new_node = struct.pack(
                     '<' + self.node_heading_format + self.pointer_format +
@@ -1305,42 +1616,34 @@ class IU_TreeBasedIndex(Index):
                     *old_node_data[-new_node_size * 2:])
                 new_node += blanks
                 # write new node
-                self.buckets.write(new_node)
+                self._write_buckets(new_node_start, new_node)
                 self._update_size(node_start, old_node_size)
-                # seek position of new key in first half
-                self.buckets.seek(
+                # write new key and keys after, at its position in first half
+                self._write_buckets(
                     self._calculate_key_position(
-                        node_start, self.node_capacity -
-                        nr_of_keys_to_rewrite, self.TYPE_NODE) +
-                    self.pointer_size)
-                # write new key and keys after
-                self.buckets.write(
+                        node_start, self.node_capacity - nr_of_keys_to_rewrite,
+                        self.TYPE_NODE) + self.pointer_size,
                     struct.pack(
                         '<' + (self.key_format + self.pointer_format) *
                         (nr_of_keys_to_rewrite - new_node_size), new_key,
                         new_pointer,
                         *old_node_data[:-(new_node_size + 1) * 2]))
 
-                self._read_single_node_key.delete(node_start)
-                self._read_node_nr_of_elements_and_children_flag.delete(
-                    node_start)
 
                 return new_node_start, key_moved_to_parent_node
             else:  # key goes into second half
                 # reading second half of node
-                self.buckets.seek(
+                data = self._read_buckets(
                     self._calculate_key_position(node_start, old_node_size,
                                                  self.TYPE_NODE) +
-                    self.pointer_size)
-                data = self.buckets.read(new_node_size *
-                                         (self.key_size + self.pointer_size))
+                    self.pointer_size,
+                    new_node_size * (self.key_size + self.pointer_size))
                 old_node_data = struct.unpack(
                     '<' + new_node_size *
                     (self.key_format + self.pointer_format), data)
                 # find key which goes to parent node
                 key_moved_to_parent_node = old_node_data[0]
-                self.buckets.seek(0, 2)  # end of file
-                new_node_start = self.buckets.tell()
+                new_node_start = self._new_page(self.TYPE_NODE)
                 index_of_records_split = nr_of_keys_to_rewrite * 2
                 # prepare new node_data
                 first_leaf_pointer = old_node_data[1]
@@ -1362,28 +1665,22 @@ class IU_TreeBasedIndex(Index):
                     *keys_after)
                 new_node += blanks
                 # write new node
-                self.buckets.write(new_node)
+                self._write_buckets(new_node_start, new_node)
                 self._update_size(node_start, old_node_size)
 
-                self._read_single_node_key.delete(node_start)
-                self._read_node_nr_of_elements_and_children_flag.delete(
-                    node_start)
 
                 return new_node_start, key_moved_to_parent_node
 
     def insert_first_record_into_leaf(self, leaf_start, key, doc_id, start,
                                       size, status):
-        self.buckets.seek(leaf_start)
-        self.buckets.write(struct.pack('<' + self.elements_counter_format, 1))
-        self.buckets.seek(leaf_start + self.leaf_heading_size)
-        self.buckets.write(
+        self._write_buckets(leaf_start,
+                            struct.pack('<' + self.elements_counter_format, 1))
+        self._write_buckets(
+            leaf_start + self.leaf_heading_size,
             struct.pack('<' + self.single_leaf_record_format, key, doc_id,
                         start, size, status))
 
         #            self._read_single_leaf_record.delete(leaf_start)
-        self._find_key_in_leaf.delete(leaf_start)
-        self._read_leaf_nr_of_elements.delete(leaf_start)
-        self._read_leaf_nr_of_elements_and_neighbours.delete(leaf_start)
 
     def _insert_new_record_into_leaf(self, leaf_start, key, doc_id, start,
                                      size, status, nodes_stack, indexes):
@@ -1416,7 +1713,6 @@ class IU_TreeBasedIndex(Index):
                                                new_leaf_start_position,
                                                nodes_stack, indexes)
         else:  # there is a place for record in leaf
-            self.buckets.seek(leaf_start)
             self._update_leaf(leaf_start, new_record_position, nr_of_elements,
                               nr_of_records_to_rewrite, on_deleted, key,
                               doc_id, start, size, status)
@@ -1424,20 +1720,20 @@ class IU_TreeBasedIndex(Index):
     def _update_node(self, new_key_position, nr_of_keys_to_rewrite, new_key,
                      new_pointer):
         if nr_of_keys_to_rewrite == 0:
-            self.buckets.seek(new_key_position)
-            self.buckets.write(
+            self._write_buckets(
+                new_key_position,
                 struct.pack('<' + self.key_format + self.pointer_format,
                             new_key, new_pointer))
             self.flush()
         else:
-            self.buckets.seek(new_key_position)
-            data = self.buckets.read(nr_of_keys_to_rewrite *
-                                     (self.key_size + self.pointer_size))
+            data = self._read_buckets(
+                new_key_position,
+                nr_of_keys_to_rewrite * (self.key_size + self.pointer_size))
             keys_to_rewrite = struct.unpack(
                 '<' + nr_of_keys_to_rewrite *
                 (self.key_format + self.pointer_format), data)
-            self.buckets.seek(new_key_position)
-            self.buckets.write(
+            self._write_buckets(
+                new_key_position,
                 struct.pack(
                     '<' + (nr_of_keys_to_rewrite + 1) *
                     (self.key_format + self.pointer_format), new_key,
@@ -1479,17 +1775,11 @@ class IU_TreeBasedIndex(Index):
                                                new_node_start_position,
                                                nodes_stack, indexes)
 
-            self._find_first_key_occurence_in_node.delete(node_start)
-            self._find_last_key_occurence_in_node.delete(node_start)
         else:  # there is a empty slot for new key in node
             self._update_size(node_start, nr_of_elements + 1)
             self._update_node(new_key_position, nr_of_keys_to_rewrite, new_key,
                               new_half_start)
 
-            self._find_first_key_occurence_in_node.delete(node_start)
-            self._find_last_key_occurence_in_node.delete(node_start)
-            self._read_single_node_key.delete(node_start)
-            self._read_node_nr_of_elements_and_children_flag.delete(node_start)
 
     def _find_leaf_to_insert(self, key):
         """
@@ -1548,6 +1838,8 @@ class IU_TreeBasedIndex(Index):
             return curr_position
 
     def _find_key(self, key):
+        if self.bloom is not None and key not in self.bloom:
+            raise ElemNotFound
         containing_leaf_start = self._find_leaf_with_first_key_occurence(key)
         nr_of_elements, prev_leaf, next_leaf = self._read_leaf_nr_of_elements_and_neighbours(
             containing_leaf_start)
@@ -1600,20 +1892,186 @@ class IU_TreeBasedIndex(Index):
 
         self._find_key.delete(key)
         self._match_doc_id.delete(doc_id)
-        self._find_key_in_leaf.delete(containing_leaf_start, key)
         return True
 
     def delete(self, doc_id, key, start=0, size=0):
+        """
+        Removes record from its leaf. Leaf that gets less than half
+        full takes records from its sibling or is merged with it, nodes
+        above are rebalanced the same way. Pages of merged leaves and
+        nodes are reused by later splits.
+        """
         containing_leaf_start, element_index = self._find_key_to_update(
             key, doc_id)[:2]
-        self._delete_element(containing_leaf_start, element_index)
+        self._remove_record(containing_leaf_start, element_index, key)
 
         self._find_key.delete(key)
-        self._match_doc_id.delete(doc_id)
-        self._find_key_in_leaf.delete(containing_leaf_start, key)
+        # positions of other records could change
+        self._match_doc_id.clear()
         return True
 
+    def _remove_record(self, leaf_start, key_index, key):
+        nr_of_elements, prev_leaf, next_leaf = self._read_leaf_nr_of_elements_and_neighbours(
+            leaf_start)
+        records = list(self._read_leaf_records(leaf_start, nr_of_elements))
+        del records[key_index]
+        self._write_leaf(leaf_start, records, prev_leaf, next_leaf)
+        if self.root_flag == self.TYPE_NODE and len(
+                records) < self.node_capacity // 2:
+            self._rebalance_leaf(leaf_start, records,
+                                 self._path_to_leaf(key, leaf_start))
+        self.flush()
+
+    def _path_to_leaf(self, key, leaf_start):
+        """
+        Returns path from root to leaf, list of ``[node_start,
+        child_index]`` for every node on the way. Leaf with first
+        occurrence of key is found first, then path follows next leaves
+        until it gets to ``leaf_start``.
+        """
+        path = []
+        curr_pointer = self.data_start
+        children_flag = self.TYPE_NODE
+        while children_flag == self.TYPE_NODE:
+            nr_of_elements, children_flag, keys, pointers = self._node_page(
+                curr_pointer)[1:]
+            curr_index = bisect_left(keys, key, 0, nr_of_elements)
+            path.append([curr_pointer, curr_index])
+            curr_pointer = pointers[curr_index]
+        while curr_pointer != leaf_start:
+            curr_pointer = self._next_leaf_in_path(path)
+            if not curr_pointer:
+                raise ElemNotFound
+        return path
+
+    def _next_leaf_in_path(self, path):
+        """
+        Moves ``path`` to the next leaf
+
+        :returns: start of the next leaf, ``0`` after the last one
+        """
+        level = len(path)
+        while level:
+            level -= 1
+            node_start, curr_index = path[level]
+            if curr_index < self._node_page(node_start)[1]:
+                path[level][1] = curr_index + 1
+                break
+        else:
+            return 0
+        for level in range(level, len(path) - 1):
+            node_start, curr_index = path[level]
+            path[level + 1] = [self._node_page(node_start)[4][curr_index], 0]
+        node_start, curr_index = path[-1]
+        return self._node_page(node_start)[4][curr_index]
+
+    def _read_node(self, node_start):
+        """
+        :returns: ``(keys, pointers, children_flag)`` of node, keys and
+            pointers as new lists
+        """
+        nr_of_elements, children_flag, keys, pointers = self._node_page(
+            node_start)[1:]
+        return (list(keys[:nr_of_elements]),
+                list(pointers[:nr_of_elements + 1]), children_flag)
+
+    def _rebalance_leaf(self, leaf_start, records, path):
+        node_start, child_index = path.pop()
+        keys, pointers, children_flag = self._read_node(node_start)
+        # separator of leaf and its sibling, the right one if there is one
+        key_index = min(child_index, len(keys) - 1)
+        left_leaf, right_leaf = pointers[key_index:key_index + 2]
+        if left_leaf == leaf_start:
+            left_records = records
+            right_records = self._read_leaf_records(
+                right_leaf, self._read_leaf_nr_of_elements(right_leaf))
+        else:
+            left_records = self._read_leaf_records(
+                left_leaf, self._read_leaf_nr_of_elements(left_leaf))
+            right_records = records
+        prev_leaf = self._read_leaf_neighbours(left_leaf)[0]
+        next_leaf = self._read_leaf_neighbours(right_leaf)[1]
+        records = list(left_records) + list(right_records)
+        if len(records) <= self.node_capacity:
+            # merge into left leaf, so the first leaf never moves
+            self._write_leaf(left_leaf, records, prev_leaf, next_leaf)
+            if next_leaf:
+                self._update_leaf_prev_pointer(next_leaf, left_leaf)
+            self._free_page(right_leaf, self.TYPE_LEAF)
+            del keys[key_index]
+            del pointers[key_index + 1]
+            self._remove_key_from_node(node_start, keys, pointers,
+                                       children_flag, path)
+        else:
+            half = len(records) // 2
+            self._write_leaf(left_leaf, records[:half], prev_leaf, right_leaf)
+            self._write_leaf(right_leaf, records[half:], left_leaf, next_leaf)
+            keys[key_index] = records[half][0]
+            self._write_node(node_start, keys, pointers, children_flag)
+
+    def _remove_key_from_node(self, node_start, keys, pointers, children_flag,
+                              path):
+        """
+        Writes node that lost one key in merge of its children, node
+        less than half full is rebalanced with its sibling. Root with
+        single child is replaced by the child.
+        """
+        if not path:  # root
+            if keys:
+                self._write_node(node_start, keys, pointers, children_flag)
+            elif children_flag == self.TYPE_LEAF:
+                # it's the first leaf, right after root node. Its page
+                # isn't freed: root leaf overlaps it, and next split of
+                # the root writes the first leaf there again
+                child = pointers[0]
+                self._write_leaf(
+                    self.data_start,
+                    self._read_leaf_records(
+                        child, self._read_leaf_nr_of_elements(child)), 0, 0)
+                self._write_buckets(self._start_ind,
+                                    struct.pack('<c', self.TYPE_LEAF))
+                self.root_flag = self.TYPE_LEAF
+            else:
+                child = pointers[0]
+                self._write_node(self.data_start, *self._read_node(child))
+                self._free_page(child, self.TYPE_NODE)
+            return
+        if len(keys) >= self.node_capacity // 2:
+            self._write_node(node_start, keys, pointers, children_flag)
+            return
+        parent_start, child_index = path.pop()
+        parent_keys, parent_pointers, parent_flag = self._read_node(
+            parent_start)
+        key_index = min(child_index, len(parent_keys) - 1)
+        left_node, right_node = parent_pointers[key_index:key_index + 2]
+        if left_node == node_start:
+            sibling_keys, sibling_pointers = self._read_node(right_node)[:2]
+            keys = keys + [parent_keys[key_index]] + sibling_keys
+            pointers = pointers + sibling_pointers
+        else:
+            sibling_keys, sibling_pointers = self._read_node(left_node)[:2]
+            keys = sibling_keys + [parent_keys[key_index]] + keys
+            pointers = sibling_pointers + pointers
+        if len(keys) <= self.node_capacity:
+            self._write_node(left_node, keys, pointers, children_flag)
+            self._free_page(right_node, self.TYPE_NODE)
+            del parent_keys[key_index]
+            del parent_pointers[key_index + 1]
+            self._remove_key_from_node(parent_start, parent_keys,
+                                       parent_pointers, parent_flag, path)
+        else:
+            half = len(keys) // 2
+            self._write_node(left_node, keys[:half], pointers[:half + 1],
+                             children_flag)
+            self._write_node(right_node, keys[half + 1:], pointers[half + 1:],
+                             children_flag)
+            parent_keys[key_index] = keys[half]
+            self._write_node(parent_start, parent_keys, parent_pointers,
+                             parent_flag)
+
     def _find_key_many(self, key, limit=1, offset=0):
+        if self.bloom is not None and key not in self.bloom:
+            return
         leaf_with_key = self._find_leaf_with_first_key_occurence(key)
         nr_of_elements, prev_leaf, next_leaf = self._read_leaf_nr_of_elements_and_neighbours(
             leaf_with_key)
@@ -1623,6 +2081,8 @@ class IU_TreeBasedIndex(Index):
             nr_of_elements, prev_leaf, next_leaf = self._read_leaf_nr_of_elements_and_neighbours(
                 leaf_with_key)
         except ElemNotFound:
+            if not next_leaf:
+                return  # key is bigger than all keys in the last leaf
             leaf_with_key = next_leaf
             key_index = 0
             nr_of_elements, prev_leaf, next_leaf = self._read_leaf_nr_of_elements_and_neighbours(
@@ -1860,7 +2320,7 @@ class IU_TreeBasedIndex(Index):
                 leaf_with_key)
             curr_key = self._read_single_leaf_record(leaf_with_key,
                                                      key_index)[0]
-            if curr_key < start:
+            if key_index < 0 or curr_key < start:  # < 0 in empty leaf
                 key_index += 1
         else:
             leaf_with_key = self._find_leaf_with_last_key_occurence(start)
@@ -1870,7 +2330,7 @@ class IU_TreeBasedIndex(Index):
                 start, leaf_with_key, nr_of_elements)
             curr_key, curr_doc_id, curr_start, curr_size, curr_status = self._read_single_leaf_record(
                 leaf_with_key, key_index)
-            if curr_key <= start:
+            if key_index < 0 or curr_key <= start:
                 key_index += 1
         while offset:
             if key_index < nr_of_elements:
@@ -1906,11 +2366,67 @@ class IU_TreeBasedIndex(Index):
                 else:
                     return
 
+    def _find_key_between_reversed(self, gen, start, limit, inclusive_start):
+        """
+        Passes records of ``gen``, that walks leaves backwards, until
+        their keys get below ``start``.
+        """
+        for record in gen:
+            if not limit or record[1] < start or (record[1] == start
+                                                  and not inclusive_start):
+                return
+            yield record
+            limit -= 1
+
     def get(self, key):
         return self._find_key(self.make_key(key))
 
     def get_many(self, key, limit=1, offset=0):
-        return self._find_key_many(self.make_key(key), limit, offset)
+        key = self.make_key(key)
+        return self._scan(self._find_key_many(key, limit, offset),
+                          limit,
+                          key=key)
+
+    def get_multi(self, keys):
+        """
+        Finds many keys at once. Keys are sorted and matched with records
+        while walking leaves from left to right, so every leaf is read
+        at most once. For duplicated keys the first not deleted record
+        is returned.
+
+        :param keys: keys to find
+        :returns: list with result of :py:meth:`get` for every key,
+            ``None`` for keys that were not found
+        """
+        res = [None] * len(keys)
+        wanted = {}
+        for i, key in enumerate(keys):
+            key = self.make_key(key)
+            if self.bloom is None or key in self.bloom:
+                wanted.setdefault(key, []).append(i)
+        todo = sorted(wanted, reverse=True)
+        visited = set()
+        next_leaf = 0
+        while todo:
+            leaf_start = self._find_leaf_with_first_key_occurence(todo[-1])
+            if leaf_start in visited:
+                # key is after the leaf that was just read
+                leaf_start = next_leaf
+                if not leaf_start:
+                    break
+            visited.add(leaf_start)
+            nr_of_elements, prev_leaf, next_leaf = self._read_leaf_nr_of_elements_and_neighbours(
+                leaf_start)
+            for l_key, doc_id, start, size, status in self._read_leaf_records(
+                    leaf_start, nr_of_elements):
+                while todo and todo[-1] < l_key:
+                    todo.pop()  # not in tree
+                if not todo:
+                    break
+                if todo[-1] == l_key and status != self.STATUS_D:
+                    for i in wanted[todo.pop()]:
+                        res[i] = doc_id, l_key, start, size, status
+        return res
 
     def get_between(self,
                     start,
@@ -1918,29 +2434,54 @@ class IU_TreeBasedIndex(Index):
                     limit=1,
                     offset=0,
                     inclusive_start=True,
-                    inclusive_end=True):
-        if start is None:
+                    inclusive_end=True,
+                    reverse=False):
+        """
+        Returns generator of records with keys between ``start`` and
+        ``end`` (``None`` for no limit). Records are in order of keys,
+        with ``reverse=True`` (and always when ``start`` is ``None``)
+        they start from ``end`` and go backwards.
+        """
+        if start is not None:
+            start = self.make_key(start)
+        if end is not None:
             end = self.make_key(end)
+        if reverse and start is not None:
+            if end is None:
+                gen = self._all_reversed(-1, offset)
+            elif inclusive_end:
+                gen = self._find_key_equal_and_smaller(end, -1, offset)
+            else:
+                gen = self._find_key_smaller(end, -1, offset)
+            gen = self._find_key_between_reversed(gen, start, limit,
+                                                  inclusive_start)
+        elif start is None:
+            reverse = True
             if inclusive_end:
-                return self._find_key_equal_and_smaller(end, limit, offset)
+                gen = self._find_key_equal_and_smaller(end, limit, offset)
             else:
-                return self._find_key_smaller(end, limit, offset)
+                gen = self._find_key_smaller(end, limit, offset)
         elif end is None:
-            start = self.make_key(start)
             if inclusive_start:
-                return self._find_key_equal_and_bigger(start, limit, offset)
+                gen = self._find_key_equal_and_bigger(start, limit, offset)
             else:
-                return self._find_key_bigger(start, limit, offset)
+                gen = self._find_key_bigger(start, limit, offset)
         else:
-            start = self.make_key(start)
-            end = self.make_key(end)
-            return self._find_key_between(start, end, limit, offset,
-                                          inclusive_start, inclusive_end)
+            gen = self._find_key_between(start, end, limit, offset,
+                                         inclusive_start, inclusive_end)
+        return self._scan(gen, limit, reverse, start, end, inclusive_start,
+                          inclusive_end)
 
-    def all(self, limit=-1, offset=0):
+    def all(self, limit=-1, offset=0, reverse=False):
         """
         Traverses linked list of all tree leaves and returns generator containing all elements stored in index.
+        With ``reverse=True`` it starts from the last leaf and goes backwards.
         """
+        if reverse:
+            return self._scan(self._all_reversed(limit, offset), limit, True)
+        return self._scan(self._all(limit, offset), limit)
+
+    def _all(self, limit, offset):
         if self.root_flag == self.TYPE_NODE:
             leaf_start = self.data_start + self.node_size
         else:
@@ -1980,6 +2521,60 @@ class IU_TreeBasedIndex(Index):
                 else:
                     return
 
+    def _find_last_leaf(self):
+        """
+        Returns start of the last leaf, following last pointers of nodes
+        """
+        if self.root_flag == self.TYPE_LEAF:
+            return self.data_start
+        node_start = self.data_start
+        while True:
+            nr_of_elements, children_flag = self._read_node_nr_of_elements_and_children_flag(
+                node_start)
+            node_start = self._node_page(node_start)[4][nr_of_elements]
+            if children_flag == self.TYPE_LEAF:
+                return node_start
+
+    def _all_reversed(self, limit=-1, offset=0):
+        """
+        Traverses linked list of leaves backwards, from the last one
+        """
+        leaf_start = self._find_last_leaf()
+        nr_of_elements, prev_leaf, next_leaf = self._read_leaf_nr_of_elements_and_neighbours(
+            leaf_start)
+        key_index = nr_of_elements - 1
+        while offset:
+            if key_index >= 0:
+                curr_key, doc_id, start, size, status = self._read_single_leaf_record(
+                    leaf_start, key_index)
+                if status != self.STATUS_D:
+                    offset -= 1
+                key_index -= 1
+            else:
+                if prev_leaf:
+                    leaf_start = prev_leaf
+                    nr_of_elements, prev_leaf, next_leaf = self._read_leaf_nr_of_elements_and_neighbours(
+                        prev_leaf)
+                    key_index = nr_of_elements - 1
+                else:
+                    return
+        while limit:
+            if key_index >= 0:
+                curr_key, doc_id, start, size, status = self._read_single_leaf_record(
+                    leaf_start, key_index)
+                if status != self.STATUS_D:
+                    yield doc_id, curr_key, start, size, status
+                    limit -= 1
+                key_index -= 1
+            else:
+                if prev_leaf:
+                    leaf_start = prev_leaf
+                    nr_of_elements, prev_leaf, next_leaf = self._read_leaf_nr_of_elements_and_neighbours(
+                        prev_leaf)
+                    key_index = nr_of_elements - 1
+                else:
+                    return
+
     def make_key(self, key):
         raise NotImplementedError()
 
@@ -1990,12 +2585,14 @@ class IU_TreeBasedIndex(Index):
         s = globals()[self.storage_class]
         if not self.storage:
             self.storage = s(self.db_path, self.name)
+            self._configure_storage()
         self.storage.open()
 
     def _create_storage(self):
         s = globals()[self.storage_class]
         if not self.storage:
             self.storage = s(self.db_path, self.name)
+            self._configure_storage()
         self.storage.create()
 
     def compact(self, node_capacity=0):
@@ -2006,18 +2603,15 @@ class IU_TreeBasedIndex(Index):
                                      self.name + '_compact',
                                      node_capacity=node_capacity)
         compact_ind.create_index()
+        compact_ind.storage.copy_settings(self.storage)
 
-        gen = self.all()
-        while True:
-            try:
-                doc_id, key, start, size, status = next(gen)
-            except StopIteration:
-                break
-            self.storage._f.seek(start)
-            value = self.storage._f.read(size)
-            start_ = compact_ind.storage._f.tell()
-            compact_ind.storage._f.write(value)
-            compact_ind.insert(doc_id, key, start_, size, status)
+        def copy_records():
+            for doc_id, key, start, size, status in self.all():
+                value = self.storage._read(start, size)
+                start_ = compact_ind.storage._write(value)
+                yield doc_id, key, start_, size, status
+
+        compact_ind.bulk_load(copy_records(), presorted=True)
 
         compact_ind.close_index()
         original_name = self.name
@@ -2026,9 +2620,8 @@ class IU_TreeBasedIndex(Index):
         shutil.move(
             os.path.join(compact_ind.db_path, compact_ind.name + "_buck"),
             os.path.join(self.db_path, self.name + "_buck"))
-        shutil.move(
-            os.path.join(compact_ind.db_path, compact_ind.name + "_stor"),
-            os.path.join(self.db_path, self.name + "_stor"))
+        compact_ind._move_bloom(self.name)
+        compact_ind.storage.move(self.name)
         # self.name = original_name
         self.open_index()  # reload...
         self.name = original_name
@@ -2038,21 +2631,18 @@ class IU_TreeBasedIndex(Index):
         return True
 
     def _fix_params(self):
+        # files made before free pages were reused don't list them
+        self.free_leaf = self.free_node = 0
+        self._free_pages_changed = False
         super(IU_TreeBasedIndex, self)._fix_params()
         self._count_props()
 
     def _clear_cache(self):
+        self._changes += 1
         self._find_key.clear()
+        self._pages.clear()
         self._match_doc_id.clear()
         #        self._read_single_leaf_record.clear()
-        self._find_key_in_leaf.clear()
-        self._read_single_node_key.clear()
-        self._find_first_key_occurence_in_node.clear()
-        self._find_last_key_occurence_in_node.clear()
-        self._read_leaf_nr_of_elements.clear()
-        self._read_leaf_neighbours.clear()
-        self._read_leaf_nr_of_elements_and_neighbours.clear()
-        self._read_node_nr_of_elements_and_children_flag.clear()
 
     def close_index(self):
         super(IU_TreeBasedIndex, self).close_index()
@@ -2102,10 +2692,721 @@ class IU_MultiTreeBasedIndex(IU_TreeBasedIndex):
     def get(self, key):
         return super(IU_MultiTreeBasedIndex, self).get(key)
 
+    def bulk_load(self, records, presorted=False):
+        """
+        Works as :py:meth:`IU_TreeBasedIndex.bulk_load`, every key of
+        record is added. ``presorted`` stays valid only for records with
+        single keys.
+        """
+        def single_keys():
+            for doc_id, key, start, size, status in records:
+                if isinstance(key, (list, tuple)):
+                    key = set(key)
+                elif not isinstance(key, set):
+                    key = set([key])
+                for curr_key in key:
+                    yield doc_id, curr_key, start, size, status
+
+        return super(IU_MultiTreeBasedIndex,
+                     self).bulk_load(single_keys(), presorted)
+
     def make_key_value(self, data):
         raise NotImplementedError()
 
 
+def _separator(left, right):
+    """
+    Returns the shortest key ``k`` with ``left <= k <= right``
+    (``left <= right``), used to separate pages in nodes
+    """
+    return right[:len(os.path.commonprefix((left, right))) + 1]
+
+
+class IU_VarTreeBasedIndex(Index):
+    """
+    B+ tree index for keys of variable length (``bytes``).
+
+    Leaves and nodes are pages of ``page_size`` bytes. Page starts with
+    common prefix of its keys, that is stored only once, then offsets of
+    records (slots) and records with rest of the keys. Keys in nodes are
+    the shortest ones that separate pages below, so short or similar
+    keys give many records per page and low tree.
+
+    Deleted records are removed from leaves, pages are not merged.
+    """
+
+    custom_header = 'from codernitydb3.tree_index import VarTreeBasedIndex'
+
+    TYPE_LEAF = b'l'
+    TYPE_NODE = b'n'
+
+    page_cache_bytes = 4 * 1024 * 1024  # : size of pages kept decoded in memory (as stored in file), 0 disables the cache
+
+    bulk_fill_factor = 0.9  # : part of pages filled by :py:meth:`bulk_load` (compact, reindex), the rest is left for later inserts
+
+    bulk_sort_chunk = 100000  # : records sorted in memory by :py:meth:`bulk_load`, longer streams are sorted in chunks on disk and merged
+
+    def __init__(self, db_path, name, page_size=4096, storage_class=None):
+        """
+        :param page_size: size of leaves and nodes in bytes (512 to
+            65535), keys can take up to 1/8 of it
+        """
+        if not 512 <= page_size <= 65535:
+            raise IndexException("Page size must be from 512 to 65535")
+        super(IU_VarTreeBasedIndex, self).__init__(db_path, name)
+        self.data_start = self._start_ind + 4
+        self.page_size = page_size
+        self.root_start = self.data_start
+        self._count_props()
+        if not storage_class:
+            storage_class = IU_Storage
+        if storage_class and not isinstance(storage_class, str):
+            storage_class = storage_class.__name__
+        self.storage_class = storage_class
+        self.storage = None
+        lock_obj = cdb_environment.get('rlock_obj')
+        self._pages = PageCache(self.page_cache_bytes,
+                                lock_obj() if lock_obj else None)
+
+    def _count_props(self):
+        """
+        Counts sizes of page elements for current ``page_size``
+        """
+        self._root_struct = struct.Struct('<I')
+        self._leaf_heading_struct = struct.Struct('<cHHII')
+        self._node_heading_struct = struct.Struct('<cHHI')
+        self._length_struct = struct.Struct('<H')
+        self._meta_struct = struct.Struct('<32sII')
+        self._pointer_struct = self._root_struct
+        self._leaf_prev_offset = struct.calcsize('<cHH')
+        # slot, key length and meta for every record
+        self._leaf_record_size = 4 + self._meta_struct.size
+        self._node_record_size = 4 + self._pointer_struct.size
+        self.max_key_size = self.page_size // 8
+
+    def create_index(self):
+        if os.path.isfile(os.path.join(self.db_path, self.name + '_buck')):
+            raise IndexException('Already exists')
+        with io.open(os.path.join(self.db_path, self.name + "_buck"),
+                     'w+b') as f:
+            props = dict(name=self.name,
+                         page_size=self.page_size,
+                         version=self.__version__,
+                         storage_class=self.storage_class)
+            f.write(marshal.dumps(props))
+        self._open_buckets()
+        self._create_storage()
+        self._write_leaf(self.data_start, [], [], 0, 0)
+        self._set_root(self.data_start)
+        self.flush()
+        self._open_bloom(create=True)
+
+    def open_index(self):
+        if not os.path.isfile(os.path.join(self.db_path, self.name + '_buck')):
+            raise IndexException("Doesn't exists")
+        self._open_buckets()
+        self.root_start = self._root_struct.unpack(
+            self._read_buckets(self._start_ind, self._root_struct.size))[0]
+        self._fix_params()
+        self._open_storage()
+        self._open_bloom()
+        self._drop_lost()
+
+    def _fix_params(self):
+        super(IU_VarTreeBasedIndex, self)._fix_params()
+        self._count_props()
+
+    def _clear_cache(self):
+        self._pages.clear()
+
+    def close_index(self):
+        super(IU_VarTreeBasedIndex, self).close_index()
+        self._clear_cache()
+
+    def _set_root(self, root_start):
+        self._write_buckets(self._start_ind,
+                            self._root_struct.pack(root_start))
+        self.root_start = root_start
+
+    def _write_buckets(self, start, data):
+        """
+        Writes ``data`` at ``start`` position of buckets file,
+        cached pages that it changes are dropped
+        """
+        self.buckets.seek(start)
+        self.buckets.write(data)
+        self._pages.invalidate(start, len(data))
+
+    def _write_leaf(self, leaf_start, keys, metas, prev_leaf, next_leaf):
+        """
+        Writes leaf at ``leaf_start``, it replaces cached one
+        """
+        self._write_buckets(
+            leaf_start, self._encode_leaf(keys, metas, prev_leaf, next_leaf))
+        self._pages.put(leaf_start, self.page_size,
+                        (self.TYPE_LEAF, keys, metas, prev_leaf, next_leaf))
+
+    def _write_node(self, node_start, keys, children):
+        """
+        Writes node at ``node_start``, it replaces cached one
+        """
+        self._write_buckets(node_start, self._encode_node(keys, children))
+        self._pages.put(node_start, self.page_size,
+                        (self.TYPE_NODE, keys, children))
+
+    def _append_pages(self, pages):
+        """
+        Writes ``pages`` at the end of buckets file
+
+        :returns: start of the first page
+        """
+        self.buckets.seek(0, 2)  # end of file
+        start = self.buckets.tell()
+        self.buckets.write(b''.join(pages))
+        return start
+
+    def _page(self, start):
+        """
+        Returns decoded page, kept in page cache:
+        ``(TYPE_LEAF, keys, metas, prev_leaf, next_leaf)`` for leaves,
+        where metas are packed ``(doc_id, start, size)`` of records, and
+        ``(TYPE_NODE, keys, children)`` for nodes.
+
+        Returned lists are shared, they must not be changed.
+        """
+        page = self._pages.get(start)
+        if page is None:
+            data = bytes(self._read_buckets(start, self.page_size))
+            if data[:1] == self.TYPE_LEAF:
+                page = self._decode_leaf(data)
+            else:
+                page = self._decode_node(data)
+            self._pages.put(start, self.page_size, page)
+        return page
+
+    def _decode_leaf(self, data):
+        kind, nr_of_elements, prefix_len, prev_leaf, next_leaf = self._leaf_heading_struct.unpack_from(
+            data)
+        pos = self._leaf_heading_struct.size
+        prefix = data[pos:pos + prefix_len]
+        unpack_length = self._length_struct.unpack_from
+        meta_size = self._meta_struct.size
+        keys = []
+        metas = []
+        for slot in struct.unpack_from('<%dH' % nr_of_elements, data,
+                                       pos + prefix_len):
+            end = slot + 2 + unpack_length(data, slot)[0]
+            keys.append(prefix + data[slot + 2:end])
+            metas.append(data[end:end + meta_size])
+        return self.TYPE_LEAF, keys, metas, prev_leaf, next_leaf
+
+    def _decode_node(self, data):
+        kind, nr_of_keys, prefix_len, first_child = self._node_heading_struct.unpack_from(
+            data)
+        pos = self._node_heading_struct.size
+        prefix = data[pos:pos + prefix_len]
+        unpack_length = self._length_struct.unpack_from
+        unpack_pointer = self._pointer_struct.unpack_from
+        keys = []
+        children = [first_child]
+        for slot in struct.unpack_from('<%dH' % nr_of_keys, data,
+                                       pos + prefix_len):
+            end = slot + 2 + unpack_length(data, slot)[0]
+            keys.append(prefix + data[slot + 2:end])
+            children.append(unpack_pointer(data, end)[0])
+        return self.TYPE_NODE, keys, children
+
+    def _encode_page(self, heading_struct, heading, keys, values):
+        """
+        Packs page with ``heading`` (values after type, number of keys
+        and prefix length), ``keys`` and their packed ``values``
+        """
+        prefix = os.path.commonprefix((keys[0], keys[-1])) if keys else b''
+        prefix_len = len(prefix)
+        pos = heading_struct.size + prefix_len + 2 * len(keys)
+        slots = []
+        records = []
+        pack_length = self._length_struct.pack
+        for key, value in zip(keys, values):
+            suffix = key[prefix_len:]
+            slots.append(pos)
+            records += (pack_length(len(suffix)), suffix, value)
+            pos += 2 + len(suffix) + len(value)
+        heading = heading_struct.pack(heading[0], len(keys), prefix_len,
+                                      *heading[1:])
+        data = b''.join(
+            [heading, prefix,
+             struct.pack('<%dH' % len(slots), *slots)] + records)
+        return data + (self.page_size - len(data)) * b'\x00'
+
+    def _encode_leaf(self, keys, metas, prev_leaf, next_leaf):
+        return self._encode_page(self._leaf_heading_struct,
+                                 (self.TYPE_LEAF, prev_leaf, next_leaf), keys,
+                                 metas)
+
+    def _encode_node(self, keys, children):
+        pack_pointer = self._pointer_struct.pack
+        return self._encode_page(
+            self._node_heading_struct, (self.TYPE_NODE, children[0]), keys,
+            [pack_pointer(child) for child in children[1:]])
+
+    def _leaf_size(self, nr_of_elements, keys_size, prefix_len):
+        return (self._leaf_heading_struct.size + prefix_len + nr_of_elements *
+                (self._leaf_record_size - prefix_len) + keys_size)
+
+    def _node_size(self, nr_of_keys, keys_size, prefix_len):
+        return (self._node_heading_struct.size + prefix_len + nr_of_keys *
+                (self._node_record_size - prefix_len) + keys_size)
+
+    def _fits(self, keys, size_of):
+        prefix_len = len(os.path.commonprefix(
+            (keys[0], keys[-1]))) if keys else 0
+        return size_of(len(keys), sum(map(len, keys)),
+                       prefix_len) <= self.page_size
+
+    def _split_index(self, keys, record_size):
+        """
+        Returns index that splits ``keys`` into halves of similar size
+        """
+        half = (sum(map(len, keys)) + len(keys) * record_size) // 2
+        size = 0
+        for i, key in enumerate(keys):
+            size += len(key) + record_size
+            if size >= half:
+                return max(1, min(i, len(keys) - 2))
+        return len(keys) // 2
+
+    def _find_leaf(self, key, right=False, path=None):
+        """
+        Goes down the tree to leaf for ``key``. The first record with
+        key equal or bigger than ``key`` (bigger only when ``right``)
+        is in that leaf or after it, records before it are smaller
+        (or equal when ``right``).
+
+        :param path: list that gets ``(node_start, child_index)`` of
+            visited nodes
+        :returns: ``(leaf_start, page)``
+        """
+        find = bisect_right if right else bisect_left
+        start = self.root_start
+        page = self._page(start)
+        while page[0] == self.TYPE_NODE:
+            index = find(page[1], key)
+            if path is not None:
+                path.append((start, index))
+            start = page[2][index]
+            page = self._page(start)
+        return start, page
+
+    def _leaf_position(self, key, right=False):
+        """
+        Returns ``(leaf_start, index)`` of the first record with key
+        equal or bigger than ``key`` (bigger only when ``right``), index
+        can point behind the last record of the leaf
+        """
+        leaf_start, page = self._find_leaf(key, right)
+        find = bisect_right if right else bisect_left
+        return leaf_start, find(page[1], key)
+
+    def _edge_leaf(self, last=False):
+        start = self.root_start
+        page = self._page(start)
+        while page[0] == self.TYPE_NODE:
+            start = page[2][-1 if last else 0]
+            page = self._page(start)
+        return start
+
+    def _records_forward(self, leaf_start, index=0):
+        """
+        Yields ``(key, meta)`` of records from ``index`` of the leaf,
+        following next leaves
+        """
+        while leaf_start:
+            page = self._page(leaf_start)
+            keys = page[1]
+            metas = page[2]
+            for i in range(index, len(keys)):
+                yield keys[i], metas[i]
+            leaf_start = page[4]
+            index = 0
+
+    def _records_backward(self, leaf_start, index=None):
+        """
+        Yields ``(key, meta)`` of records from ``index`` of the leaf
+        (the last one for ``None``) down, following previous leaves
+        """
+        while leaf_start:
+            page = self._page(leaf_start)
+            keys = page[1]
+            metas = page[2]
+            if index is None or index >= len(keys):
+                index = len(keys) - 1
+            for i in range(index, -1, -1):
+                yield keys[i], metas[i]
+            leaf_start = page[3]
+            index = None
+
+    def _find_record(self, key, doc_id):
+        """
+        Returns ``(leaf_start, page, index)`` of record of ``doc_id``
+        with ``key``
+        """
+        leaf_start, index = self._leaf_position(key)
+        found = False
+        while leaf_start:
+            page = self._page(leaf_start)
+            keys = page[1]
+            for i in range(index, len(keys)):
+                if keys[i] != key:
+                    leaf_start = 0
+                    break
+                found = True
+                if self._meta_struct.unpack(page[2][i])[0] == doc_id:
+                    return leaf_start, page, i
+            else:
+                leaf_start = page[4]
+                index = 0
+        if found:
+            raise DocIdNotFound
+        raise ElemNotFound
+
+    def _find_key(self, key):
+        if self.bloom is not None and key not in self.bloom:
+            raise ElemNotFound
+        for l_key, meta in self._records_forward(*self._leaf_position(key)):
+            if l_key != key:
+                break
+            doc_id, start, size = self._meta_struct.unpack(meta)
+            return doc_id, l_key, start, size, self.STATUS_O
+        raise ElemNotFound
+
+    def insert(self, doc_id, key, start, size, status=None):
+        if len(key) > self.max_key_size:
+            raise IndexException("Key too long")
+        self._bloom_add(key)
+        path = []
+        leaf_start, page = self._find_leaf(key, True, path)
+        keys = list(page[1])
+        metas = list(page[2])
+        index = bisect_right(keys, key)
+        keys.insert(index, key)
+        metas.insert(index, self._meta_struct.pack(doc_id, start, size))
+        if self._fits(keys, self._leaf_size):
+            self._write_leaf(leaf_start, keys, metas, page[3], page[4])
+            return
+        split = self._split_index(keys, self._leaf_record_size)
+        next_leaf = page[4]
+        new_leaf = self._append_pages([
+            self._encode_leaf(keys[split:], metas[split:], leaf_start,
+                              next_leaf)
+        ])
+        self._write_leaf(leaf_start, keys[:split], metas[:split], page[3],
+                         new_leaf)
+        if next_leaf:
+            self._write_buckets(next_leaf + self._leaf_prev_offset,
+                                self._pointer_struct.pack(new_leaf))
+        self._insert_into_node(path, _separator(keys[split - 1], keys[split]),
+                               new_leaf, leaf_start)
+
+    def _insert_into_node(self, path, key, new_start, old_start):
+        """
+        Adds ``key`` that separates just split ``old_start`` page from
+        its new right part ``new_start`` to the last node of ``path``
+        """
+        if not path:
+            self._set_root(
+                self._append_pages(
+                    [self._encode_node([key], [old_start, new_start])]))
+            return
+        node_start, index = path.pop()
+        page = self._page(node_start)
+        keys = list(page[1])
+        children = list(page[2])
+        keys.insert(index, key)
+        children.insert(index + 1, new_start)
+        if self._fits(keys, self._node_size):
+            self._write_node(node_start, keys, children)
+            return
+        split = self._split_index(keys, self._node_record_size)
+        new_node = self._append_pages(
+            [self._encode_node(keys[split + 1:], children[split + 1:])])
+        self._write_node(node_start, keys[:split], children[:split + 1])
+        self._insert_into_node(path, keys[split], new_node, node_start)
+
+    def update(self, doc_id, key, u_start=0, u_size=0, u_status=None):
+        leaf_start, page, index = self._find_record(key, doc_id)
+        metas = list(page[2])
+        old_doc_id, old_start, old_size = self._meta_struct.unpack(
+            metas[index])
+        metas[index] = self._meta_struct.pack(old_doc_id, u_start or old_start,
+                                              u_size or old_size)
+        self._write_leaf(leaf_start, page[1], metas, page[3], page[4])
+        return True
+
+    def delete(self, doc_id, key, start=0, size=0):
+        leaf_start, page, index = self._find_record(key, doc_id)
+        keys = list(page[1])
+        metas = list(page[2])
+        del keys[index]
+        del metas[index]
+        self._write_leaf(leaf_start, keys, metas, page[3], page[4])
+        return True
+
+    def _records(self, records, limit, offset):
+        unpack_meta = self._meta_struct.unpack
+        for key, meta in islice(records, offset,
+                                None if limit < 0 else offset + limit):
+            doc_id, start, size = unpack_meta(meta)
+            yield doc_id, key, start, size, self.STATUS_O
+
+    def get(self, key):
+        return self._find_key(self.make_key(key))
+
+    def get_many(self, key, limit=1, offset=0):
+        key = self.make_key(key)
+        if self.bloom is not None and key not in self.bloom:
+            return
+        records = self._records_forward(*self._leaf_position(key))
+        for doc_id, l_key, start, size, status in self._records(
+                takewhile(lambda record: record[0] == key, records), limit,
+                offset):
+            yield doc_id, start, size, status
+
+    def get_between(self,
+                    start,
+                    end,
+                    limit=1,
+                    offset=0,
+                    inclusive_start=True,
+                    inclusive_end=True,
+                    reverse=False):
+        """
+        Works as :py:meth:`IU_TreeBasedIndex.get_between`
+        """
+        if start is not None:
+            start = self.make_key(start)
+        if end is not None:
+            end = self.make_key(end)
+        if reverse or start is None:
+            if end is None:
+                records = self._records_backward(self._edge_leaf(True))
+            else:
+                leaf_start, index = self._leaf_position(end, inclusive_end)
+                records = self._records_backward(leaf_start, index - 1)
+            if start is not None:
+                if inclusive_start:
+                    records = takewhile(lambda record: record[0] >= start,
+                                        records)
+                else:
+                    records = takewhile(lambda record: record[0] > start,
+                                        records)
+        else:
+            records = self._records_forward(
+                *self._leaf_position(start, not inclusive_start))
+            if end is not None:
+                if inclusive_end:
+                    records = takewhile(lambda record: record[0] <= end,
+                                        records)
+                else:
+                    records = takewhile(lambda record: record[0] < end,
+                                        records)
+        return self._records(records, limit, offset)
+
+    def all(self, limit=-1, offset=0, reverse=False):
+        """
+        Returns generator of all records, from the last one with
+        ``reverse=True``
+        """
+        if reverse:
+            records = self._records_backward(self._edge_leaf(True))
+        else:
+            records = self._records_forward(self._edge_leaf())
+        return self._records(records, limit, offset)
+
+    def make_key(self, key):
+        raise NotImplementedError()
+
+    def make_key_value(self, data):
+        raise NotImplementedError()
+
+    def bulk_load(self, records, presorted=False):
+        """
+        Builds empty index from ``records`` bottom-up, pages are filled
+        to :py:attr:`bulk_fill_factor` of ``page_size``. Works as
+        :py:meth:`IU_TreeBasedIndex.bulk_load`.
+        """
+        page = self._page(self.root_start)
+        if page[0] != self.TYPE_LEAF or page[1]:
+            return super(IU_VarTreeBasedIndex, self).bulk_load(records)
+        if not presorted:
+            records = _sorted_records(records, self.bulk_sort_chunk,
+                                      self.db_path)
+        page_limit = int(self.page_size * self.bulk_fill_factor)
+        level = self._bulk_write_leaves(self._bulk_leaves(records, page_limit))
+        if level:
+            while len(level) > 1:
+                level = self._bulk_write_nodes(level, page_limit)
+            self._set_root(level[0][2])
+        self.flush()
+        self._clear_cache()
+
+    def _bulk_leaves(self, records, page_limit):
+        """
+        Groups sorted records into leaves
+
+        :returns: generator of ``(keys, metas)``
+        """
+        bloom = self.bloom
+        pack_meta = self._meta_struct.pack
+        keys = []
+        metas = []
+        keys_size = 0
+        prefix = b''
+        for doc_id, key, start, size, status in records:
+            if len(key) > self.max_key_size:
+                raise IndexException("Key too long")
+            if bloom is not None:
+                bloom.add(key)
+            if keys:
+                if not key.startswith(prefix):
+                    prefix = os.path.commonprefix((prefix, key))
+                if self._leaf_size(
+                        len(keys) + 1, keys_size + len(key),
+                        len(prefix)) > page_limit:
+                    yield keys, metas
+                    keys = []
+                    metas = []
+                    keys_size = 0
+            if not keys:
+                prefix = key
+            keys.append(key)
+            metas.append(pack_meta(doc_id, start, size))
+            keys_size += len(key)
+        if keys:
+            yield keys, metas
+
+    def _bulk_write_leaves(self, leaves):
+        """
+        Writes linked leaves one after another from the first page
+
+        :returns: list of ``(first_key, last_key, leaf_start)``
+        """
+        level = []
+        leaf = next(leaves, None)
+        if leaf is None:
+            return level
+        pages = []
+        prev_leaf = 0
+        leaf_start = self.data_start
+        self.buckets.seek(leaf_start)
+        for following in chain(leaves, (None, )):
+            next_leaf = leaf_start + self.page_size if following else 0
+            pages.append(
+                self._encode_leaf(leaf[0], leaf[1], prev_leaf, next_leaf))
+            level.append((leaf[0][0], leaf[0][-1], leaf_start))
+            if len(pages) == 256:
+                self.buckets.write(b''.join(pages))
+                pages = []
+            prev_leaf, leaf_start, leaf = leaf_start, next_leaf, following
+        self.buckets.write(b''.join(pages))
+        return level
+
+    def _bulk_write_nodes(self, level, page_limit):
+        """
+        Appends nodes for pages of ``level``
+
+        :returns: list of ``(first_key, last_key, node_start)``
+        """
+        groups = [[level[0]]]
+        keys_size = 0
+        prefix = None
+        for child in level[1:]:
+            group = groups[-1]
+            key = _separator(group[-1][1], child[0])
+            if prefix is None:
+                prefix = key
+            elif not key.startswith(prefix):
+                prefix = os.path.commonprefix((prefix, key))
+            if len(group) > 1 and self._node_size(len(group),
+                                                  keys_size + len(key),
+                                                  len(prefix)) > page_limit:
+                groups.append([child])
+                keys_size = 0
+                prefix = None
+            else:
+                group.append(child)
+                keys_size += len(key)
+        if len(groups) > 1 and len(groups[-1]) == 1:
+            # node needs two children at least, last two nodes share them
+            children = groups[-2] + groups.pop()
+            if len(children) > 3:
+                half = len(children) // 2
+                groups[-1:] = [children[:half], children[half:]]
+            else:
+                groups[-1] = children
+        pages = []
+        for group in groups:
+            keys = [
+                _separator(left[1], right[0])
+                for left, right in zip(group, group[1:])
+            ]
+            pages.append(self._encode_node(keys,
+                                           [child[2] for child in group]))
+        node_start = self._append_pages(pages)
+        upper = []
+        for group in groups:
+            upper.append((group[0][0], group[-1][1], node_start))
+            node_start += self.page_size
+        return upper
+
+    def compact(self, page_size=0):
+        if not page_size:
+            page_size = self.page_size
+
+        compact_ind = self.__class__(self.db_path,
+                                     self.name + '_compact',
+                                     page_size=page_size)
+        compact_ind.create_index()
+        compact_ind.storage.copy_settings(self.storage)
+
+        def copy_records():
+            for doc_id, key, start, size, status in self.all():
+                value = self.storage._read(start, size)
+                start_ = compact_ind.storage._write(value)
+                yield doc_id, key, start_, size, status
+
+        compact_ind.bulk_load(copy_records(), presorted=True)
+
+        compact_ind.close_index()
+        original_name = self.name
+        self.close_index()
+        shutil.move(
+            os.path.join(compact_ind.db_path, compact_ind.name + "_buck"),
+            os.path.join(self.db_path, self.name + "_buck"))
+        compact_ind._move_bloom(self.name)
+        compact_ind.storage.move(self.name)
+        self.open_index()
+        self.name = original_name
+        self._save_params(dict(name=original_name))
+        self._fix_params()
+        self._clear_cache()
+        return True
+
+    def _open_storage(self):
+        s = globals()[self.storage_class]
+        if not self.storage:
+            self.storage = s(self.db_path, self.name)
+            self._configure_storage()
+        self.storage.open()
+
+    def _create_storage(self):
+        s = globals()[self.storage_class]
+        if not self.storage:
+            self.storage = s(self.db_path, self.name)
+            self._configure_storage()
+        self.storage.create()
+
+
 # classes for public use, done in this way because of
 # generation static files with indexes (_index directory)
 
@@ -2119,3 +3420,10 @@ class MultiTreeBasedIndex(IU_MultiTreeBasedIndex):
     It allows to index more than one key for record. (ie. prefix/infix/suffix search mechanizms)
     That class is designed to be used in custom indexes.
     """
+
+
+class VarTreeBasedIndex(IU_VarTreeBasedIndex):
+    """
+    Tree index for ``bytes`` keys of variable length, check
+    :py:class:`IU_VarTreeBasedIndex`
+    """
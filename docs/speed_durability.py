@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Compares durability modes of database:
+insert / update times with different fsync policies.
+
+Usage: python speed_durability.py [number of records]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from codernitydb3.database import Database
+
+MODES = ('os', 10, 100, 'always')
+
+
+def run(mode, records):
+    path = tempfile.mkdtemp()
+    try:
+        db = Database(os.path.join(path, 'db'))
+        db.set_durability(mode)
+        db.create()
+        docs = []
+        start = time.time()
+        for i in range(records):
+            doc = dict(i=i, name='user %d' % i)
+            db.insert(doc)
+            docs.append(doc)
+        insert_time = time.time() - start
+
+        start = time.time()
+        for doc in docs:
+            doc['i'] += 1
+            db.update(doc)
+        update_time = time.time() - start
+        db.close()
+    finally:
+        shutil.rmtree(path)
+    name = mode if isinstance(mode, str) else 'every %d ms' % mode
+    print('%-12s insert: %8.1f us/op  update: %8.1f us/op' %
+          (name, insert_time / records * 1e6, update_time / records * 1e6))
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for mode in MODES:
+        run(mode, records)
+
+
+if __name__ == '__main__':
+    main()
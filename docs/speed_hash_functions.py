@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Compares hash functions of hash index:
+insert / get times and chain lengths of the id index and md5 keys index.
+
+Usage: python speed_hash_functions.py [number of records]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from hashlib import md5
+
+from codernitydb3.database import Database
+from codernitydb3.hash_index import HashIndex, UniqueHashIndex
+
+FUNCTIONS = ('crc32', 'blake2b', 'fnv1a')
+
+
+class Md5Index(HashIndex):
+    def __init__(self, *args, **kwargs):
+        kwargs['key_format'] = '16s'
+        super(Md5Index, self).__init__(*args, **kwargs)
+
+    def make_key_value(self, data):
+        return md5(data['name'].encode('utf8')).digest(), None
+
+    def make_key(self, key):
+        return md5(key.encode('utf8')).digest()
+
+
+def describe(lengths):
+    buckets = sum(lengths.values())
+    entries = sum(k * v for k, v in lengths.items())
+    return 'buckets: %7d  avg chain: %.3f  max chain: %d' % (
+        buckets, entries / float(buckets), max(lengths))
+
+
+def run(function, records):
+    UniqueHashIndex.hash_function = function
+    HashIndex.hash_function = function
+    path = tempfile.mkdtemp()
+    try:
+        db = Database(os.path.join(path, 'db'))
+        db.set_indexes([UniqueHashIndex(db.path, 'id')])
+        db.create()
+        db.add_index(Md5Index(db.path, 'md5'))
+        ids = []
+        start = time.time()
+        for i in range(records):
+            ids.append(db.insert(dict(name='user %d' % i))['_id'])
+        insert_time = time.time() - start
+
+        random.shuffle(ids)
+        start = time.time()
+        for _id in ids:
+            db.get('id', _id)
+        get_time = time.time() - start
+        id_lengths = db.id_ind.chain_lengths()
+        md5_lengths = db.indexes_names['md5'].chain_lengths()
+        db.close()
+    finally:
+        shutil.rmtree(path)
+    print('%-8s insert: %6.2fs  get: %6.2fs' %
+          (function, insert_time, get_time))
+    print('  id   %s' % describe(id_lengths))
+    print('  md5  %s' % describe(md5_lengths))
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for function in FUNCTIONS:
+        run(function, records)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Compares plain and compressed storage of the id index:
+insert / get times and size of the storage file.
+
+Usage: python speed_storages.py [number of records]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+from codernitydb3.database import Database
+from codernitydb3.hash_index import UniqueHashIndex
+
+
+class CompressedIdIndex(UniqueHashIndex):
+    def __init__(self, *args, **kwargs):
+        kwargs['storage_class'] = 'CompressedStorage'
+        super(CompressedIdIndex, self).__init__(*args, **kwargs)
+
+
+def make_doc(i):
+    # ~1.5 kB of repetitive JSON like data
+    return dict(i=i,
+                name='user %d' % i,
+                email='user%d@example.com' % i,
+                tags=['tag%d' % (i % 13), 'active', 'customer'],
+                address=dict(street='%d Main Street' % (i % 500),
+                             city='Springfield',
+                             country='US'),
+                history=[
+                    dict(event='login', ts=1600000000 + i * 60 + x, ok=True)
+                    for x in range(45)
+                ])
+
+
+def run(name, id_index, records):
+    path = tempfile.mkdtemp()
+    try:
+        db = Database(os.path.join(path, 'db'))
+        db.set_indexes([id_index(db.path, 'id')])
+        db.create()
+        ids = []
+        start = time.time()
+        for i in range(records):
+            ids.append(db.insert(make_doc(i))['_id'])
+        insert_time = time.time() - start
+        db.flush()
+        size = os.path.getsize(os.path.join(db.path, 'id_stor'))
+
+        random.shuffle(ids)
+        start = time.time()
+        for _id in ids:
+            db.get('id', _id)
+        get_time = time.time() - start
+        db.close()
+    finally:
+        shutil.rmtree(path)
+    print('%-12s insert: %6.2fs  get: %6.2fs  storage: %8d kB' %
+          (name, insert_time, get_time, size // 1024))
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    run('Storage', UniqueHashIndex, records)
+    run('Compressed', CompressedIdIndex, records)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,13 +18,23 @@
 import pytest
 import os
 import random
-from hashlib import md5
+import marshal
+import shutil
+import time
+from hashlib import md5, blake2b
 
 from codernitydb3.database import Database, RecordDeleted, RecordNotFound
-from codernitydb3.database import DatabaseException
+from codernitydb3.database import DatabaseException, PreconditionsException
 
 from codernitydb3.hash_index import HashIndex, UniqueHashIndex
+from codernitydb3.hash_index import LinearHashIndex, UniqueLinearHashIndex
+from codernitydb3.hash_index import PagedHashIndex, UniquePagedHashIndex
+from codernitydb3.hash_index import register_hash_function, get_hash_function
 from codernitydb3.index import IndexException
+from codernitydb3.storage import StorageException, register_codec, get_codec
+from codernitydb3.storage import SegmentedStorage, hole_punching
+from codernitydb3.storage import CompressedStorage, BufferedStorage
+from codernitydb3.bloom import header_struct as bloom_header, DIRTY
 from codernitydb3.misc import random_hex_32
 
 from codernitydb3 import rr_cache
@@ -101,6 +111,145 @@ class WithAIndex(HashIndex):
         return md5(key.encode('utf8')).digest()
 
 
+class BufferedUniqueHashIndex(UniqueHashIndex):
+    def __init__(self, *args, **kwargs):
+        kwargs['storage_class'] = 'BufferedStorage'
+        super(BufferedUniqueHashIndex, self).__init__(*args, **kwargs)
+
+
+class CompressedUniqueHashIndex(UniqueHashIndex):
+    def __init__(self, *args, **kwargs):
+        kwargs['storage_class'] = 'CompressedStorage'
+        super(CompressedUniqueHashIndex, self).__init__(*args, **kwargs)
+
+
+class SegmentedUniqueHashIndex(UniqueHashIndex):
+    def __init__(self, *args, **kwargs):
+        kwargs['storage_class'] = 'SegmentedStorage'
+        super(SegmentedUniqueHashIndex, self).__init__(*args, **kwargs)
+
+
+class PickleUniqueHashIndex(UniqueHashIndex):
+
+    storage_codec = 'pickle'
+
+
+class MmapUniqueHashIndex(UniqueHashIndex):
+
+    mmap_reads = True
+
+
+class ReuseUniqueHashIndex(UniqueHashIndex):
+
+    storage_reuse_space = True
+
+
+class ReuseBufferedUniqueHashIndex(UniqueHashIndex):
+
+    storage_reuse_space = True
+
+    def __init__(self, *args, **kwargs):
+        kwargs['storage_class'] = 'BufferedStorage'
+        super(ReuseBufferedUniqueHashIndex, self).__init__(*args, **kwargs)
+
+
+class ReuseSegmentedUniqueHashIndex(UniqueHashIndex):
+
+    storage_reuse_space = True
+
+    def __init__(self, *args, **kwargs):
+        kwargs['storage_class'] = 'SegmentedStorage'
+        super(ReuseSegmentedUniqueHashIndex, self).__init__(*args, **kwargs)
+
+
+class SmallUniqueLinearHashIndex(UniqueLinearHashIndex):
+    def __init__(self, *args, **kwargs):
+        kwargs['initial_buckets'] = 2
+        super(SmallUniqueLinearHashIndex, self).__init__(*args, **kwargs)
+
+
+class Md5KeyMixin(object):
+    def make_key_value(self, data):
+        a_val = data.get('a')
+        if a_val:
+            if not isinstance(a_val, str):
+                a_val = str(a_val)
+            return md5(a_val.encode('utf8')).digest(), {}
+        return {}
+
+    def make_key(self, key):
+        if not isinstance(key, str):
+            key = str(key)
+        return md5(key.encode('utf8')).digest()
+
+
+class LinearWithAIndex(Md5KeyMixin, LinearHashIndex):
+
+    custom_header = 'from tests.hash_tests import Md5KeyMixin'
+
+    def __init__(self, *args, **kwargs):
+        kwargs['key_format'] = '16s'
+        kwargs['initial_buckets'] = 2
+        super(LinearWithAIndex, self).__init__(*args, **kwargs)
+
+
+class SmallUniquePagedHashIndex(UniquePagedHashIndex):
+    def __init__(self, *args, **kwargs):
+        kwargs['hash_lim'] = 15
+        kwargs['page_entries'] = 4
+        super(SmallUniquePagedHashIndex, self).__init__(*args, **kwargs)
+
+
+class PagedWithAIndex(Md5KeyMixin, PagedHashIndex):
+
+    custom_header = 'from tests.hash_tests import Md5KeyMixin'
+
+    def __init__(self, *args, **kwargs):
+        kwargs['key_format'] = '16s'
+        kwargs['hash_lim'] = 3
+        kwargs['page_entries'] = 8
+        super(PagedWithAIndex, self).__init__(*args, **kwargs)
+
+
+class MemoryUniqueHashIndex(UniqueHashIndex):
+
+    memory_buckets = True
+
+
+class MemoryWithAIndex(WithAIndex):
+
+    custom_header = 'from tests.hash_tests import WithAIndex'
+
+    memory_buckets = True
+
+
+class BloomUniqueHashIndex(UniqueHashIndex):
+
+    bloom_capacity = 100
+
+
+class BloomWithAIndex(WithAIndex):
+
+    custom_header = 'from tests.hash_tests import WithAIndex'
+
+    bloom_capacity = 100
+
+
+class MmapMd5Index(HashIndex):
+
+    mmap_reads = True
+
+    def __init__(self, *args, **kwargs):
+        kwargs['key_format'] = '16s'
+        super(MmapMd5Index, self).__init__(*args, **kwargs)
+
+    def make_key_value(self, data):
+        return md5(data['a'].encode('utf8')).digest(), None
+
+    def make_key(self, key):
+        return md5(key.encode('utf8')).digest()
+
+
 class HashIndexTests:
 
     _db = Database
@@ -707,3 +856,913 @@ class HashIndexTests:
         assert 1 == db.count(db.get_many, 'custom', 1, limit=1, offset=offset)
 
         db.close()
+
+    def test_buffered_storage(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(BufferedStorage, 'buffer_time', 0)
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([BufferedUniqueHashIndex(db.path, 'id')])
+        db.create()
+        l = []
+        for i in range(100):
+            c = dict(i=i)
+            db.insert(c)
+            l.append(c)
+        storage = db.id_ind.storage
+        stor_path = os.path.join(db.path, 'id_stor')
+        # records are written in batches, not on every insert
+        assert storage._buffer
+        assert os.path.getsize(stor_path) < storage._tail
+        # pending records are readable before commit
+        start, size = storage.save(dict(i=100))
+        assert storage.get(start, size) == dict(i=100)
+        db.flush()
+        assert not storage._buffer
+        assert os.path.getsize(stor_path) == storage._tail
+        for curr in l:
+            assert db.get('id', curr['_id'])['i'] == curr['i']
+
+        for curr in l[:50]:
+            curr['updated'] = True
+            db.update(curr)
+        db.compact()
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        db.close()
+
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        assert db.count(db.all, 'id') == 100
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        db.close()
+
+    def test_buffered_storage_timer(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(BufferedStorage, 'buffer_time', 0.05)
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([BufferedUniqueHashIndex(db.path, 'id')])
+        db.create()
+        db.insert(dict(i=1))
+        storage = db.id_ind.storage
+        deadline = time.time() + 5
+        while storage._buffer and time.time() < deadline:
+            time.sleep(0.01)
+        assert not storage._buffer
+        assert os.path.getsize(os.path.join(db.path,
+                                            'id_stor')) == storage._tail
+        db.close()
+
+    def test_buffered_storage_lost_records(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(BufferedStorage, 'buffer_time', 0)
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([BufferedUniqueHashIndex(db.path, 'id')])
+        db.create()
+        saved = [dict(i=i) for i in range(20)]
+        for c in saved:
+            db.insert(c)
+        db.flush()
+        pending = [dict(i=i) for i in range(20, 40)]
+        for c in pending:
+            db.insert(c)
+        # files as they are on disk when the process dies now
+        crashed = os.path.join(str(tmpdir), 'crashed')
+        shutil.copytree(db.path, crashed)
+        db.close()
+
+        db = self._db(crashed)
+        db.open()
+        assert db.count(db.all, 'id') == 20
+        for c in saved:
+            assert db.get('id', c['_id']) == c
+        for c in pending:
+            with pytest.raises(RecordDeleted):
+                db.get('id', c['_id'])
+        c = dict(i='new')
+        db.insert(c)
+        db.close()
+
+        db = self._db(crashed)
+        db.open()
+        assert db.count(db.all, 'id') == 21
+        assert db.get('id', c['_id']) == c
+        db.close()
+
+    def test_mmap_reads(self, tmpdir):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([MmapUniqueHashIndex(db.path, 'id')])
+        db.create()
+        db.add_index(MmapMd5Index(db.path, 'md5'))
+        l = []
+        for i in range(200):
+            c = dict(a=str(i % 50), i=i)
+            db.insert(c)
+            l.append(c)
+        # files grow, reader has to remap them
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        old_map = db.id_ind.storage._reader._map
+        c = dict(a='x', i=200)
+        db.insert(c)
+        assert db.get('id', c['_id']) == c
+        # previous map is closed
+        assert db.id_ind.storage._reader._map is not old_map
+        assert old_map.closed
+        db.delete(c)
+        assert db.count(db.get_many, 'md5', '7', limit=-1) == 4
+        for curr in l[:100]:
+            curr['i'] += 1000
+            db.update(curr)
+        for curr in l[100:150]:
+            db.delete(curr)
+        assert db.count(db.all, 'id') == 150
+        db.compact()
+        for curr in l[:100]:
+            assert db.get('id', curr['_id'])['i'] == curr['i']
+        for curr in l[100:150]:
+            with pytest.raises(RecordNotFound):
+                db.get('id', curr['_id'])
+        db.close()
+
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        assert db.count(db.all, 'id') == 150
+        assert db.count(db.all, 'md5') == 150
+        db.close()
+
+    def test_storage_codec(self, tmpdir):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([PickleUniqueHashIndex(db.path, 'id')])
+        db.create()
+        assert db.id_ind.storage.codec == 'pickle'
+        l = []
+        for i in range(50):
+            c = dict(i=i, t=(i, str(i)), s={i})
+            db.insert(c)
+            l.append(c)
+        db.close()
+        with open(os.path.join(db.path, 'id_stor'), 'rb') as f:
+            assert f.read(31)[15:].rstrip(b'\x00') == b'pickle'
+
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        db.close()
+
+    def test_storage_codec_from_header(self, tmpdir):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.create()
+        docs = [dict(i=i) for i in range(10)]
+        for doc in docs:
+            db.insert(doc)
+        db.close()
+        # storages created before codecs have no codec name in header
+        with open(os.path.join(db.path, 'id_stor'), 'r+b') as f:
+            f.seek(15)
+            f.write(b'\x00' * 16)
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        assert db.id_ind.storage.codec == 'marshal'
+        for doc in docs:
+            assert db.get('id', doc['_id']) == doc
+        db.close()
+
+        with open(os.path.join(db.path, 'id_stor'), 'r+b') as f:
+            f.seek(15)
+            f.write(b'unknown')
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        with pytest.raises(StorageException):
+            db.open()
+        with pytest.raises(StorageException):
+            register_codec('x' * 17, repr, eval)
+
+    def test_compressed_storage(self, tmpdir):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([CompressedUniqueHashIndex(db.path, 'id')])
+        db.create()
+        l = []
+        for i in range(200):
+            c = dict(i=i,
+                     name='name %d' % i,
+                     tags=['tag%d' % (i % 7), 'common', 'tags'],
+                     text='some repetitive text of the document ' * 30)
+            db.insert(c)
+            l.append(c)
+        storage = db.id_ind.storage
+        assert len(storage._zdicts) == 2
+        assert os.path.exists(os.path.join(db.path, 'id_zdict'))
+        # 200 documents, over 1 kB each
+        assert os.path.getsize(os.path.join(db.path, 'id_stor')) < 200 * 1024
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        for curr in l[:50]:
+            curr['updated'] = True
+            db.update(curr)
+        db.compact()
+        assert not os.path.exists(os.path.join(db.path, 'id_compact_zdict'))
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        db.close()
+
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        assert len(db.id_ind.storage._zdicts) == 2
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        db.insert(dict(i=200))
+        assert db.count(db.all, 'id') == 201
+        db.compact()
+        locations = [db.id_ind.get(curr['_id'])[2:] for curr in l]
+        values = [db.id_ind.storage.get(*loc) for loc in locations]
+        db.close()
+
+        # dictionaries go with records when storage is moved
+        storage = CompressedStorage(db.path, 'id')
+        storage.move('renamed')
+        assert not os.path.exists(os.path.join(db.path, 'id_zdict'))
+        storage = CompressedStorage(db.path, 'renamed')
+        storage.open()
+        assert [storage.get(*loc) for loc in locations] == values
+        storage.close()
+        storage.destroy()
+        assert not os.path.exists(os.path.join(db.path, 'renamed_zdict'))
+
+    def test_segmented_storage(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(SegmentedStorage, 'segment_size', 4096)
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([SegmentedUniqueHashIndex(db.path, 'id')])
+        db.create()
+        l = []
+        for i in range(100):
+            c = dict(i=i, text='x' * 100)
+            db.insert(c)
+            l.append(c)
+        storage = db.id_ind.storage
+        sealed = storage.sealed_segments()
+        assert len(sealed) > 1
+        for seg_id in sealed:
+            assert os.path.getsize(storage.segment_path(seg_id)) <= 4096
+        with pytest.raises(StorageException):
+            db.insert(dict(text='x' * 5000))
+
+        for curr in l:
+            curr['i'] += 1
+            db.update(curr)
+        # segments with outdated records only can be dropped
+        live = set(start // 4096
+                   for _, _, start, _, _ in db.id_ind.all(limit=-1))
+        dead = [seg_id for seg_id in sealed if seg_id not in live]
+        assert dead
+        for seg_id in dead:
+            storage.drop_segment(seg_id)
+            assert not os.path.exists(storage.segment_path(seg_id))
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        db.close()
+
+        monkeypatch.setattr(SegmentedStorage, 'segment_size', 1024 * 1024)
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        # segment size is saved in the manifest
+        assert db.id_ind.storage.segment_size == 4096
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        db.compact()
+        assert db.id_ind.storage.segment_size == 1024 * 1024
+        assert db.id_ind.storage.sealed_segments() == []
+        assert not [
+            n for n in os.listdir(db.path) if n.startswith('id_compact')
+        ]
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        db.close()
+
+    @pytest.mark.parametrize(('id_index', ), [(UniqueHashIndex, ),
+                                              (BufferedUniqueHashIndex, ),
+                                              (SegmentedUniqueHashIndex, )])
+    def test_storage_get_many(self, tmpdir, monkeypatch, id_index):
+        monkeypatch.setattr(SegmentedStorage, 'segment_size', 4096)
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([id_index(db.path, 'id')])
+        db.create()
+        db.add_index(WithAIndex(db.path, 'with_a'))
+        l = []
+        for i in range(300):
+            c = dict(a=i % 3, i=i, text='x' * (i % 50))
+            db.insert(c)
+            l.append(c)
+            if i == 150:
+                # part of records is committed, part is still buffered
+                db.flush()
+        locations = [db.id_ind.get(curr['_id'])[2:] for curr in l]
+        random.shuffle(locations)
+        storage = db.id_ind.storage
+        assert storage.get_many(locations) == [
+            storage.get(*loc) for loc in locations
+        ]
+        assert storage.get_many([]) == []
+
+        assert sorted(db.all('id'), key=lambda d: d['i']) == l
+        docs = list(db.get_many('with_a', 1, limit=-1, with_doc=True))
+        assert sorted((d['doc'] for d in docs),
+                      key=lambda d: d['i']) == [c for c in l if c['a'] == 1]
+        docs = list(db.all('with_a', with_doc=True))
+        # a=0 is not indexed by with_a
+        assert sorted(d['doc']['i']
+                      for d in docs) == [i for i in range(300) if i % 3]
+        assert storage.get_many([locations[0][:2] + (b'd', )]) == [None]
+
+        # records before the one without document are yielded
+        ids = [d['_id'] for d in db.get_many('with_a', 1, limit=-1)]
+        db.id_ind.delete(ids[10])
+        got = []
+        with pytest.raises(RecordDeleted):
+            for d in db.get_many('with_a', 1, limit=-1, with_doc=True):
+                got.append(d['_id'])
+        assert got == ids[:10]
+        db.close()
+
+    @pytest.mark.parametrize(('id_index', ),
+                             [(ReuseUniqueHashIndex, ),
+                              (ReuseBufferedUniqueHashIndex, ),
+                              (ReuseSegmentedUniqueHashIndex, )])
+    def test_storage_reuse_space(self, tmpdir, monkeypatch, id_index):
+        monkeypatch.setattr(SegmentedStorage, 'segment_size', 64 * 1024)
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([id_index(db.path, 'id')])
+        db.create()
+
+        def location(curr):
+            return db.id_ind.get(curr['_id'])[2]
+
+        l = []
+        for i in range(100):
+            c = dict(i=i, text='x' * 100)
+            db.insert(c)
+            l.append(c)
+            if i == 50:
+                db.flush()
+        for curr in l[:50]:
+            start = location(curr)
+            curr['text'] = 'x' * 50
+            db.update(curr)
+            assert location(curr) == start
+        freed = set()
+        for curr in l[50:]:
+            freed.add(location(curr))
+            curr['text'] = 'x' * 200
+            db.update(curr)
+            assert location(curr) not in freed
+        for curr in l[:10]:
+            db.delete(curr)
+        del l[:10]
+        for i in range(20):
+            c = dict(i=i, text='y' * 100)
+            db.insert(c)
+            l.append(c)
+            assert location(c) in freed
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        db.close()
+        free_path = os.path.join(db.path, 'id_free')
+        assert os.path.exists(free_path)
+
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        assert not os.path.exists(free_path)
+        for i in range(20):
+            c = dict(i=i, text='z' * 100)
+            db.insert(c)
+            l.append(c)
+            assert location(c) in freed
+        db.compact()
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        db.close()
+        assert not os.path.exists(free_path)
+
+    @pytest.mark.skipif(not hole_punching, reason="no hole punching")
+    @pytest.mark.parametrize(('id_index', ), [(UniqueHashIndex, ),
+                                              (BufferedUniqueHashIndex, ),
+                                              (SegmentedUniqueHashIndex, ),
+                                              (ReuseUniqueHashIndex, )])
+    def test_reclaim_space(self, tmpdir, monkeypatch, id_index):
+        monkeypatch.setattr(SegmentedStorage, 'segment_size', 64 * 1024)
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([id_index(db.path, 'id')])
+        db.create()
+
+        def disk_usage():
+            return sum(
+                os.stat(os.path.join(db.path, name)).st_blocks * 512
+                for name in os.listdir(db.path) if name.startswith('id_stor'))
+
+        l = []
+        for i in range(200):
+            c = dict(i=i, text=str(i) * 3000)
+            db.insert(c)
+            l.append(c)
+        for curr in l[:100]:
+            curr['text'] += 'x'
+            db.update(curr)
+        for curr in l[100:150]:
+            db.delete(curr)
+        del l[100:150]
+        db.flush()
+        before = disk_usage()
+        released = db.reclaim_space('id')
+        if id_index is ReuseUniqueHashIndex:
+            assert released == 0
+        else:
+            assert released > 100 * 4096
+            assert disk_usage() <= before - released
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        assert sorted(db.all('id'), key=lambda d: d['i']) == l
+        # nothing more to release
+        assert db.reclaim_space(db.id_ind) == 0
+        with pytest.raises(PreconditionsException):
+            db.reclaim_space('missing')
+        db.close()
+
+    @pytest.mark.parametrize(('id_index', ), [(UniqueHashIndex, ),
+                                              (BufferedUniqueHashIndex, ),
+                                              (CompressedUniqueHashIndex, ),
+                                              (SegmentedUniqueHashIndex, ),
+                                              (MmapUniqueHashIndex, ),
+                                              (PickleUniqueHashIndex, )])
+    def test_get_raw(self, tmpdir, id_index):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([id_index(db.path, 'id')])
+        db.create()
+        db.add_index(WithAIndex(db.path, 'with_a'))
+        l = []
+        for i in range(100):
+            c = dict(a=i, text='x' * i)
+            db.insert(c)
+            l.append(c)
+            if i == 50:
+                db.flush()
+        for curr in l:
+            res = db.get_raw('id', curr['_id'])
+            assert isinstance(res['raw'], memoryview)
+            assert res['_rev'] == curr['_rev']
+            loads = get_codec(res['codec'])[1]
+            assert loads(res['raw']) == dict(a=curr['a'], text=curr['text'])
+        res = db.get_raw('with_a', 5)
+        assert res['_id'] == l[5]['_id']
+        assert res['raw'] is None
+        db.delete(l[0])
+        with pytest.raises(RecordDeleted):
+            db.get_raw('id', l[0]['_id'])
+        with pytest.raises(RecordNotFound):
+            db.get_raw('id', b'0' * 32)
+        db.close()
+
+    def test_linear_hash_index(self, tmpdir):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([SmallUniqueLinearHashIndex(db.path, 'id')])
+        db.create()
+        db.add_index(LinearWithAIndex(db.path, 'with_a'))
+        l = []
+        for i in range(600):
+            c = dict(a=i % 7, i=i)
+            db.insert(c)
+            l.append(c)
+        # buckets were split while inserting
+        assert len(db.id_ind._dir) >= 600 / db.id_ind.load_factor
+        assert os.path.getsize(os.path.join(db.path, 'id_buck')) < 600 * 64
+        for curr in l[::3]:
+            curr['up'] = True
+            db.update(curr)
+        for curr in l[::5]:
+            db.delete(curr)
+        live = [c for c in l if c['i'] % 5]
+
+        def check():
+            for curr in live:
+                assert db.get('id', curr['_id']) == curr
+            for curr in l[::5]:
+                with pytest.raises(RecordDeleted):
+                    db.get('id', curr['_id'])
+            for a in range(1, 7):
+                assert db.count(db.get_many, 'with_a', a, limit=-1) == len(
+                    [c for c in live if c['a'] == a])
+            assert db.count(db.all, 'id') == len(live)
+
+        check()
+        db.close()
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        assert db.id_ind.initial_buckets == 2
+        check()
+        db.compact()
+        assert len(db.id_ind._dir) < 600 / db.id_ind.load_factor
+        l = [c for c in l if c['i'] % 5]
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        for a in range(1, 7):
+            assert db.count(db.get_many, 'with_a', a,
+                            limit=-1) == len([c for c in l if c['a'] == a])
+        db.reindex()
+        assert db.count(db.get_many, 'with_a', 3,
+                        limit=-1) == len([c for c in l if c['a'] == 3])
+        db.destroy()
+        assert not os.path.exists(os.path.join(str(tmpdir), 'db'))
+
+    @pytest.mark.parametrize(('hash_function', ), [('crc32', ), ('blake2b', ),
+                                                   ('fnv1a', ), ('builtin', ),
+                                                   ('custom', )])
+    def test_hash_function(self, tmpdir, monkeypatch, hash_function):
+        register_hash_function('custom', lambda key: len(key))
+        monkeypatch.setattr(UniqueHashIndex, 'hash_function', hash_function)
+        monkeypatch.setattr(LinearHashIndex, 'hash_function', hash_function)
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([UniqueHashIndex(db.path, 'id')])
+        db.create()
+        db.add_index(LinearWithAIndex(db.path, 'with_a'))
+        l = []
+        for i in range(200):
+            c = dict(a=i % 7, i=i)
+            db.insert(c)
+            l.append(c)
+        with open(os.path.join(db.path, 'id_buck'), 'rb') as f:
+            props = marshal.loads(f.read(500))
+        assert props['hash_function'] == hash_function
+        lengths = db.id_ind.chain_lengths()
+        assert sum(k * v for k, v in lengths.items()) == 200
+        if hash_function == 'custom':
+            assert lengths == {200: 1}
+        assert sum(
+            k * v for k, v in
+            db.indexes_names['with_a'].chain_lengths().items()) == 200 - 29
+        db.close()
+
+        monkeypatch.undo()
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        assert db.id_ind.hash_function == hash_function
+        assert db.indexes_names['with_a'].hash_function == hash_function
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        assert db.count(db.get_many, 'with_a', 3, limit=-1) == 29
+        db.compact()
+        # compacted index uses function of the index class
+        assert db.id_ind.hash_function == 'crc32'
+        for curr in l:
+            assert db.get('id', curr['_id']) == curr
+        db.close()
+
+    def test_hash_functions_stable(self):
+        assert get_hash_function('crc32')(b'abc') == 0x352441c2
+        assert get_hash_function('fnv1a')(b'a') == 0xaf63dc4c8601ec8c
+        assert get_hash_function('fnv1a')(b'a\x00') != get_hash_function(
+            'fnv1a')(b'a')
+        assert get_hash_function('blake2b')(b'abc') == int.from_bytes(
+            blake2b(b'abc', digest_size=8).digest(), 'little')
+        assert get_hash_function('crc32')(5) == get_hash_function('crc32')(
+            b'5')
+        with pytest.raises(IndexException):
+            get_hash_function('missing')
+
+    def test_paged_hash_index(self, tmpdir, monkeypatch):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([SmallUniquePagedHashIndex(db.path, 'id')])
+        db.create()
+        db.add_index(PagedWithAIndex(db.path, 'with_a'))
+        l = []
+        for i in range(300):
+            c = dict(a=i % 7, i=i)
+            db.insert(c)
+            l.append(c)
+        id_ind = db.id_ind
+        for curr in l[::2]:
+            curr['up'] = True
+            db.update(curr)
+        for curr in l[::5]:
+            db.delete(curr)
+        live = [c for c in l if c['i'] % 5]
+
+        # every chain is stored in pages owned by its bucket
+        for location in id_ind._bucket_locations():
+            pages = [
+                id_ind._page_start(at) for at, _ in id_ind._walk(location)
+            ]
+            assert pages == sorted(pages)
+            assert len(pages) <= len(set(pages)) * 4
+        # one read per page when walking the chain
+        reads = []
+        read_buckets = id_ind._read_buckets
+        monkeypatch.setattr(
+            id_ind, '_read_buckets',
+            lambda *args: reads.append(args) or read_buckets(*args))
+        lengths = id_ind.chain_lengths()
+        assert len(reads) == sum(-(-k // 4) * v
+                                 for k, v in lengths.items()) + 1
+        monkeypatch.undo()
+
+        def check(deleted_exc=RecordDeleted):
+            for curr in live:
+                assert db.get('id', curr['_id']) == curr
+            for curr in l[::5]:
+                with pytest.raises(deleted_exc):
+                    db.get('id', curr['_id'])
+            for a in range(1, 7):
+                assert db.count(db.get_many, 'with_a', a, limit=-1) == len(
+                    [c for c in live if c['a'] == a])
+            assert db.count(db.get_many, 'with_a', 3, limit=3, offset=30) == 3
+            assert db.count(db.all, 'id') == len(live)
+            assert db.count(db.all,
+                            'with_a') == len([c for c in live if c['a']])
+
+        check()
+        db.close()
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        assert db.id_ind.page_entries == 4
+        check()
+        db.compact()
+        # deleted entries are gone after compaction
+        check(RecordNotFound)
+        db.close()
+
+    def test_memory_buckets(self, tmpdir, monkeypatch):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([MemoryUniqueHashIndex(db.path, 'id')])
+        db.create()
+        db.add_index(MemoryWithAIndex(db.path, 'with_a'))
+        l = []
+        for i in range(200):
+            c = dict(a=i % 7, i=i)
+            db.insert(c)
+            l.append(c)
+        for curr in l[::2]:
+            curr['up'] = True
+            db.update(curr)
+        for curr in l[::5]:
+            db.delete(curr)
+        live = [c for c in l if c['i'] % 5]
+
+        def check():
+            for curr in live:
+                assert db.get('id', curr['_id']) == curr
+            for curr in l[::5]:
+                with pytest.raises((RecordDeleted, RecordNotFound)):
+                    db.get('id', curr['_id'])
+            with pytest.raises(RecordNotFound):
+                db.get('id', b'0' * 32)
+            for a in range(1, 7):
+                assert db.count(db.get_many, 'with_a', a, limit=-1) == len(
+                    [c for c in live if c['a'] == a])
+
+        # bucket table is never read from the file
+        for ind in (db.id_ind, db.indexes_names['with_a']):
+            read_buckets = ind._read_buckets
+            monkeypatch.setattr(
+                ind,
+                '_read_buckets',
+                lambda start, size, read=read_buckets, ind=ind: read(
+                    start, size)
+                if start >= ind.data_start else pytest.fail(start))
+        check()
+        monkeypatch.undo()
+        db.close()
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        assert db.id_ind._bucket_table is not None
+        check()
+        db.compact()
+        check()
+        db.close()
+
+    def test_bloom_filter(self, tmpdir, monkeypatch):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([BloomUniqueHashIndex(db.path, 'id')])
+        db.create()
+        db.add_index(BloomWithAIndex(db.path, 'with_a'))
+        l = []
+        for i in range(100):
+            c = dict(a=i % 10, i=i)
+            db.insert(c)
+            l.append(c)
+        for curr in l[::10]:
+            db.delete(curr)
+        live = [c for c in l if c['i'] % 10]
+        missing = [random_hex_32() for _ in range(100)]
+        bloom_path = os.path.join(db.path, 'id_bloom')
+
+        def check():
+            assert all(db.key_exists('id', c['_id']) for c in live)
+            assert not any(db.key_exists('id', c['_id']) for c in l[::10])
+            assert not any(db.key_exists('id', _id) for _id in missing)
+            assert all(db.key_exists('with_a', a) for a in range(1, 10))
+            assert not db.key_exists('with_a', 10)
+            assert db.count(db.get_many, 'with_a', 5, limit=-1) == 10
+            # missing keys are mostly rejected by the filter
+            id_ind = db.id_ind
+            rejected = [_id for _id in missing if _id not in id_ind.bloom]
+            assert len(rejected) > 90
+            monkeypatch.setattr(id_ind, '_read_buckets',
+                                lambda *args: pytest.fail(args))
+            for _id in rejected:
+                with pytest.raises(RecordNotFound):
+                    db.get('id', _id)
+            monkeypatch.undo()
+
+        check()
+        with pytest.raises(IndexException):
+            db.key_exists('missing', 1)
+        db.close()
+        with open(bloom_path, 'rb') as f:
+            assert f.read(1) != DIRTY
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        # filter in use is not trusted after crash
+        with open(bloom_path, 'rb') as f:
+            assert f.read(1) == DIRTY
+        check()
+        db.close()
+
+        # not closed cleanly, rebuilt from index keys
+        with open(bloom_path, 'r+b') as f:
+            f.write(DIRTY)
+            f.seek(bloom_header.size)
+            f.write(b'\x00' * 16)
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        check()
+        db.compact()
+        check()
+        db.reindex()
+        check()
+        db.destroy()
+
+    @pytest.mark.parametrize(('ind_class', ), [(WithAIndex, ),
+                                               (PagedWithAIndex, ),
+                                               (LinearWithAIndex, )])
+    def test_reuse_deleted_entries(self, tmpdir, ind_class):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([UniqueHashIndex(db.path, 'id')])
+        db.create()
+        db.add_index(ind_class(db.path, 'with_a'))
+        ind = db.indexes_names['with_a']
+        buck = os.path.join(db.path, 'with_a_buck')
+        free = os.path.join(db.path, 'with_a_buck_free')
+        l = []
+        for i in range(200):
+            c = dict(a=i % 7, i=i)
+            db.insert(c)
+            l.append(c)
+
+        def check():
+            # deleted entries are unlinked from chains
+            for location in ind._bucket_locations():
+                for _, entry in ind._walk(location):
+                    assert entry[-2] == ind.STATUS_O
+            for a in range(1, 7):
+                assert db.count(db.get_many, 'with_a', a,
+                                limit=-1) == len([c for c in l if c['a'] == a])
+            assert db.count(db.all, 'with_a') == len([c for c in l if c['a']])
+
+        for curr in l[::2]:
+            db.delete(curr)
+        l = l[1::2]
+        check()
+        size = os.path.getsize(buck)
+        for i in range(0, 200, 2):
+            c = dict(a=i % 7, i=i)
+            db.insert(c)
+            l.append(c)
+        check()
+        assert os.path.getsize(buck) == size
+
+        for curr in l[:50]:
+            db.delete(curr)
+        l = l[50:]
+        # paged index reuses slots in pages of the bucket, only empty
+        # pages are on the list
+        free_entries = len(ind._free_entries)
+        assert free_entries or ind_class is PagedWithAIndex
+        # saved on flush, not only on close
+        db.flush()
+        assert os.path.exists(free) == bool(free_entries)
+        db.close()
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        ind = db.indexes_names['with_a']
+        assert len(ind._free_entries) == free_entries
+        check()
+        for i in range(50):
+            c = dict(a=l[i]['a'], i=i)
+            db.insert(c)
+            l.append(c)
+        check()
+        assert os.path.getsize(buck) == size
+        if ind_class is LinearWithAIndex:
+            # free entries don't count for bucket splits
+            assert ind.entries == len([c for c in l if c['a']])
+        for curr in l[:50]:
+            db.delete(curr)
+        l = l[50:]
+        db.compact()
+        ind = db.indexes_names['with_a']
+        assert not ind._free_entries
+        check()
+        db.close()
+        assert not os.path.exists(free)
+
+    @pytest.mark.parametrize(('ind_class', ), [(WithAIndex, ),
+                                               (PagedWithAIndex, ),
+                                               (LinearWithAIndex, )])
+    def test_get_multi(self, tmpdir, ind_class):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([UniqueHashIndex(db.path, 'id')])
+        db.create()
+        db.add_index(ind_class(db.path, 'with_a'))
+        l = []
+        for i in range(300):
+            c = dict(a=i % 50, i=i)
+            db.insert(c)
+            l.append(c)
+        deleted = [
+            l[i] for i in sorted(set(range(0, 50, 3)) | set(range(1, 100, 7)))
+        ]
+        for curr in deleted:
+            db.delete(curr)
+
+        def get_or_none(index_name, key, **kwargs):
+            try:
+                return db.get(index_name, key, **kwargs)
+            except (RecordNotFound, RecordDeleted):
+                return None
+
+        ids = [c['_id'] for c in l[::5]] + [random_hex_32()] + [l[0]['_id']]
+        res = db.get_multi('id', ids)
+        assert res == [get_or_none('id', _id) for _id in ids]
+        assert res[-1] is None and res[-2] is None
+        assert [r['i'] for r in res[:-2]
+                if r] == [c['i'] for c in l[::5] if c not in deleted]
+
+        keys = list(range(60)) + [7, 3]
+        for kwargs in ({}, dict(with_doc=True), dict(with_storage=False)):
+            res = db.get_multi('with_a', keys, **kwargs)
+            assert res == [get_or_none('with_a', a, **kwargs) for a in keys]
+        assert [bool(r) for r in res] == [0 < a < 50 for a in keys]
+        assert db.get_multi('with_a', []) == []
+        with pytest.raises(IndexException):
+            db.get_multi('missing', keys)
+
+        # every bucket is read once
+        ind = db.indexes_names['with_a']
+        read = []
+        read_bucket = ind._read_bucket
+
+        def counting(position):
+            read.append(position)
+            return read_bucket(position)
+
+        ind._read_bucket = counting
+        ind.get_multi(keys)
+        assert read == sorted(set(read))
+        assert len(read) == len(
+            set(ind._calculate_position(ind.make_key(a)) for a in keys))
+        db.close()
+
+    @pytest.mark.parametrize(('ind_class', ), [(WithAIndex, ),
+                                               (PagedWithAIndex, ),
+                                               (LinearWithAIndex, )])
+    def test_all_block_reads(self, tmpdir, ind_class):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes([UniqueHashIndex(db.path, 'id')])
+        db.create()
+        db.add_index(ind_class(db.path, 'with_a'))
+        for i in range(500):
+            db.insert(dict(a=i % 50, i=i))
+        for curr in db.all('id', limit=100):
+            db.delete(curr)
+        ind = db.indexes_names['with_a']
+        expected_id = list(db.id_ind.all())
+        expected = list(ind.all())
+        assert len(expected_id) == 400
+        assert len(expected) == db.count(db.all, 'with_a')
+        reads = []
+        for index in (db.id_ind, ind):
+            read_buckets = index._read_buckets
+
+            def counting(start, size, read_buckets=read_buckets):
+                reads.append(size)
+                return read_buckets(start, size)
+
+            index._read_buckets = counting
+        assert list(db.id_ind.all()) == expected_id
+        assert list(ind.all()) == expected
+        assert len(reads) <= 4
+        # blocks hold whole entries (pages), smaller than file
+        for index in (db.id_ind, ind):
+            index.scan_block_size = 1000
+        del reads[:]
+        assert list(db.id_ind.all()) == expected_id
+        assert list(ind.all()) == expected
+        assert 4 < len(reads) < 200
+        assert db.count(db.all, 'id') == 400
+        assert list(db.id_ind.all(limit=5, offset=3)) == expected_id[3:8]
+        db.close()
@@ -17,7 +17,9 @@
 
 import pytest
 import os
+import io
 import random
+import time
 from hashlib import md5
 
 from codernitydb3.database import Database, RecordDeleted, RecordNotFound
@@ -1087,6 +1089,114 @@ class DB_Tests:
             db.insert(dict(x=x))
         db.close()
 
+    def test_durability(self, tmpdir, monkeypatch):
+        synced = []
+        fsync = os.fsync
+
+        def counting_fsync(fd):
+            synced.append(fd)
+            fsync(fd)
+
+        monkeypatch.setattr(os, 'fsync', counting_fsync)
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.create()
+        db.add_index(WithAIndex(db.path, 'with_a'))
+        for mode in ('never', True, 0, -5, None):
+            with pytest.raises(PreconditionsException):
+                db.set_durability(mode)
+
+        del synced[:]
+        doc = dict(a=1)
+        db.insert(doc)
+        assert synced == []
+
+        db.set_durability('always')
+        db.insert(dict(a=2))
+        assert len(synced) >= 4  # buckets and storage of both indexes
+        del synced[:]
+        db.update(doc)
+        assert synced
+        del synced[:]
+
+        db.set_durability(10)
+        db.delete(doc)
+        assert synced == []
+        for x in range(200):
+            if len(synced) >= 4:
+                break
+            time.sleep(0.01)
+        assert len(synced) >= 4
+        time.sleep(0.05)
+        del synced[:]
+        time.sleep(0.05)
+        assert synced == []  # nothing written, nothing synced
+        db.insert(dict(a=3))
+        syncer = db._syncer
+        db.close()
+        # last writes are synced on close
+        assert synced
+        assert not syncer.is_alive()
+
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_durability(10)
+        db.open()
+        assert db._syncer.is_alive()
+        db.set_durability('os')
+        assert db._syncer is None
+        assert db.count(db.all, 'with_a') == 2
+        db.close()
+
+    def test_blobs(self, tmpdir, monkeypatch):
+        from codernitydb3.storage import BlobStore, StorageException
+        monkeypatch.setattr(BlobStore, 'chunk_size', 4096)
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.create()
+        payload = os.urandom(100000)
+        src = io.BytesIO(payload)
+        reads = []
+        orig_read = src.read
+
+        def read(size=-1):
+            reads.append(size)
+            return orig_read(size)
+
+        src.read = read
+        blob_id = db.put_blob(src)
+        # copied in chunks
+        assert reads and max(reads) == 4096
+        small_id = db.put_blob(b'small')
+        doc = dict(name='a', attachments=[blob_id, small_id])
+        db.insert(doc)
+
+        with db.blobs.create_blob() as writer:
+            for x in range(10):
+                writer.write(b'%d' % x)
+        assert db.blobs.blob_size(writer.blob_id) == 10
+        with pytest.raises(ValueError):
+            with db.blobs.create_blob() as failed:
+                failed.write(b'data')
+                raise ValueError()
+        assert len(os.listdir(os.path.join(db.path, '_blobs'))) == 3
+        db.close()
+
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        doc = db.get('id', doc['_id'])
+        with db.open_blob(doc['attachments'][0]) as f:
+            assert f.read(10) == payload[:10]
+            f.seek(50000)
+            assert f.read() == payload[50000:]
+        with db.open_blob(doc['attachments'][1]) as f:
+            assert f.read() == b'small'
+        db.delete_blob(small_id)
+        with pytest.raises(StorageException):
+            db.open_blob(small_id)
+        with pytest.raises(StorageException):
+            db.open_blob('../../etc/passwd')
+        db.close()
+        with pytest.raises(DatabaseException):
+            db.put_blob(b'closed')
+
     def test_revert_index(self, tmpdir):
         db = self._db(os.path.join(str(tmpdir), 'db'))
         db.create()
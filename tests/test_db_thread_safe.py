@@ -19,9 +19,12 @@ import os
 import time
 import random
 import pytest
-from threading import Thread
+from threading import Thread, Barrier
 
 from codernitydb3.database_thread_safe import ThreadSafeDatabase
+from codernitydb3.database_safe_shared import RWLock
+from codernitydb3.reclaimer import SpaceReclaimer
+from codernitydb3.storage import hole_punching
 
 from .shared import DB_Tests, WithAIndex
 from .hash_tests import HashIndexTests
@@ -101,3 +104,103 @@ class Test_Threads:
 
         assert db.count(db.all, 'with_a', with_doc=True) == 1
         assert db.count(db.all, 'id') == 1
+
+    def test_rw_lock(self):
+        lock = RWLock()
+        both_inside = Barrier(2, timeout=5)
+        errors = []
+
+        def reader():
+            try:
+                with lock.reader:
+                    both_inside.wait()
+            except Exception as e:
+                errors.append(e)
+
+        ths = [Thread(target=reader) for x in range(2)]
+        for th in ths:
+            th.start()
+        for th in ths:
+            th.join()
+        assert errors == []
+
+        # writer may enter again and read while writing
+        with lock:
+            with lock:
+                with lock.reader:
+                    pass
+        assert lock._writer is None
+        assert lock._readers == {}
+
+    def test_parallel_reads(self, tmpdir):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.create()
+        db.add_index(WithAIndex(db.path, 'with_a'))
+        docs = [dict(a=x) for x in range(1, 201)]
+        for doc in docs:
+            db.insert(doc)
+        errors = []
+
+        def reader():
+            try:
+                for i in range(200):
+                    doc = random.choice(docs)
+                    assert db.get('id', doc['_id'])['_id'] == doc['_id']
+                    assert db.get('with_a', doc['a'],
+                                  with_doc=True)['doc']['a'] == doc['a']
+                assert db.count(db.all, 'with_a') == 200
+            except Exception as e:
+                errors.append(e)
+
+        def writer():
+            try:
+                for doc in random.sample(docs, 50):
+                    doc = db.get('id', doc['_id'])
+                    doc['b'] = 1
+                    db.update(doc)
+            except Exception as e:
+                errors.append(e)
+
+        ths = [Thread(target=reader) for x in range(8)]
+        ths.append(Thread(target=writer))
+        for th in ths:
+            th.start()
+        for th in ths:
+            th.join()
+        assert errors == []
+        assert db.count(db.all, 'id') == 200
+        assert db.count(db.all, 'with_a') == 200
+
+    @pytest.mark.skipif(not hole_punching, reason="no hole punching")
+    def test_space_reclaimer(self, tmpdir):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.create()
+        db.add_index(WithAIndex(db.path, 'with_a'))
+        docs = [dict(a=x, text='x' * 5000) for x in range(1, 101)]
+        for doc in docs:
+            db.insert(doc)
+        reclaimer = SpaceReclaimer(db, interval=0.01)
+        reclaimer.start()
+        errors = []
+
+        def writer(part):
+            try:
+                for doc in part:
+                    for i in range(5):
+                        doc['text'] += 'y'
+                        db.update(doc)
+            except Exception as e:
+                errors.append(e)
+
+        ths = [Thread(target=writer, args=(docs[x::4], )) for x in range(4)]
+        for th in ths:
+            th.start()
+        for th in ths:
+            th.join()
+        reclaimer.stop()
+        assert errors == []
+        assert reclaimer.released + reclaimer.reclaim() > 0
+        for doc in docs:
+            assert db.get('id', doc['_id']) == doc
+            assert db.get('with_a', doc['a'], with_doc=True)['doc'] == doc
+        db.close()
@@ -25,7 +25,8 @@ from codernitydb3.database import Database, RecordDeleted, RecordNotFound
 
 from codernitydb3.hash_index import UniqueHashIndex
 
-from codernitydb3.tree_index import TreeBasedIndex
+from codernitydb3.tree_index import TreeBasedIndex, VarTreeBasedIndex
+from codernitydb3.index import IndexException
 
 from codernitydb3.debug_stuff import database_step_by_step
 
@@ -50,6 +51,25 @@ class SimpleTreeIndex(TreeBasedIndex):
         return key
 
 
+class BloomTreeIndex(TreeBasedIndex):
+
+    bloom_capacity = 50
+
+    def __init__(self, *args, **kwargs):
+        kwargs['node_capacity'] = 13
+        kwargs['key_format'] = 'I'
+        super(BloomTreeIndex, self).__init__(*args, **kwargs)
+
+    def make_key_value(self, data):
+        a_val = data.get('a')
+        if a_val is not None:
+            return a_val, None
+        return None
+
+    def make_key(self, key):
+        return key
+
+
 class CustomTreeIndex(TreeBasedIndex):
     def __init__(self, *args, **kwargs):
         kwargs['node_capacity'] = 13
@@ -83,6 +103,40 @@ class EvenCapacityTreeIndex(TreeBasedIndex):
         return key
 
 
+class MmapTreeIndex(TreeBasedIndex):
+
+    mmap_reads = True
+
+    def __init__(self, *args, **kwargs):
+        kwargs['node_capacity'] = 13
+        kwargs['key_format'] = 'I'
+        super(MmapTreeIndex, self).__init__(*args, **kwargs)
+
+    def make_key_value(self, data):
+        a_val = data.get('a')
+        if a_val is not None:
+            return a_val, None
+        return None
+
+    def make_key(self, key):
+        return key
+
+
+class VarKeyTreeIndex(VarTreeBasedIndex):
+    def __init__(self, *args, **kwargs):
+        kwargs['page_size'] = 512
+        super(VarKeyTreeIndex, self).__init__(*args, **kwargs)
+
+    def make_key_value(self, data):
+        s_val = data.get('s')
+        if s_val is not None:
+            return s_val.encode(), {'x': data['x']}
+        return None
+
+    def make_key(self, key):
+        return key.encode()
+
+
 def sort_by_key(list):
     def _comp(a, b):
         return cmp(a['a'], b['a'])
@@ -927,6 +981,28 @@ class TreeIndexTests:
         count_and_check(inserted)
         db.close()
 
+    def test_mmap_reads_random(self, tmpdir, operations):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        id = UniqueHashIndex(db.path, 'id')
+        tree = MmapTreeIndex(db.path, 'tree')
+        db.set_indexes([id, tree])
+        db.create()
+        inserted = {}
+        updated = {}
+
+        def count_and_check(inserted):
+            assert len(inserted) == db.count(db.all, 'tree')
+            inserted_vals = list(inserted.values())
+            sort_by_key(inserted_vals)
+            assert check_if_keys_match(db.all('tree', with_storage=False),
+                                       inserted_vals)
+
+        self.random_database_usage(db, operations, inserted, updated)
+        count_and_check(inserted)
+        db.compact()
+        count_and_check(inserted)
+        db.close()
+
     def test_even_cap_tree_real_life_example_random(self, tmpdir, operations):
         db = self._db(os.path.join(str(tmpdir), 'db'))
         id = UniqueHashIndex(db.path, 'id')
@@ -1487,3 +1563,398 @@ class TreeIndexTests:
         db.insert(dict(a=2))
         assert 20 == db.count(db.get_many, 'tree', 1, limit=-1)
         db.close()
+
+    def test_bloom_filter(self, tmpdir):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes(
+            [UniqueHashIndex(db.path, 'id'),
+             BloomTreeIndex(db.path, 'tree')])
+        db.create()
+        for x in range(100):
+            db.insert(dict(a=x * 2))
+        tree = db.indexes_names['tree']
+        assert tree.bloom is not None
+        assert all(db.key_exists('tree', x * 2) for x in range(100))
+        assert not any(db.key_exists('tree', x * 2 + 1) for x in range(100))
+        assert sum(1 for x in range(100) if x * 2 + 1 not in tree.bloom) > 80
+        assert db.count(db.get_many, 'tree', 4, limit=-1) == 1
+        assert db.count(db.get_many, 'tree', 5, limit=-1) == 0
+        db.close()
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        assert os.path.exists(os.path.join(db.path, 'tree_bloom'))
+        db.compact()
+        assert all(db.key_exists('tree', x * 2) for x in range(100))
+        with pytest.raises(RecordNotFound):
+            db.get('tree', 3)
+        db.close()
+
+    def test_get_multi(self, tmpdir):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes(
+            [UniqueHashIndex(db.path, 'id'),
+             SimpleTreeIndex(db.path, 'tree')])
+        db.create()
+        l = []
+        for x in range(500):
+            c = dict(a=x % 200 * 2, x=x)
+            db.insert(c)
+            l.append(c)
+        # first records of some keys and all records of others
+        for curr in l[:100:3] + l[:50:4] + l[250:300:4] + l[450:500:4]:
+            if '_deleted' not in curr:
+                db.delete(curr)
+
+        def get_or_none(key, **kwargs):
+            try:
+                return db.get('tree', key, **kwargs)
+            except (RecordNotFound, RecordDeleted):
+                return None
+
+        keys = list(range(420)) + [3, 2, 2]
+        random.shuffle(keys)
+        live = {}
+        for c in l:
+            if '_deleted' not in c:
+                live.setdefault(c['a'], []).append(c['_id'])
+        for kwargs in ({}, dict(with_doc=True), dict(with_storage=False)):
+            res = db.get_multi('tree', keys, **kwargs)
+            for key, data in zip(keys, res):
+                if get_or_none(key, **kwargs) is None:
+                    assert data is None
+                else:
+                    # first not deleted record of duplicated key
+                    assert data['key'] == key
+                    assert data['_id'] == live[key][0]
+                    if kwargs:
+                        assert ('doc' in data) == ('with_doc' in kwargs)
+        assert any(res) and not all(res)
+
+        # every leaf is read once
+        tree = db.indexes_names['tree']
+        read = []
+        read_leaf = tree._read_leaf_records
+
+        def counting(leaf_start, nr_of_elements):
+            read.append(leaf_start)
+            return read_leaf(leaf_start, nr_of_elements)
+
+        tree._read_leaf_records = counting
+        tree.get_multi(keys)
+        assert len(read) == len(set(read))
+        assert db.get_multi('tree', []) == []
+        db.close()
+
+    def test_page_cache(self, tmpdir, monkeypatch):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes(
+            [UniqueHashIndex(db.path, 'id'),
+             SimpleTreeIndex(db.path, 'tree')])
+        db.create()
+        tree = db.indexes_names['tree']
+        # room for few pages only, they are evicted all the time
+        tree._pages.max_bytes = 3 * tree.leaf_size
+        l = []
+        for x in range(400):
+            c = dict(a=random.randint(0, 200), x=x)
+            db.insert(c)
+            l.append(c)
+            assert tree._pages.size <= tree._pages.max_bytes
+        for curr in l[::3]:
+            db.delete(curr)
+        for curr in l[1::3]:
+            curr['a'] += 1000
+            db.update(curr)
+        l = [c for c in l if '_deleted' not in c]
+
+        def check():
+            for a in set(c['a'] for c in l):
+                assert db.count(db.get_many, 'tree', a,
+                                limit=-1) == len([c for c in l if c['a'] == a])
+            assert db.count(db.all, 'tree') == len(l)
+            assert db.count(db.get_many, 'tree', start=50, end=150,
+                            limit=-1) == len(
+                                [c for c in l if 50 <= c['a'] <= 150])
+
+        check()
+        tree._pages.max_bytes = 1024 * 1024
+        check()
+        # all pages are in memory now
+        monkeypatch.setattr(tree, '_read_buckets',
+                            lambda *args: pytest.fail(args))
+        check()
+        monkeypatch.undo()
+        db.close()
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        check()
+        db.compact()
+        check()
+        db.close()
+
+    def test_bulk_load(self, tmpdir):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes(
+            [UniqueHashIndex(db.path, 'id'),
+             SimpleTreeIndex(db.path, 'tree')])
+        db.create()
+        l = []
+        for x in range(1000):
+            c = dict(a=random.randint(0, 300), x=x)
+            db.insert(c)
+            l.append(c)
+        for curr in l[::4]:
+            db.delete(curr)
+        l = [c for c in l if '_deleted' not in c]
+        tree = db.indexes_names['tree']
+        # sorted in chunks on disk
+        tree.bulk_sort_chunk = 100
+        tree.bulk_fill_factor = 0.5
+        db.reindex_index('tree')
+        assert tree.root_flag == tree.TYPE_NODE
+        assert [r[1] for r in tree.all()] == sorted(c['a'] for c in l)
+        # records with equal keys stay in order of documents
+        assert [r[0] for r in tree.all()
+                ] == [c['_id'] for c in sorted(l, key=lambda c: c['a'])]
+
+        def check():
+            for a in range(-1, 302):
+                assert db.count(db.get_many, 'tree', a,
+                                limit=-1) == len([c for c in l if c['a'] == a])
+                assert db.count(db.get_many,
+                                'tree',
+                                start=a,
+                                end=a + 10,
+                                limit=-1) == len(
+                                    [c for c in l if a <= c['a'] <= a + 10])
+            assert db.count(db.all, 'tree') == len(l)
+
+        check()
+        for x in range(300):
+            c = dict(a=random.randint(0, 300), x=x)
+            db.insert(c)
+            l.append(c)
+        check()
+        db.compact()
+        check()
+        db.close()
+
+    def test_reverse_range(self, tmpdir):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes(
+            [UniqueHashIndex(db.path, 'id'),
+             SimpleTreeIndex(db.path, 'tree')])
+        db.create()
+        l = []
+        for x in range(500):
+            c = dict(a=random.randint(0, 100), x=x)
+            db.insert(c)
+            l.append(c)
+        for curr in l[::5]:
+            db.delete(curr)
+        l = [c for c in l if '_deleted' not in c]
+        forward = [(r['_id'], r['key']) for r in db.all('tree')]
+        assert [(r['_id'], r['key'])
+                for r in db.all('tree', reverse=True)] == forward[::-1]
+        assert [(r['_id'], r['key'])
+                for r in db.all('tree', limit=5, offset=3, reverse=True)
+                ] == forward[::-1][3:8]
+        ranges = [(10, 50), (-5, 30), (90, 200), (40, 40), (50, None)]
+        for start, end in ranges:
+            ids = [
+                r['_id'] for r in db.get_many(
+                    'tree', start=start, end=end, limit=-1, reverse=True)
+            ]
+            assert ids == [
+                _id for _id, key in forward[::-1]
+                if start <= key and (end is None or key <= end)
+            ]
+            latest = list(
+                db.get_many('tree',
+                            start=start,
+                            end=end,
+                            limit=3,
+                            offset=1,
+                            reverse=True,
+                            inclusive_start=False,
+                            inclusive_end=False))
+            assert [r['_id'] for r in latest] == [
+                _id for _id, key in forward[::-1]
+                if start < key and (end is None or key < end)
+            ][1:4]
+        db.close()
+
+    def test_delete_rebalance(self, tmpdir):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes(
+            [UniqueHashIndex(db.path, 'id'),
+             SimpleTreeIndex(db.path, 'tree')])
+        db.create()
+        rng = random.Random(25)
+        tree = db.indexes_names['tree']
+        buck_path = os.path.join(db.path, 'tree_buck')
+        l = []
+
+        def check():
+            assert [r[1] for r in tree.all()] == sorted(c['a'] for c in l)
+            for a in range(-1, 102, 7):
+                assert db.count(db.get_many, 'tree', a,
+                                limit=-1) == len([c for c in l if c['a'] == a])
+                assert db.count(db.get_many,
+                                'tree',
+                                start=a,
+                                end=a + 20,
+                                limit=-1) == len(
+                                    [c for c in l if a <= c['a'] <= a + 20])
+
+        sizes = []
+        for step in range(3):
+            for x in range(1000):
+                c = dict(a=rng.randint(0, 100), x=x)
+                db.insert(c)
+                l.append(c)
+            check()
+            sizes.append(os.path.getsize(buck_path))
+            rng.shuffle(l)
+            for c in l[100:]:
+                db.delete(c)
+            l = l[:100]
+            check()
+            # deleted records are gone from leaves
+            leaves = 0
+            leaf_start = tree.data_start + tree.node_size
+            while leaf_start:
+                nr_of_elements, prev_leaf, leaf_start = tree._read_leaf_nr_of_elements_and_neighbours(
+                    leaf_start)
+                assert nr_of_elements >= tree.node_capacity // 2
+                leaves += 1
+            assert leaves <= 100 // (tree.node_capacity // 2)
+        # pages freed by deletes were used again
+        assert sizes[-1] < sizes[0] * 1.5
+        for c in l:
+            db.delete(c)
+        l = []
+        check()
+        assert tree.root_flag == tree.TYPE_LEAF
+        free_pages = (tree.free_leaf, tree.free_node)
+        size = os.path.getsize(buck_path)
+        db.close()
+        db.open()
+        tree = db.indexes_names['tree']
+        assert (tree.free_leaf, tree.free_node) == free_pages
+        for x in range(1000):
+            c = dict(a=rng.randint(0, 100), x=x)
+            db.insert(c)
+            l.append(c)
+        check()
+        # at most few pages more than were freed
+        assert os.path.getsize(buck_path) < size * 1.1
+        db.close()
+
+    def test_delete_during_scan(self, tmpdir):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes(
+            [UniqueHashIndex(db.path, 'id'),
+             SimpleTreeIndex(db.path, 'tree')])
+        db.create()
+        tree = db.indexes_names['tree']
+        l = []
+        for x in range(500):
+            c = dict(a=x % 100, x=x)
+            db.insert(c)
+            l.append(c)
+        scan = tree.get_between(20, 60, limit=-1)
+        records = [next(scan)]
+        # leaves are merged and split again, scan starts from the root
+        for c in l[:450]:
+            db.delete(c)
+        for x in range(300):
+            db.insert(dict(a=40 + x % 2, x=x))
+        records.extend(scan)
+        keys = [r[1] for r in records]
+        assert keys[0] == 20
+        assert keys == sorted(keys)
+        assert set(keys[1:]) == set([40, 41] + list(range(50, 61)))
+        assert len(records) == len(set(r[0] for r in records)) == 1 + 300 + 11
+        l = l[450:]
+        # deleted during iteration of the same index
+        for r in db.all('tree'):
+            db.delete(db.get('id', r['_id']))
+        assert db.count(db.all, 'tree') == 0
+        for c in l:
+            db.insert(dict(a=c['a']))
+        assert [r[1] for r in tree.all()] == sorted(c['a'] for c in l)
+        db.close()
+
+    def test_var_tree_index(self, tmpdir):
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.set_indexes(
+            [UniqueHashIndex(db.path, 'id'),
+             VarKeyTreeIndex(db.path, 'var')])
+        db.create()
+        tree = db.indexes_names['var']
+        prefixes = ['', 'user/', 'http://example.com/very/long/path/']
+        l = []
+        for x in range(800):
+            c = dict(s=random.choice(prefixes) + str(random.randint(0, 300)),
+                     x=x)
+            db.insert(c)
+            l.append(c)
+        for curr in l[::4]:
+            db.delete(curr)
+        for curr in l[1::4]:
+            curr['s'] = random.choice(prefixes) + 'upd'
+            curr['x'] += 1000
+            db.update(curr)
+        l = [c for c in l if '_deleted' not in c]
+        with pytest.raises(IndexException):
+            tree.insert(b'0' * 32, b'x' * (tree.max_key_size + 1), 0, 0)
+
+        def check():
+            ordered = sorted(l, key=lambda c: c['s'])
+            assert [r['key'] for r in db.all('var')
+                    ] == [c['s'].encode() for c in ordered]
+            assert [r['key'] for r in db.all('var', reverse=True)
+                    ] == [c['s'].encode() for c in ordered[::-1]]
+            for c in random.sample(l, 50):
+                got = db.get_many('var', c['s'], limit=-1)
+                assert sorted(r['x']
+                              for r in got) == sorted(d['x'] for d in l
+                                                      if d['s'] == c['s'])
+                assert db.get('var', c['s'])['key'] == c['s'].encode()
+            with pytest.raises(RecordNotFound):
+                db.get('var', 'user/missing')
+            for start, end in (('1', '2'), ('user/1', 'user/15'), ('a', 'z')):
+                got = [
+                    r['key']
+                    for r in db.get_many('var', start=start, end=end, limit=-1)
+                ]
+                expected = [
+                    c['s'].encode() for c in ordered if start <= c['s'] <= end
+                ]
+                assert got == expected
+                got = [
+                    r['key'] for r in db.get_many('var',
+                                                  start=start,
+                                                  end=end,
+                                                  limit=5,
+                                                  reverse=True,
+                                                  inclusive_end=False)
+                ]
+                assert got == [
+                    c['s'].encode() for c in ordered[::-1]
+                    if start <= c['s'] < end
+                ][:5]
+
+        check()
+        db.close()
+        db = self._db(os.path.join(str(tmpdir), 'db'))
+        db.open()
+        check()
+        db.compact()
+        check()
+        tree = db.indexes_names['var']
+        tree.bulk_sort_chunk = 100
+        db.reindex_index('var')
+        check()
+        db.close()